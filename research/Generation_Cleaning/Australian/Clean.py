@@ -1,36 +1,28 @@
-import pandas as pd
+import os
+import sys
 
-# Load dataset
-file_path = "wyndham_smartbin_filllevel.csv"  # Replace with the actual file path
-df = pd.read_csv(file_path)
-
-# Convert timestamp column to datetime format
-df["timestamp"] = pd.to_datetime(df["timestamp"], dayfirst=True, errors="coerce")
-
-# Drop rows with missing timestamps
-df = df.dropna(subset=["timestamp"])
-
-# Sort the dataframe by Bin ID and timestamp
-df = df.sort_values(by=["Bin ID", "timestamp"])
-df = df.replace(
-    {"Fullness": {0: 0, 1: 1, 2: 1, 3: 2, 4: 2, 5: 3, 6: 3, 7: 4, 8: 4, 9: 5, 10: 5}}
+sys.path.append(
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "..", "src")
 )
+from Pipeline.cleaning import clean_australian, export_csv
 
-# Extract useful time-based features
-df["year"] = df["timestamp"].dt.year
-df["month"] = df["timestamp"].dt.month
-df["day"] = df["timestamp"].dt.day
-df["day_of_week"] = df["timestamp"].dt.dayofweek
-
-# Compute the change in fullness level (trend indicator) but **DO NOT normalize fullness values**
-df["fullness_change"] = df.groupby("Bin ID")["Fullness"].diff().fillna(0)
-
-# Save the cleaned dataset
-cleaned_file_path = "cleaned_bin_data.csv"
-df.to_csv(cleaned_file_path, index=False)
+# Cleaning runs incrementally into a bin-partitioned Parquet store
+# (src/Pipeline/cleaning.py): only rows added to the raw feed since the last
+# run are read, with typed columns, fixed-format timestamps and the 0-10 to
+# 0-5 fullness remap done with a lookup table
+file_path = "wyndham_smartbin_filllevel.csv"  # Replace with the actual file path
+store_dir = "australian_store"
 
-# Display success message
-print(f"Cleaned dataset saved as: {cleaned_file_path}")
+summary = clean_australian(file_path, store_dir, timestamp_format="%d-%m-%Y")
+print(
+    f"{summary['rows']} new rows cleaned for {summary['bins']} bins "
+    f"in {summary['seconds']}s"
+)
 
-# Display the first few rows
-print(df.head())
+# The model scripts read the store directly; a CSV copy is only written when
+# a path is set here, for code that still reads the CSV
+# (e.g. research/Basic_Model_Research)
+cleaned_file_path = None  # e.g. "cleaned_bin_data.csv"
+if cleaned_file_path:
+    export_csv(store_dir, cleaned_file_path)
+    print(f"Cleaned dataset saved as: {cleaned_file_path}")
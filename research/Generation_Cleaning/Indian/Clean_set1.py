@@ -1,15 +1,20 @@
-import pandas as pd
+import os
+import sys
 
-# Load your data
-df = pd.read_csv("synthetic_mumbai_waste_data.csv")
+sys.path.append(
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "..", "src")
+)
+from Pipeline.cleaning import clean_mumbai
 
-# Convert date column to datetime to group correctly
-df["date"] = pd.to_datetime(df["date"], format="%Y-%m-%d")
+# Cleaning runs incrementally into a bin-partitioned Parquet store
+# (src/Pipeline/cleaning.py): each bin keeps a high-water timestamp, and only
+# readings newer than it are remapped to 0-5 and appended after the bin's
+# stored ones, so the store stays sorted by bin and time without re-sorting
+file_path = "synthetic_mumbai_waste_data.csv"
+store_dir = "mumbai_store"
 
-
-# Sort to ensure proper order of time for each bin per day
-df.sort_values(by=["Bin_ID", "date", "time"], inplace=True)
-
-
-# Optional: Save the cleaned data
-df.to_csv("cleaned_waste_data.csv", index=False)
+summary = clean_mumbai(file_path, store_dir)
+print(
+    f"{summary['rows']} new rows cleaned for {summary['bins']} bins "
+    f"in {summary['seconds']}s ({summary['already_stored']} already stored)"
+)
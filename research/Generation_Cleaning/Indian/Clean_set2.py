@@ -1,26 +1,22 @@
-import pandas as pd
+import os
+import sys
 
-# Load dataset
-file_path = "cleaned_waste_data.csv"  # Replace with the actual file path
-df = pd.read_csv(file_path)
-
-# Convert timestamp column to datetime format
-
-# Drop rows with missing timestamps
-
-# Sort the dataframe by Bin ID and timestamp
-df = df.replace(
-    {"Fullness": {0: 0, 1: 0, 2: 1, 3: 1, 4: 2, 5: 2, 6: 3, 7: 3, 8: 4, 9: 4, 10: 5}}
+sys.path.append(
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "..", "src")
 )
-
-# Compute the change in fullness level (trend indicator) but **DO NOT normalize fullness values**
-
-# Save the cleaned dataset
-cleaned_file_path = "cleaned_bin_data.csv"
-df.to_csv(cleaned_file_path, index=False)
-
-# Display success message
-print(f"Cleaned dataset saved as: {cleaned_file_path}")
+from Pipeline.bin_store import BinStore
+from Pipeline.cleaning import export_csv
+
+# The store written by Clean_set1.py already holds the remapped fullness
+# levels sorted by bin and time, and the model scripts read it directly.
+# A CSV copy is only written when a path is set here, for code that still
+# reads the CSV (e.g. research/Basic_Model_Research)
+store_dir = "mumbai_store"
+store = BinStore(store_dir)
+cleaned_file_path = None  # e.g. "cleaned_bin_data.csv"
+if cleaned_file_path:
+    export_csv(store_dir, cleaned_file_path, dataset="mumbai")
+    print(f"Cleaned dataset saved as: {cleaned_file_path}")
 
 # Display the first few rows
-print(df.head())
+print(store.read_bin(store.bins()[0]).head())
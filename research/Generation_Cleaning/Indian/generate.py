@@ -2,24 +2,28 @@ import random
 import json
 import csv
 import datetime
+import os
+from concurrent.futures import ProcessPoolExecutor
 import pandas as pd
 import numpy as np
 
+from holiday_calendar import HolidayCalendar, day_offsets
+
 # Load the clusters of Mumbai dataset
 
 
-def load_bin_data(csv_path):
+def load_bin_data(csv_path, rng=random):
     df = pd.read_csv(csv_path)
     if "religion_majority" not in df.columns:
         religions = ["hindu", "muslim"]
-        df["religion_majority"] = [random.choice(religions) for _ in range(len(df))]
+        df["religion_majority"] = [rng.choice(religions) for _ in range(len(df))]
     return df
 
 
 # Ensure diversity in religion majority per cluster
 
 
-def ensure_religion_diversity(df):
+def ensure_religion_diversity(df, rng=random):
     updated_df = df.copy()
     for cluster in df["knn_cluster"].unique():
         sub_df = df[df["knn_cluster"] == cluster]
@@ -27,10 +31,10 @@ def ensure_religion_diversity(df):
         muslim_bins = sub_df[sub_df["religion_majority"] == "muslim"]
 
         if len(hindu_bins) == 0:
-            index = sub_df.sample(1).index[0]
+            index = sub_df.sample(1, random_state=rng.randrange(2**32)).index[0]
             updated_df.at[index, "religion_majority"] = "hindu"
         if len(muslim_bins) == 0:
-            index = sub_df.sample(1).index[0]
+            index = sub_df.sample(1, random_state=rng.randrange(2**32)).index[0]
             updated_df.at[index, "religion_majority"] = "muslim"
 
     return updated_df
@@ -39,7 +43,7 @@ def ensure_religion_diversity(df):
 # Define filling rate categories
 
 
-def categorize_bins(df):
+def categorize_bins(df, rng=random):
     clusters = df["knn_cluster"].unique()
     bin_categories = {}
 
@@ -47,7 +51,7 @@ def categorize_bins(df):
         cluster_df = df[df["knn_cluster"] == cluster]
         cluster_size = len(cluster_df)
         cluster_bin_ids = cluster_df["Bin Id's"].tolist()
-        random.shuffle(cluster_bin_ids)
+        rng.shuffle(cluster_bin_ids)
 
         if cluster_size >= 3:
             num_high = max(1, round(cluster_size * 0.25))
@@ -204,20 +208,282 @@ def generate_fill_pattern(
     return fill_pattern
 
 
-def generate_waste_data(csv_path, start_date, end_date, output_file):
-    bin_df = load_bin_data(csv_path)
-    bin_df = ensure_religion_diversity(bin_df)
-    bin_categories = categorize_bins(bin_df)
-    hindu_holidays, islamic_holidays = get_holidays()
+# Vectorized engine: one block of days x bins x 12 slots per call
 
-    bin_info = {}
-    for _, row in bin_df.iterrows():
-        bin_info[row["Bin Id's"]] = {
-            "location": row["Location"],
-            "cluster": row["knn_cluster"],
-            "religion": row["religion_majority"],
+CATEGORY_PARAMS = {
+    "high": {"increment": (0.9, 1.5), "emptying": (4, 5), "holiday": 1.5},
+    "medium": {"increment": (0.5, 0.9), "emptying": (5, 6), "holiday": 1.3},
+    "low": {"increment": (0.2, 0.5), "emptying": (6, 7), "holiday": 1.2},
+}
+SLOT_HOURS = np.arange(12) * 2
+PEAK_SLOTS = np.isin(SLOT_HOURS, [12, 14, 18, 20])
+
+
+def _category_table(categories, key):
+    values = np.array([CATEGORY_PARAMS[category][key] for category in categories])
+    return values.T if values.ndim == 2 else values
+
+
+# Every bin draws from its own stream derived from the master seed and its ID,
+# so a bin's readings do not depend on which shard or worker generates it
+
+
+def bin_rngs(bin_ids, seed=None):
+    master = np.random.SeedSequence(seed)
+    return [
+        np.random.default_rng(np.random.SeedSequence([master.entropy, int(bin_id)]))
+        for bin_id in bin_ids
+    ]
+
+
+def generate_fill_block(
+    categories,
+    clusters,
+    is_hindu_holiday,
+    is_islamic_holiday,
+    is_weekend,
+    prev_fill,
+    rngs,
+):
+    n_days, n_bins = len(is_weekend), len(categories)
+    hours = len(SLOT_HOURS)
+    is_hindu_holiday = np.asarray(is_hindu_holiday, dtype=bool)[:, None]
+    is_islamic_holiday = np.asarray(is_islamic_holiday, dtype=bool)[:, None]
+    is_weekend = np.asarray(is_weekend, dtype=bool)[:, None]
+    clusters = np.asarray(clusters)[None, :]
+
+    increment_low, increment_high = _category_table(categories, "increment")
+    emptying_low, emptying_high = _category_table(categories, "emptying")
+    draws = np.stack([rng.random((n_days, hours + 2)) for rng in rngs], axis=1)
+    base_increment = increment_low + (increment_high - increment_low) * draws[:, :, 0]
+    empty_hour = emptying_low + (
+        draws[:, :, 1] * (emptying_high - emptying_low + 1)
+    ).astype(int)
+    noise = 0.8 + 0.4 * draws[:, :, 2:]
+
+    holiday_multiplier = _category_table(categories, "holiday")[None, :] * np.where(
+        (np.isin(clusters, [0, 3]) & is_islamic_holiday)
+        | (np.isin(clusters, [1, 2]) & is_hindu_holiday),
+        1.2,
+        1.0,
+    )
+    actual_increment = (
+        base_increment
+        * np.where(is_hindu_holiday | is_islamic_holiday, holiday_multiplier, 1.0)
+        * np.where(is_weekend, 1.4, 1.0)
+    )
+    slot_multiplier = np.where(PEAK_SLOTS, 1.2, 1.0) * np.where(
+        PEAK_SLOTS & is_weekend, 1.2, 1.0
+    )
+    hour_increment = actual_increment[:, :, None] * noise * slot_multiplier[:, None, :]
+
+    # The first four slots repeat the previous day's level and the emptying
+    # slot resets it, so neither contributes to the running fill
+    slots = np.arange(hours)
+    hour_increment[:, :, :4] = 0
+    hour_increment[slots == empty_hour[:, :, None]] = 0
+    cumulative = np.cumsum(hour_increment, axis=2)
+    at_empty = np.take_along_axis(cumulative, empty_hour[:, :, None], axis=2)
+
+    # Emptying always happens before the last slot, so the level carried into
+    # the next day depends only on the increments after emptying
+    last_fill = np.clip(np.round(cumulative[:, :, -1] - at_empty[:, :, 0]), 0, 10)
+    prev_day_fill = np.vstack([np.asarray(prev_fill)[None, :], last_fill[:-1]])
+
+    current_fill = np.where(
+        slots < empty_hour[:, :, None],
+        prev_day_fill[:, :, None] + cumulative,
+        cumulative - at_empty,
+    )
+    fills = np.clip(np.round(current_fill), 0, 10).astype(np.int8)
+    return fills, fills[-1, :, -1]
+
+
+def _generate_shard_block(args):
+    fills, last_fill = generate_fill_block(*args)
+    return fills, last_fill, args[-1]
+
+
+def build_block_frame(fills, dates, bin_ids, locations, categories, first_entry_id):
+    n_days, n_bins, hours = fills.shape
+    per_day = n_bins * hours
+    bin_codes = np.tile(np.repeat(np.arange(n_bins), hours), n_days)
+    day_codes = np.repeat(np.arange(n_days), per_day)
+    location_values = pd.Categorical(locations)
+    category_values = pd.Categorical(categories)
+    day_names = pd.Categorical([date.strftime("%A") for date in dates])
+    times = [f"{hour:02d}:00" for hour in SLOT_HOURS]
+
+    return pd.DataFrame(
+        {
+            "entry_ID": np.arange(first_entry_id, first_entry_id + fills.size),
+            "dustbin_id": np.asarray(bin_ids, dtype=np.int64)[bin_codes],
+            "location": pd.Categorical.from_codes(
+                location_values.codes[bin_codes], location_values.categories
+            ),
+            "filled_capacity": fills.ravel(),
+            "date": pd.Categorical.from_codes(
+                day_codes, [date.strftime("%Y-%m-%d") for date in dates]
+            ),
+            "time": pd.Categorical.from_codes(
+                np.tile(np.arange(hours), n_days * n_bins), times
+            ),
+            "day_of_week": pd.Categorical.from_codes(
+                day_names.codes[day_codes], day_names.categories
+            ),
+            "fill_category": pd.Categorical.from_codes(
+                category_values.codes[bin_codes], category_values.categories
+            ),
         }
+    )
+
+
+# The cluster holiday rule reads these two calendars, so any calendar passed
+# in (e.g. HolidayCalendar.from_csv) has to define both of them
+CLUSTER_CALENDARS = ("hindu", "islamic")
+OUTPUT_FORMATS = ("csv", "parquet")
+
+
+def check_calendar(calendar):
+    missing = [name for name in CLUSTER_CALENDARS if name not in calendar.names]
+    if missing:
+        raise ValueError(
+            f"Holiday calendar is missing {missing}; the cluster holiday rule "
+            f"needs calendars named {list(CLUSTER_CALENDARS)} "
+            f"(got {calendar.names})"
+        )
 
+
+def iter_waste_chunks(
+    bin_df,
+    bin_categories,
+    start_date,
+    end_date,
+    calendar,
+    chunk_freq=None,
+    seed=None,
+    workers=1,
+):
+    check_calendar(calendar)
+    dates = pd.date_range(start_date, end_date, freq="D")
+    features = calendar.feature_table(start_date, end_date)
+
+    bin_ids = bin_df["Bin Id's"].tolist()
+    locations = bin_df["Location"].tolist()
+    clusters = bin_df["knn_cluster"].to_numpy()
+    categories = [bin_categories[bin_id] for bin_id in bin_ids]
+    rngs = bin_rngs(bin_ids, seed)
+    shards = np.array_split(np.arange(len(bin_ids)), max(1, min(workers, len(bin_ids))))
+
+    if chunk_freq is None:
+        chunks = [dates]
+    else:
+        chunks = [
+            chunk.index
+            for _, chunk in dates.to_series().groupby(dates.to_period(chunk_freq))
+        ]
+
+    # Only the last fill level of each bin is carried from one chunk to the next
+    last_fill = np.zeros(len(bin_ids))
+    entry_id = 1
+    pool = ProcessPoolExecutor(max_workers=len(shards)) if len(shards) > 1 else None
+    try:
+        for chunk_dates in chunks:
+            chunk_features = features.iloc[day_offsets(chunk_dates, start_date)]
+            tasks = [
+                (
+                    [categories[i] for i in shard],
+                    clusters[shard],
+                    chunk_features["hindu"].to_numpy(),
+                    chunk_features["islamic"].to_numpy(),
+                    chunk_features["weekend"].to_numpy(),
+                    last_fill[shard],
+                    [rngs[i] for i in shard],
+                )
+                for shard in shards
+            ]
+            results = list(
+                pool.map(_generate_shard_block, tasks)
+                if pool
+                else map(_generate_shard_block, tasks)
+            )
+
+            # Shards are contiguous bin ranges, so concatenating them in order
+            # restores the serial row layout regardless of the worker count
+            fills = np.concatenate(
+                [shard_fills for shard_fills, _, _ in results], axis=1
+            )
+            last_fill = np.concatenate([shard_last for _, shard_last, _ in results])
+            for shard, (_, _, shard_rngs) in zip(shards, results):
+                for i, rng in zip(shard, shard_rngs):
+                    rngs[i] = rng
+
+            yield build_block_frame(
+                fills, chunk_dates, bin_ids, locations, categories, entry_id
+            )
+            entry_id += fills.size
+    finally:
+        if pool:
+            pool.shutdown()
+
+
+def generate_waste_frame(
+    bin_df,
+    bin_categories,
+    start_date,
+    end_date,
+    calendar,
+    seed=None,
+):
+    return next(
+        iter_waste_chunks(
+            bin_df,
+            bin_categories,
+            start_date,
+            end_date,
+            calendar,
+            seed=seed,
+        )
+    )
+
+
+# Streaming writers: each chunk is flushed before the next one is generated
+
+
+def write_waste_chunks(chunks, output_file, output_format="csv"):
+    total = 0
+    if output_format == "parquet":
+        os.makedirs(output_file, exist_ok=True)
+
+    for index, chunk in enumerate(chunks):
+        if output_format == "csv":
+            chunk.to_csv(
+                output_file,
+                mode="w" if index == 0 else "a",
+                header=index == 0,
+                index=False,
+            )
+        elif output_format == "parquet":
+            partition = os.path.join(output_file, f"start={chunk['date'].iloc[0]}")
+            os.makedirs(partition, exist_ok=True)
+            chunk.to_parquet(os.path.join(partition, "part-0.parquet"), index=False)
+        else:
+            raise ValueError(
+                f"Unknown output format '{output_format}', expected 'csv' or 'parquet'"
+            )
+        total += len(chunk)
+
+    return total
+
+
+def generate_waste_rows(
+    bin_df,
+    bin_categories,
+    bin_info,
+    start_date,
+    end_date,
+    calendar,
+):
     data = []
     current_date = start_date
     entry_id = 1
@@ -225,8 +491,8 @@ def generate_waste_data(csv_path, start_date, end_date, output_file):
     while current_date <= end_date:
         date_str = current_date.strftime("%Y-%m-%d")
         day_of_week = current_date.strftime("%A")
-        is_hindu_holiday = is_holiday(date_str, hindu_holidays)
-        is_islamic_holiday = is_holiday(date_str, islamic_holidays)
+        is_hindu_holiday = calendar.is_holiday("hindu", current_date)
+        is_islamic_holiday = calendar.is_holiday("islamic", current_date)
 
         for _, row in bin_df.iterrows():
             bin_id = row["Bin Id's"]
@@ -265,9 +531,86 @@ def generate_waste_data(csv_path, start_date, end_date, output_file):
 
         current_date += datetime.timedelta(days=1)
 
-    df = pd.DataFrame(data)
-    df.to_csv(output_file, index=False)
-    print(f"Data generation complete. {len(data)} entries saved to '{output_file}'.")
+    return data
+
+
+def generate_waste_data(
+    csv_path,
+    start_date,
+    end_date,
+    output_file,
+    engine="loop",
+    chunk_freq=None,
+    output_format="csv",
+    seed=None,
+    workers=1,
+    calendar=None,
+):
+    # Options are checked before any bin is set up or any data generated
+    if output_format not in OUTPUT_FORMATS:
+        raise ValueError(
+            f"Unknown output format '{output_format}', expected 'csv' or 'parquet'"
+        )
+    if engine not in ("loop", "numpy"):
+        raise ValueError(f"Unknown engine '{engine}', expected 'loop' or 'numpy'")
+    if (chunk_freq is not None or workers > 1) and engine != "numpy":
+        raise ValueError(
+            "Chunked and parallel output are only supported by the 'numpy' engine"
+        )
+    if calendar is not None:
+        check_calendar(calendar)
+
+    # Bin setup runs in this process from a seeded stream; the fill patterns
+    # themselves use per-bin streams (numpy) or the global module (loop)
+    rng = random.Random(seed)
+    if engine == "loop" and seed is not None:
+        random.seed(seed)
+    bin_df = load_bin_data(csv_path, rng)
+    bin_df = ensure_religion_diversity(bin_df, rng)
+    bin_categories = categorize_bins(bin_df, rng)
+    if calendar is None:
+        hindu_holidays, islamic_holidays = get_holidays()
+        calendar = HolidayCalendar(
+            {"hindu": hindu_holidays, "islamic": islamic_holidays}
+        )
+
+    bin_info = {}
+    for _, row in bin_df.iterrows():
+        bin_info[row["Bin Id's"]] = {
+            "location": row["Location"],
+            "cluster": row["knn_cluster"],
+            "religion": row["religion_majority"],
+        }
+
+    if engine == "numpy":
+        chunks = iter_waste_chunks(
+            bin_df,
+            bin_categories,
+            start_date,
+            end_date,
+            calendar,
+            chunk_freq=chunk_freq,
+            seed=seed,
+            workers=workers,
+        )
+    elif engine == "loop":
+        chunks = [
+            pd.DataFrame(
+                generate_waste_rows(
+                    bin_df,
+                    bin_categories,
+                    bin_info,
+                    start_date,
+                    end_date,
+                    calendar,
+                )
+            )
+        ]
+    else:
+        raise ValueError(f"Unknown engine '{engine}', expected 'loop' or 'numpy'")
+
+    total = write_waste_chunks(chunks, output_file, output_format)
+    print(f"Data generation complete. {total} entries saved to '{output_file}'.")
 
     print("\nBin Category Distribution by Cluster:")
     cluster_stats = {
@@ -291,4 +634,5 @@ if __name__ == "__main__":
         start_date=start_date,
         end_date=end_date,
         output_file="synthetic_mumbai_waste_data.csv",
+        engine="loop",
     )
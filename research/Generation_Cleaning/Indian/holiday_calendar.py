@@ -0,0 +1,72 @@
+import numpy as np
+import pandas as pd
+
+# Date-indexed holiday calendar shared by the generator and the forecasting
+# models. Holidays are stored as sorted datetime64[D] arrays per calendar, and
+# feature_table() turns them into one row per day for a whole date range.
+
+
+def _to_days(dates):
+    return np.unique(pd.to_datetime(list(dates)).values.astype("datetime64[D]"))
+
+
+def day_offsets(dates, start_date):
+    dates = pd.to_datetime(dates).values.astype("datetime64[D]")
+    return (dates - np.datetime64(pd.Timestamp(start_date).date(), "D")).astype(int)
+
+
+class HolidayCalendar:
+    def __init__(self, holidays=None):
+        self._days = {}
+        self._lookup = {}
+        for name, dates in (holidays or {}).items():
+            self.add(name, dates)
+
+    @classmethod
+    def from_csv(cls, csv_path, date_column="date", calendar_column="calendar"):
+        df = pd.read_csv(csv_path)
+        calendar = cls()
+        for name, group in df.groupby(calendar_column):
+            calendar.add(name, group[date_column])
+        return calendar
+
+    @property
+    def names(self):
+        return list(self._days)
+
+    def add(self, name, dates):
+        days = _to_days(dates)
+        if name in self._days:
+            days = np.union1d(self._days[name], days)
+        self._days[name] = days
+        self._lookup[name] = set(days.tolist())
+        return self
+
+    def is_holiday(self, name, date):
+        return pd.Timestamp(date).date() in self._lookup.get(name, ())
+
+    def flags(self, name, start_date, end_date):
+        start = np.datetime64(pd.Timestamp(start_date).date(), "D")
+        n_days = (np.datetime64(pd.Timestamp(end_date).date(), "D") - start).astype(
+            int
+        ) + 1
+        flags = np.zeros(n_days, dtype=bool)
+        offsets = (self._days.get(name, np.array([], "datetime64[D]")) - start).astype(
+            int
+        )
+        flags[offsets[(offsets >= 0) & (offsets < n_days)]] = True
+        return flags
+
+    def feature_table(self, start_date, end_date):
+        dates = pd.date_range(start_date, end_date, freq="D", name="date")
+        table = pd.DataFrame(
+            {
+                "day_offset": np.arange(len(dates), dtype=np.int32),
+                "day_of_week": dates.dayofweek.astype(np.int8),
+                "weekend": dates.dayofweek >= 5,
+            },
+            index=dates,
+        )
+        for name in self._days:
+            table[name] = self.flags(name, start_date, end_date)
+        return table
@@ -1,3 +1,5 @@
+import os
+import sys
 import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
@@ -9,25 +11,19 @@ from sklearn.metrics import mean_squared_error
 from sklearn.metrics import mean_absolute_error
 from sklearn.metrics import mean_absolute_percentage_error
 
-# Load resampled dataset
-df = pd.read_csv(
-    "/content/sample_data/cleaned_bin_data_new.csv", parse_dates=["timestamp"]
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".."))
+from Pipeline.bin_store import open_bin_store
+from Pipeline.rollout import recursive_forecast
+from Pipeline.windows import window_dataset
+
+# Load resampled dataset from the per-bin columnar store, built from the CSV on
+# the first run
+store = open_bin_store(
+    "/content/sample_data/cleaned_bin_data_new.csv", "bin_store", "australian"
 )
 
 # Select bins for forecasting
 bins_to_forecast = [1511208, 1511199, 1510830]
-df = df[df["Bin ID"].isin(bins_to_forecast)]
-
-# Filter data up to a specific date
-train_data = df[df["timestamp"] <= "2021-04-26"]
-
-
-def prepare_data(series, time_steps=10):
-    X, y = [], []
-    for i in range(len(series) - time_steps):
-        X.append(series[i : i + time_steps])
-        y.append(series[i + time_steps])
-    return np.array(X), np.array(y)
 
 
 results_es_lstm = {}
@@ -45,8 +41,8 @@ def smape(y_true, y_pred):
 
 
 for bin_id in bins_to_forecast:
-    bin_train = train_data[train_data["Bin ID"] == bin_id].sort_values(by="timestamp")
-    bin_train.set_index("timestamp", inplace=True)
+    bin_full = store.read_bin(bin_id, columns=["Fullness"])
+    bin_train = bin_full[bin_full.index <= "2021-04-26"]
 
     # Exponential Smoothing
     es_model = ExponentialSmoothing(
@@ -64,8 +60,9 @@ for bin_id in bins_to_forecast:
     residuals_scaled = scaler.fit_transform(residuals.values.reshape(-1, 1))
 
     time_steps = 10
-    X_train, y_train = prepare_data(residuals_scaled, time_steps)
-    X_train = X_train.reshape((X_train.shape[0], time_steps, 1))
+    train_windows = window_dataset(
+        {bin_id: residuals_scaled}, time_steps, batch_size=32
+    )
 
     # LSTM model on residuals
     model = Sequential(
@@ -83,15 +80,12 @@ for bin_id in bins_to_forecast:
         ]
     )
     model.compile(optimizer="adam", loss="mse")
-    model.fit(X_train, y_train, epochs=100, batch_size=32, verbose=0)
+    model.fit(train_windows, shuffle=False, epochs=100, verbose=0)
 
     # Predict residuals for next 7 days
-    predictions = []
-    last_sequence = residuals_scaled[-time_steps:].reshape(1, time_steps, 1)
-    for _ in range(7):
-        pred = model.predict(last_sequence, verbose=0)
-        predictions.append(pred[0, 0])
-        last_sequence = np.append(last_sequence[:, 1:, :], [[[pred[0, 0]]]], axis=1)
+    predictions = recursive_forecast(
+        model, residuals_scaled[-time_steps:].reshape(1, time_steps), 7
+    )[0]
 
     residual_predictions = scaler.inverse_transform(
         np.array(predictions).reshape(-1, 1)
@@ -107,9 +101,6 @@ for bin_id in bins_to_forecast:
     )
 
     # Actual data alignment
-    bin_full = (
-        df[df["Bin ID"] == bin_id].sort_values(by="timestamp").set_index("timestamp")
-    )
     daily_actual = (
         bin_full["Fullness"]
         .resample("D")
@@ -1,39 +1,76 @@
+import os
+import sys
 import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
 from statsmodels.tsa.holtwinters import ExponentialSmoothing
-from statsmodels.tsa.statespace.sarimax import SARIMAX
 from sklearn.metrics import mean_squared_error
 from sklearn.metrics import mean_absolute_error
 
-# Load data
-df = pd.read_csv("cleaned_bin_data.csv", parse_dates=["timestamp"])
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".."))
+from Pipeline.bin_store import open_cleaned_store
+from Pipeline.forecast_cache import ForecastCache, forecast_key
+from Pipeline.model_store import SarimaModelStore, fit_sarima_warm, model_key
+
+# Load data from the per-bin columnar store that Clean.py keeps up to date
+store = open_cleaned_store("australian_store")
 bins_to_forecast = [1511208, 1511199, 1510830]
-df = df[df["Bin ID"].isin(bins_to_forecast)]
-train_data = df[df["timestamp"] <= "2021-04-26"]
+
+# Fitted SARIMA models are kept between runs and extended with new days
+sarima_store = SarimaModelStore("sarima_store")
+
+# Forecasts of unchanged bins are served from disk instead of refitted
+forecast_cache = ForecastCache("forecast_cache")
 
 results_es_sarima = {}
 results_es_sarima_mae = {}
 
 for bin_id in bins_to_forecast:
-    bin_train = train_data[train_data["Bin ID"] == bin_id].sort_values("timestamp")
-    bin_train.set_index("timestamp", inplace=True)
+    bin_full = store.read_bin(bin_id, columns=["Fullness"])
+    bin_train = bin_full[bin_full.index <= "2021-04-26"]
 
-    # Exponential Smoothing
-    es_model = ExponentialSmoothing(
-        bin_train["Fullness"], trend="add", seasonal="add", seasonal_periods=7
+    # Reuse the forecast if this bin's training data and models are unchanged
+    cache_key = forecast_key(
+        bin_train["Fullness"],
+        "es_sarima",
+        es_trend="add",
+        es_seasonal_periods=7,
+        order=(1, 0, 1),
+        seasonal_order=(1, 1, 1, 35),
+        steps=7,
     )
-    es_fit = es_model.fit()
-    es_forecast = es_fit.forecast(7)
+    cached = forecast_cache.load(cache_key)
+    if cached is None:
+        # Exponential Smoothing
+        es_model = ExponentialSmoothing(
+            bin_train["Fullness"], trend="add", seasonal="add", seasonal_periods=7
+        )
+        es_fit = es_model.fit()
+        es_forecast = es_fit.forecast(7)
 
-    # SARIMA on residuals
-    residuals = bin_train["Fullness"] - es_fit.fittedvalues
-    sarima_model = SARIMAX(residuals, order=(1, 0, 1), seasonal_order=(1, 1, 1, 35))
-    sarima_fit = sarima_model.fit()
-    residual_forecast = sarima_fit.forecast(7)
+        # SARIMA on residuals
+        residuals = bin_train["Fullness"] - es_fit.fittedvalues
+        sarima_fit = fit_sarima_warm(
+            sarima_store,
+            model_key("es_residuals", bin_id, (1, 0, 1), (1, 1, 1, 35)),
+            residuals,
+            order=(1, 0, 1),
+            seasonal_order=(1, 1, 1, 35),
+            refit_every=7,
+        )
+        residual_forecast = sarima_fit.forecast(7)
+        # Same entry layout as ES_SARIMA_LSTM.py, which shares these entries
+        cached = forecast_cache.save(
+            cache_key,
+            {
+                "es_forecast": np.asarray(es_forecast),
+                "residual_forecast": np.asarray(residual_forecast),
+                "residuals": np.asarray(residuals - sarima_fit.fittedvalues),
+            },
+        )
 
     # Hybrid forecast
-    hybrid_forecast = es_forecast.values + residual_forecast.values
+    hybrid_forecast = cached["es_forecast"] + cached["residual_forecast"]
 
     # Date alignment
     last_actual_date = bin_train.index[-1]
@@ -42,9 +79,6 @@ for bin_id in bins_to_forecast:
     )
 
     # Actual data
-    bin_full = (
-        df[df["Bin ID"] == bin_id].sort_values("timestamp").set_index("timestamp")
-    )
     daily_actual = (
         bin_full["Fullness"]
         .resample("D")
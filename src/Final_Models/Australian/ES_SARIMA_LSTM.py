@@ -1,85 +1,111 @@
+import os
+import sys
 import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
 from statsmodels.tsa.holtwinters import ExponentialSmoothing
-from statsmodels.tsa.statespace.sarimax import SARIMAX
 from sklearn.metrics import mean_squared_error, mean_absolute_error
-from sklearn.preprocessing import MinMaxScaler
-from tensorflow.keras.models import Sequential
-from tensorflow.keras.layers import LSTM, Dense
-
-# Load data
-df = pd.read_csv("cleaned_bin_data.csv", parse_dates=["timestamp"])
-bins_to_forecast = [1511208, 1511194, 1511191]
-df = df[df["Bin ID"].isin(bins_to_forecast)]
-train_data = df[df["timestamp"] <= "2021-04-26"]
-
-results_df = pd.DataFrame(columns=["Bin ID", "RMSE", "MAE"])
-
-# LSTM helper function
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".."))
+from Pipeline.bin_store import open_cleaned_store
+from Pipeline.forecast_cache import ForecastCache, forecast_key
+from Pipeline.global_lstm import GlobalResidualLSTM
+from Pipeline.model_store import SarimaModelStore, fit_sarima_warm, model_key
 
-def lstm_forecast(residual_series, forecast_days=7):
-    scaler = MinMaxScaler()
-    residual_scaled = scaler.fit_transform(residual_series.values.reshape(-1, 1))
-
-    # Prepare data for LSTM
-    X, y = [], []
-    seq_len = 7
-    for i in range(len(residual_scaled) - seq_len):
-        X.append(residual_scaled[i : i + seq_len])
-        y.append(residual_scaled[i + seq_len])
-    X, y = np.array(X), np.array(y)
-
-    # LSTM model
-    model = Sequential()
-    model.add(LSTM(32, activation="relu", input_shape=(seq_len, 1)))
-    model.add(Dense(1))
-    model.compile(loss="mse", optimizer="adam")
-
-    model.fit(X, y, epochs=50, batch_size=8, verbose=0)
+# Load data from the per-bin columnar store that Clean.py keeps up to date
+store = open_cleaned_store("australian_store")
+bins_to_forecast = [1511208, 1511194, 1511191]
 
-    # Forecast next 7 days
-    pred_input = residual_scaled[-seq_len:].reshape(1, seq_len, 1)
-    forecasts = []
-    for _ in range(forecast_days):
-        pred = model.predict(pred_input, verbose=0)[0][0]
-        forecasts.append(pred)
-        pred_input = np.append(pred_input[:, 1:, :], [[[pred]]], axis=1)
+# Fitted SARIMA models are kept between runs and extended with new days
+sarima_store = SarimaModelStore("sarima_store")
 
-    forecasts = scaler.inverse_transform(np.array(forecasts).reshape(-1, 1)).flatten()
-    return forecasts
+# Forecasts of unchanged bins are served from disk instead of refitted
+forecast_cache = ForecastCache("forecast_cache")
 
+results_df = pd.DataFrame(columns=["Bin ID", "RMSE", "MAE"])
 
 # Main Forecast Loop
-for bin_id in bins_to_forecast:
-    bin_train = train_data[train_data["Bin ID"] == bin_id].sort_values("timestamp")
-    bin_train.set_index("timestamp", inplace=True)
+es_sarima_forecasts, residuals_by_bin, bin_trains = {}, {}, {}
 
-    # Exponential Smoothing (ES)
-    es_model = ExponentialSmoothing(
-        bin_train["Fullness"], trend="add", seasonal="add", seasonal_periods=7
+for bin_id in bins_to_forecast:
+    bin_full = store.read_bin(bin_id, columns=["Fullness"])
+    bin_train = bin_full[bin_full.index <= "2021-04-26"]
+    bin_trains[bin_id] = bin_train
+
+    # Reuse the ES + SARIMA stage if this bin's training data is unchanged
+    cache_key = forecast_key(
+        bin_train["Fullness"],
+        "es_sarima",
+        es_trend="add",
+        es_seasonal_periods=7,
+        order=(1, 0, 1),
+        seasonal_order=(1, 1, 1, 35),
+        steps=7,
     )
-    es_fit = es_model.fit()
-    es_forecast = es_fit.forecast(7)
-
-    # SARIMA on residuals of ES
-    residuals_es = bin_train["Fullness"] - es_fit.fittedvalues
-    sarima_model = SARIMAX(residuals_es, order=(1, 0, 1), seasonal_order=(1, 1, 1, 35))
-    sarima_fit = sarima_model.fit()
-    sarima_forecast = sarima_fit.forecast(7)
+    cached = forecast_cache.load(cache_key)
+    if cached is None:
+        # Exponential Smoothing (ES)
+        es_model = ExponentialSmoothing(
+            bin_train["Fullness"], trend="add", seasonal="add", seasonal_periods=7
+        )
+        es_fit = es_model.fit()
+        es_forecast = es_fit.forecast(7)
+
+        # SARIMA on residuals of ES
+        residuals_es = bin_train["Fullness"] - es_fit.fittedvalues
+        sarima_fit = fit_sarima_warm(
+            sarima_store,
+            model_key("es_residuals", bin_id, (1, 0, 1), (1, 1, 1, 35)),
+            residuals_es,
+            order=(1, 0, 1),
+            seasonal_order=(1, 1, 1, 35),
+            refit_every=7,
+        )
+        sarima_forecast = sarima_fit.forecast(7)
+        # Same entry layout as ES_SARIMA.py, which shares these entries
+        cached = forecast_cache.save(
+            cache_key,
+            {
+                "es_forecast": np.asarray(es_forecast),
+                "residual_forecast": np.asarray(sarima_forecast),
+                "residuals": np.asarray(residuals_es - sarima_fit.fittedvalues),
+            },
+        )
 
     # Hybrid forecast: ES + SARIMA
-    hybrid_forecast_es_sarima = es_forecast.values + sarima_forecast.values
+    es_sarima_forecasts[bin_id] = cached["es_forecast"] + cached["residual_forecast"]
 
     # Residuals after SARIMA
-    residuals_sarima = residuals_es - sarima_fit.fittedvalues
+    residuals_by_bin[bin_id] = cached["residuals"]
+
+# LSTM forecast on SARIMA residuals, one model shared by all bins; it is only
+# retrained when some bin's residuals or the LSTM settings changed
+lstm_key = forecast_key(
+    residuals_by_bin, "residual_lstm", time_steps=7, units=32, epochs=50, steps=7
+)
+lstm_cached = forecast_cache.load(lstm_key)
+if lstm_cached is None:
+    lstm_model = GlobalResidualLSTM(7, units=32, optimizer="adam")
+    lstm_model.fit(residuals_by_bin, epochs=50, batch_size=256)
+    lstm_cached = forecast_cache.save(
+        lstm_key,
+        {str(bin_id): f for bin_id, f in lstm_model.forecast(7).items()},
+    )
+lstm_residual_forecasts = {
+    bin_id: lstm_cached[str(bin_id)]
+    for bin_id in residuals_by_bin
+    if str(bin_id) in lstm_cached
+}
 
-    # LSTM forecast on SARIMA residuals
-    lstm_residual_forecast = lstm_forecast(residuals_sarima, 7)
+for bin_id in bins_to_forecast:
+    if bin_id not in lstm_residual_forecasts:
+        continue
+    bin_train = bin_trains[bin_id]
 
     # Final Hybrid Forecast (ES + SARIMA + LSTM residual correction)
-    final_hybrid_forecast = hybrid_forecast_es_sarima + lstm_residual_forecast
+    final_hybrid_forecast = (
+        es_sarima_forecasts[bin_id] + lstm_residual_forecasts[bin_id]
+    )
 
     # Dates for predictions
     last_date = bin_train.index[-1]
@@ -88,9 +114,7 @@ for bin_id in bins_to_forecast:
     )
 
     # Actual values for evaluation
-    bin_full = (
-        df[df["Bin ID"] == bin_id].sort_values("timestamp").set_index("timestamp")
-    )
+    bin_full = store.read_bin(bin_id, columns=["Fullness"])
     daily_actual = (
         bin_full["Fullness"]
         .resample("D")
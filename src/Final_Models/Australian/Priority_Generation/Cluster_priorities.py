@@ -0,0 +1,220 @@
+import os
+import sys
+import argparse
+import numpy as np
+import pandas as pd
+
+sys.path.append(
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "..")
+)
+from Pipeline.bin_store import open_cleaned_store
+from Pipeline.clusters import cluster_of, load_pipeline_config
+from Pipeline.global_lstm import GlobalResidualLSTM
+from Pipeline.model_selection import cached_models, group_by_model
+from Pipeline.sarima_service import fit_sarima_batch
+from Pipeline.snapshot import publish_snapshot
+
+# SARIMA + residual LSTM priorities for every cluster in one run. Clusters and
+# model settings come from a JSON config (clusters.json by default); the data
+# is loaded once, the SARIMA fits for all bins run in parallel against the
+# shared sarima_store/, and one residual LSTM embedded by cluster is trained
+# for all bins instead of one network per bin.
+
+
+def bucket_priorities(values):
+    # Split the cluster's range of predicted fullness into five equal
+    # intervals, 1 = emptiest and 5 = fullest
+    min_val, max_val = values.min(), values.max()
+    if max_val == min_val:
+        return pd.Series(3, index=values.index)
+    interval = (max_val - min_val) / 5
+    return ((values - min_val) // interval + 1).clip(upper=5).astype(int)
+
+
+# The SARIMA stage runs in worker processes, so everything below only runs
+# when the file is executed directly and not when a worker re-imports it
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Per-cluster bin priorities")
+    parser.add_argument(
+        "--config",
+        default=os.path.join(
+            os.path.dirname(os.path.abspath(__file__)), "clusters.json"
+        ),
+    )
+    args = parser.parse_args()
+
+    config = load_pipeline_config(args.config)
+    clusters = config["clusters"]
+    sarima_config = config["sarima"]
+    lstm_config = config["lstm"]
+    horizon = config.get("horizon", 1)
+
+    # Load every bin once, whichever clusters it belongs to
+    store = open_cleaned_store(config["store"])
+    bin_series, train_series = {}, {}
+    for bin_id in cluster_of(clusters):
+        if bin_id not in store:
+            print(f"Skipping Bin {bin_id}: not in {config['store']}")
+            continue
+        bin_series[bin_id] = store.series(bin_id)
+        train_series[bin_id] = bin_series[bin_id][
+            bin_series[bin_id].index <= config["train_end"]
+        ].astype(float)
+
+    # --- SARIMA (all bins of all clusters in parallel) ---
+    # With "order": "auto" the seasonal period and orders are chosen per
+    # cluster from the data (Pipeline/model_selection.py) and cached in
+    # order_cache, so only new or changed clusters are searched
+    default_model = (
+        (1, 1, 1),
+        tuple(sarima_config.get("seasonal_order", (1, 1, 1, 7))),
+    )
+    if sarima_config["order"] == "auto":
+        fitted_clusters = {
+            cluster: [bin_id for bin_id in bin_ids if bin_id in train_series]
+            for cluster, bin_ids in clusters.items()
+        }
+        models = cached_models(
+            {
+                cluster: {bin_id: train_series[bin_id].values for bin_id in bin_ids}
+                for cluster, bin_ids in fitted_clusters.items()
+                if bin_ids
+            },
+            sarima_config.get("order_cache", "sarima_orders.json"),
+            max_age_days=sarima_config.get("max_age_days", 30),
+            workers=sarima_config.get("workers"),
+            criterion=sarima_config.get("criterion", "aic"),
+        )
+        for cluster, entry in models.items():
+            print(
+                f"Cluster {cluster}: SARIMA{tuple(entry['order'])}"
+                f"x{tuple(entry['seasonal_order'])}"
+            )
+        batches = group_by_model(models, fitted_clusters, default_model)
+    else:
+        batches = {
+            (tuple(sarima_config["order"]), default_model[1]): list(train_series)
+        }
+
+    # The daily readings have gaps, so the models are fit on the values alone
+    print("Fitting SARIMA models for all bins...")
+    sarima_results = {}
+    for (order, seasonal_order), batch_bins in batches.items():
+        sarima_results.update(
+            fit_sarima_batch(
+                {bin_id: train_series[bin_id].values for bin_id in batch_bins},
+                forecast_steps=horizon,
+                order=order,
+                seasonal_order=seasonal_order,
+                workers=sarima_config.get("workers"),
+                timeout=sarima_config.get("timeout"),
+                store_dir="sarima_store",
+                store_tag="cluster_priorities",
+                refit_every=sarima_config.get("refit_every"),
+            )
+        )
+
+    residuals_by_bin = {}
+    for bin_id, train in train_series.items():
+        sarima_result = sarima_results[bin_id]
+        if sarima_result["status"] != "ok":
+            print(f"Error processing Bin {bin_id}: {sarima_result['error']}")
+            continue
+        # A diverged fit would put inf or NaN into the shared LSTM's scalers
+        residuals = train.values - sarima_result["fitted"]
+        if (
+            not np.isfinite(sarima_result["forecast"]).all()
+            or not np.isfinite(residuals).all()
+        ):
+            print(f"Skipping Bin {bin_id}: SARIMA fit is not finite")
+            continue
+        residuals_by_bin[bin_id] = residuals
+
+    # --- One LSTM on the residuals of all bins, embedded by cluster ---
+    print("Training residual LSTM for all bins...")
+    lstm_model = GlobalResidualLSTM(
+        lstm_config["time_steps"],
+        units=lstm_config.get("units", 50),
+        groups=cluster_of(clusters),
+    )
+    lstm_model.fit(
+        residuals_by_bin,
+        epochs=lstm_config.get("epochs", 50),
+        batch_size=lstm_config.get("batch_size", 256),
+    )
+    lstm_residual_forecasts = lstm_model.forecast(horizon)
+
+    results = []
+    hybrid_forecasts = {}
+    for cluster, bin_ids in clusters.items():
+        for bin_id in bin_ids:
+            if bin_id not in lstm_residual_forecasts:
+                continue
+            hybrid_forecast = (
+                sarima_results[bin_id]["forecast"][:horizon]
+                + lstm_residual_forecasts[bin_id]
+            )
+            if not np.isfinite(hybrid_forecast).all():
+                print(f"Skipping Bin {bin_id}: hybrid forecast is not finite")
+                continue
+            hybrid_forecasts[bin_id] = hybrid_forecast
+            prediction_date = train_series[bin_id].index[-1] + pd.Timedelta(
+                days=horizon
+            )
+            actual_value = (
+                bin_series[bin_id]
+                .resample("D")
+                .last()
+                .reindex([prediction_date])
+                .ffill()
+                .bfill()
+                .values[0]
+            )
+            results.append(
+                {
+                    "Cluster": cluster,
+                    "Bin ID": bin_id,
+                    "Date": prediction_date,
+                    "Actual Fullness": actual_value,
+                    "Predicted Fullness": hybrid_forecast[-1],
+                }
+            )
+
+    result_df = pd.DataFrame(results)
+    if result_df.empty:
+        sys.exit("No bin could be forecast")
+
+    # Priority calculation, within each cluster
+    result_df["Priority"] = result_df.groupby("Cluster")[
+        "Predicted Fullness"
+    ].transform(bucket_priorities)
+
+    output = config.get("output", "cluster_priorities.csv")
+    result_df.to_csv(output, index=False)
+    print(f"\nPriorities for {len(result_df)} bins exported to {output}")
+
+    # Latest forecasts and priorities for the query API (Pipeline/priority_api.py)
+    snapshot_path = config.get("snapshot", os.path.join("snapshots", "priorities.npz"))
+    publish_snapshot(
+        snapshot_path,
+        result_df.rename(
+            columns={
+                "Bin ID": "bin_id",
+                "Cluster": "cluster",
+                "Predicted Fullness": "score",
+                "Priority": "priority",
+            }
+        ),
+        hybrid_forecasts,
+        {bin_id: train_series[bin_id].index[-1] for bin_id in hybrid_forecasts},
+        pd.Timedelta(days=1),
+    )
+    print(f"Snapshot published to {snapshot_path}")
+
+    for cluster, cluster_df in result_df.groupby("Cluster", sort=False):
+        print(f"\nCluster {cluster} ({len(cluster_df)} bins):")
+        print(
+            cluster_df[
+                ["Bin ID", "Date", "Actual Fullness", "Predicted Fullness", "Priority"]
+            ].to_string(index=False)
+        )
@@ -1,41 +1,73 @@
+import os
+import sys
 import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
 from statsmodels.tsa.holtwinters import ExponentialSmoothing
-from statsmodels.tsa.statespace.sarimax import SARIMAX
 from sklearn.metrics import mean_squared_error
 from sklearn.metrics import mean_absolute_error
 
-# Load data
-df = pd.read_csv("cleaned_bin_data.csv", parse_dates=["timestamp"])
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".."))
+from Pipeline.bin_store import open_cleaned_store
+from Pipeline.forecast_cache import ForecastCache, forecast_key
+from Pipeline.model_store import SarimaModelStore, fit_sarima_warm, model_key
+
+# Load data from the per-bin columnar store that Clean.py keeps up to date
+store = open_cleaned_store("australian_store")
 bins_to_forecast = [1511208, 1511199, 1510830]
-df = df[df["Bin ID"].isin(bins_to_forecast)]
-train_data = df[df["timestamp"] <= "2021-04-26"]
+
+# Fitted SARIMA models are kept between runs and extended with new days
+sarima_store = SarimaModelStore("sarima_store")
+
+# Forecasts of unchanged bins are served from disk instead of refitted
+forecast_cache = ForecastCache("forecast_cache")
 
 results_sarima_es = {}
 results_sarima_es_mae = {}
 
 for bin_id in bins_to_forecast:
-    bin_train = train_data[train_data["Bin ID"] == bin_id].sort_values("timestamp")
-    bin_train.set_index("timestamp", inplace=True)
+    bin_full = store.read_bin(bin_id, columns=["Fullness"])
+    bin_train = bin_full[bin_full.index <= "2021-04-26"]
 
-    # SARIMA first
-    sarima_model = SARIMAX(
-        bin_train["Fullness"], order=(1, 0, 1), seasonal_order=(1, 1, 1, 35)
+    # Reuse the forecast if this bin's training data and models are unchanged
+    cache_key = forecast_key(
+        bin_train["Fullness"],
+        "sarima_es",
+        order=(1, 0, 1),
+        seasonal_order=(1, 1, 1, 35),
+        es_seasonal_periods=7,
+        steps=7,
     )
-    sarima_fit = sarima_model.fit()
-    sarima_forecast = sarima_fit.forecast(7)
+    cached = forecast_cache.load(cache_key)
+    if cached is None:
+        # SARIMA first
+        sarima_fit = fit_sarima_warm(
+            sarima_store,
+            model_key("sarima_es", bin_id, (1, 0, 1), (1, 1, 1, 35)),
+            bin_train["Fullness"],
+            order=(1, 0, 1),
+            seasonal_order=(1, 1, 1, 35),
+            refit_every=7,
+        )
+        sarima_forecast = sarima_fit.forecast(7)
 
-    # ES on SARIMA residuals
-    residuals = bin_train["Fullness"] - sarima_fit.fittedvalues
-    es_model = ExponentialSmoothing(
-        residuals, trend="add", seasonal="add", seasonal_periods=7
-    )
-    es_fit = es_model.fit()
-    residual_forecast = es_fit.forecast(7)
+        # ES on SARIMA residuals
+        residuals = bin_train["Fullness"] - sarima_fit.fittedvalues
+        es_model = ExponentialSmoothing(
+            residuals, trend="add", seasonal="add", seasonal_periods=7
+        )
+        es_fit = es_model.fit()
+        residual_forecast = es_fit.forecast(7)
+        cached = forecast_cache.save(
+            cache_key,
+            {
+                "sarima_forecast": np.asarray(sarima_forecast),
+                "residual_forecast": np.asarray(residual_forecast),
+            },
+        )
 
     # Hybrid forecast
-    hybrid_forecast = sarima_forecast.values + residual_forecast.values
+    hybrid_forecast = cached["sarima_forecast"] + cached["residual_forecast"]
 
     # Date alignment
     last_actual_date = bin_train.index[-1]
@@ -44,9 +76,6 @@ for bin_id in bins_to_forecast:
     )
 
     # Actual data
-    bin_full = (
-        df[df["Bin ID"] == bin_id].sort_values("timestamp").set_index("timestamp")
-    )
     daily_actual = (
         bin_full["Fullness"]
         .resample("D")
@@ -1,7 +1,8 @@
+import os
+import sys
 import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
-from statsmodels.tsa.statespace.sarimax import SARIMAX
 from tensorflow.keras.models import Sequential
 from tensorflow.keras.layers import LSTM, Dense, Dropout
 from sklearn.preprocessing import MinMaxScaler
@@ -9,17 +10,23 @@ from sklearn.metrics import mean_squared_error
 from sklearn.metrics import mean_absolute_error
 from sklearn.metrics import mean_absolute_percentage_error
 
-# Load resampled dataset
-df = pd.read_csv(
-    "/content/sample_data/cleaned_bin_data_new.csv", parse_dates=["timestamp"]
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".."))
+from Pipeline.bin_store import open_bin_store
+from Pipeline.model_store import SarimaModelStore, fit_sarima_warm, model_key
+from Pipeline.rollout import recursive_forecast
+from Pipeline.windows import window_dataset
+
+# Load resampled dataset from the per-bin columnar store, built from the CSV on
+# the first run
+store = open_bin_store(
+    "/content/sample_data/cleaned_bin_data_new.csv", "bin_store", "australian"
 )
 
 # Select bins for forecasting
 bins_to_forecast = [1511208, 1511199, 1510830]
-df = df[df["Bin ID"].isin(bins_to_forecast)]
 
-# Filter data up to a specific date
-train_data = df[df["timestamp"] <= "2021-04-26"]
+# Fitted SARIMA models are kept between runs and extended with new days
+sarima_store = SarimaModelStore("sarima_store")
 
 
 def smape(y_true, y_pred):
@@ -30,27 +37,23 @@ def smape(y_true, y_pred):
     return np.mean(diff) * 100
 
 
-def prepare_data(series, time_steps=10):
-    X, y = [], []
-    for i in range(len(series) - time_steps):
-        X.append(series[i : i + time_steps])
-        y.append(series[i + time_steps])
-    return np.array(X), np.array(y)
-
-
 results_sarima_lstm = {}
 results_sarima_lstm_mae = {}
 results_es_lstm_mape = {}
 results_es_lstm_smape = {}
 for bin_id in bins_to_forecast:
-    bin_train = train_data[train_data["Bin ID"] == bin_id].sort_values(by="timestamp")
-    bin_train.set_index("timestamp", inplace=True)
+    bin_full = store.read_bin(bin_id, columns=["Fullness"])
+    bin_train = bin_full[bin_full.index <= "2021-04-26"]
 
     # SARIMA model
-    sarima_model = SARIMAX(
-        bin_train["Fullness"], order=(1, 1, 1), seasonal_order=(1, 1, 1, 7)
+    sarima_fit = fit_sarima_warm(
+        sarima_store,
+        model_key("sarima_lstm", bin_id, (1, 1, 1), (1, 1, 1, 7)),
+        bin_train["Fullness"],
+        order=(1, 1, 1),
+        seasonal_order=(1, 1, 1, 7),
+        refit_every=7,
     )
-    sarima_fit = sarima_model.fit(disp=False)
     sarima_fitted_values = sarima_fit.fittedvalues
     sarima_forecast = sarima_fit.forecast(steps=7)
 
@@ -63,8 +66,9 @@ for bin_id in bins_to_forecast:
 
     # Prepare data for LSTM
     time_steps = 10
-    X_train, y_train = prepare_data(residuals_scaled, time_steps)
-    X_train = X_train.reshape((X_train.shape[0], time_steps, 1))
+    train_windows = window_dataset(
+        {bin_id: residuals_scaled}, time_steps, batch_size=16
+    )
 
     # LSTM model
     model = Sequential(
@@ -82,15 +86,12 @@ for bin_id in bins_to_forecast:
         ]
     )
     model.compile(optimizer="adam", loss="mse")
-    model.fit(X_train, y_train, epochs=50, batch_size=16, verbose=0)
+    model.fit(train_windows, shuffle=False, epochs=50, verbose=0)
 
     # Predict residuals with LSTM
-    predictions = []
-    last_sequence = residuals_scaled[-time_steps:].reshape(1, time_steps, 1)
-    for _ in range(7):
-        pred = model.predict(last_sequence, verbose=0)
-        predictions.append(pred[0, 0])
-        last_sequence = np.append(last_sequence[:, 1:, :], [[[pred[0, 0]]]], axis=1)
+    predictions = recursive_forecast(
+        model, residuals_scaled[-time_steps:].reshape(1, time_steps), 7
+    )[0]
 
     residual_predictions = scaler.inverse_transform(
         np.array(predictions).reshape(-1, 1)
@@ -106,9 +107,6 @@ for bin_id in bins_to_forecast:
     )
 
     # Actual data alignment
-    bin_full = (
-        df[df["Bin ID"] == bin_id].sort_values(by="timestamp").set_index("timestamp")
-    )
     daily_actual = (
         bin_full["Fullness"]
         .resample("D")
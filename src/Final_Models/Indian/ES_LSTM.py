@@ -1,100 +1,62 @@
+import os
+import sys
 import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
 from sklearn.metrics import mean_squared_error, mean_absolute_error
-from sklearn.preprocessing import MinMaxScaler
 from statsmodels.tsa.statespace.sarimax import SARIMAX
-from statsmodels.tsa.holtwinters import ExponentialSmoothing
 from statsmodels.tsa.arima.model import ARIMA
-from tensorflow.keras.models import Sequential
-from tensorflow.keras.layers import LSTM, Dense
-from tensorflow.keras.optimizers import Nadam
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".."))
+from Pipeline.batch_es import fit_holt_winters_batch
+from Pipeline.bin_store import open_cleaned_store, readings_per_day
+from Pipeline.global_lstm import GlobalResidualLSTM
 
 # Load and preprocess data
-df = pd.read_csv("cleaned_bin_data.csv")
-df["datetime"] = pd.to_datetime(df["date"] + " " + df["time"])
-df.sort_values(by="datetime", inplace=True)
+store = open_cleaned_store("mumbai_store")
 
 train_end = pd.Timestamp("2025-03-05 23:59:59")
 test_start = pd.Timestamp("2025-03-06 00:00:00")
 test_end = pd.Timestamp("2025-03-07 00:00:00")
 
-# bins = df['Bin_ID'].unique()
+# bins = store.bins()
 
 
 bins = [1001, 1002, 1003, 1004, 1005, 1016, 1017, 1020, 1021, 1022, 1023]
 
 
-time_steps = df.groupby("date")["time"].nunique().mode()[0]  # dynamic
-
-# Helper functions
-
-
-def prepare_data(series, time_steps):
-    X, y = [], []
-    for i in range(len(series) - time_steps):
-        X.append(series[i : i + time_steps])
-        y.append(series[i + time_steps])
-    return np.array(X), np.array(y)
-
-
-def create_model(time_steps):
-    model = Sequential()
-    model.add(LSTM(50, activation="relu", input_shape=(time_steps, 1)))
-    model.add(Dense(1))
-    return model
-
+time_steps = readings_per_day(store.series(bins[0]))  # dynamic
 
 results_exp_lstm = {}
-
-
-def prepare_lstm_data(series, time_steps=10):
-    X, y = [], []
-    for i in range(len(series) - time_steps):
-        X.append(series[i : i + time_steps])
-        y.append(series[i + time_steps])
-    return np.array(X), np.array(y)
-
+tests, train_series = {}, {}
 
 for bin_id in bins:
-    bin_data = df[df["Bin_ID"] == bin_id].set_index("datetime")
-    train = bin_data[bin_data.index <= train_end]["Fullness"]
-    test = bin_data[(bin_data.index >= test_start) & (bin_data.index < test_end)][
-        "Fullness"
-    ]
-    forecast_steps = len(test)
-
-    exp_model = ExponentialSmoothing(train, seasonal="add", seasonal_periods=30)
-    exp_fit = exp_model.fit()
-    exp_forecast = exp_fit.forecast(forecast_steps)
-
-    residuals = train - exp_fit.fittedvalues
-    scaler = MinMaxScaler()
-    scaled_resid = scaler.fit_transform(residuals.values.reshape(-1, 1))
-
-    X, y = prepare_lstm_data(scaled_resid.flatten(), time_steps=10)
-    X = X.reshape((X.shape[0], X.shape[1], 1))
-
-    lstm_model = Sequential(
-        [LSTM(50, activation="relu", input_shape=(X.shape[1], 1)), Dense(1)]
-    )
-    lstm_model.compile(optimizer="adam", loss="mse")
-    lstm_model.fit(X, y, epochs=20, verbose=0)
+    bin_data = store.read_bin(bin_id, columns=["Fullness"])
+    train_series[bin_id] = bin_data[bin_data.index <= train_end]["Fullness"]
+    tests[bin_id] = bin_data[
+        (bin_data.index >= test_start) & (bin_data.index < test_end)
+    ]["Fullness"]
+
+# Exponential smoothing for all bins at once (Pipeline/batch_es.py)
+exp_fits = fit_holt_winters_batch(train_series, 30, trend=None)
+exp_forecasts, residuals_by_bin = {}, {}
+for bin_id, (fitted, batch, row) in exp_fits.items():
+    exp_forecasts[bin_id] = batch.forecast(len(tests[bin_id]))[row]
+    residuals_by_bin[bin_id] = train_series[bin_id].dropna().values - fitted
+
+# One LSTM trained on the residual windows of all bins
+lstm_model = GlobalResidualLSTM(10, units=50, optimizer="adam")
+lstm_model.fit(residuals_by_bin, epochs=20, batch_size=256)
+lstm_forecasts = lstm_model.forecast(max(len(test) for test in tests.values()))
 
-    last_resid = scaled_resid[-10:].reshape(1, 10, 1)
-    lstm_forecast_scaled = []
-
-    for _ in range(forecast_steps):
-        pred = lstm_model.predict(last_resid, verbose=0)
-        lstm_forecast_scaled.append(pred[0, 0])
-        last_resid = np.roll(last_resid, -1)
-        last_resid[0, -1, 0] = pred[0, 0]
-
-    lstm_forecast = scaler.inverse_transform(
-        np.array(lstm_forecast_scaled).reshape(-1, 1)
-    ).flatten()
+for bin_id in bins:
+    if bin_id not in lstm_forecasts:
+        continue
+    test = tests[bin_id]
+    exp_forecast = exp_forecasts[bin_id]
+    lstm_forecast = lstm_forecasts[bin_id][: len(test)]
 
-    hybrid_forecast = exp_forecast.values + lstm_forecast
+    hybrid_forecast = exp_forecast + lstm_forecast
     hybrid_forecast = np.maximum(hybrid_forecast, 0)
     hybrid_forecast = np.minimum(hybrid_forecast, 5)
 
@@ -1,31 +1,41 @@
+import os
+import sys
 import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
 from sklearn.metrics import mean_squared_error, mean_absolute_error
 from sklearn.preprocessing import MinMaxScaler
-from statsmodels.tsa.statespace.sarimax import SARIMAX
 from statsmodels.tsa.holtwinters import ExponentialSmoothing
 from statsmodels.tsa.arima.model import ARIMA
 from tensorflow.keras.models import Sequential
 from tensorflow.keras.layers import LSTM, Dense
 from tensorflow.keras.optimizers import Nadam
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".."))
+from Pipeline.bin_store import open_cleaned_store, readings_per_day
+from Pipeline.forecast_cache import ForecastCache, forecast_key
+from Pipeline.model_store import SarimaModelStore, fit_sarima_warm, model_key
+
 # Load and preprocess data
-df = pd.read_csv("cleaned_bin_data.csv")
-df["datetime"] = pd.to_datetime(df["date"] + " " + df["time"])
-df.sort_values(by="datetime", inplace=True)
+store = open_cleaned_store("mumbai_store")
 
 train_end = pd.Timestamp("2025-03-05 23:59:59")
 test_start = pd.Timestamp("2025-03-06 00:00:00")
 test_end = pd.Timestamp("2025-03-07 00:00:00")
 
-# bins = df['Bin_ID'].unique()
+# bins = store.bins()
 
 
 bins = [1001, 1002, 1003, 1004, 1005, 1016, 1017, 1020, 1021, 1022, 1023]
 
 
-time_steps = df.groupby("date")["time"].nunique().mode()[0]  # dynamic
+time_steps = readings_per_day(store.series(bins[0]))  # dynamic
+
+# Fitted SARIMA models are kept between runs and extended with new readings
+sarima_store = SarimaModelStore("sarima_store")
+
+# Forecasts of unchanged bins are served from disk instead of refitted
+forecast_cache = ForecastCache("forecast_cache")
 
 # Helper functions
 
@@ -48,31 +58,55 @@ def create_model(time_steps):
 results_exp_sarima = {}
 
 for bin_id in bins:
-    bin_data = df[df["Bin_ID"] == bin_id].set_index("datetime")
+    bin_data = store.read_bin(bin_id, columns=["Fullness"])
     train = bin_data[bin_data.index <= train_end]["Fullness"]
     test = bin_data[(bin_data.index >= test_start) & (bin_data.index < test_end)][
         "Fullness"
     ]
     forecast_steps = len(test)
 
-    # --- Step 1: Exponential Smoothing ---
-    exp_model = ExponentialSmoothing(train, seasonal="add", seasonal_periods=30)
-    exp_fit = exp_model.fit()
-    exp_forecast = exp_fit.forecast(forecast_steps)
-
-    # --- Step 2: Get Residuals from Training Data ---
-    exp_train_fitted = exp_fit.fittedvalues
-    residuals = train - exp_train_fitted
-
-    # --- Step 3: SARIMA on Residuals ---
-    sarima_resid_model = SARIMAX(
-        residuals, order=(1, 1, 1), seasonal_order=(1, 1, 1, 30)
+    # --- Reuse the forecast if the training slice and models are unchanged ---
+    cache_key = forecast_key(
+        train,
+        "es_sarima",
+        es_trend=None,
+        es_seasonal_periods=30,
+        order=(1, 1, 1),
+        seasonal_order=(1, 1, 1, 30),
+        steps=forecast_steps,
     )
-    sarima_resid_fit = sarima_resid_model.fit(disp=False)
-    resid_forecast = sarima_resid_fit.forecast(forecast_steps)
+    cached = forecast_cache.load(cache_key)
+    if cached is None:
+        # --- Step 1: Exponential Smoothing ---
+        exp_model = ExponentialSmoothing(train, seasonal="add", seasonal_periods=30)
+        exp_fit = exp_model.fit()
+        exp_forecast = exp_fit.forecast(forecast_steps)
+
+        # --- Step 2: Get Residuals from Training Data ---
+        exp_train_fitted = exp_fit.fittedvalues
+        residuals = train - exp_train_fitted
+
+        # --- Step 3: SARIMA on Residuals ---
+        sarima_resid_fit = fit_sarima_warm(
+            sarima_store,
+            model_key("es_residuals", bin_id, (1, 1, 1), (1, 1, 1, 30)),
+            residuals,
+            order=(1, 1, 1),
+            seasonal_order=(1, 1, 1, 30),
+            refit_every=7 * time_steps,
+        )
+        resid_forecast = sarima_resid_fit.forecast(forecast_steps)
+        cached = forecast_cache.save(
+            cache_key,
+            {
+                "es_forecast": np.asarray(exp_forecast),
+                "residual_forecast": np.asarray(resid_forecast),
+                "residuals": np.asarray(residuals - sarima_resid_fit.fittedvalues),
+            },
+        )
 
     # --- Step 4: Final Forecast = Exp + Residual Model Forecast ---
-    hybrid_forecast = exp_forecast.values + resid_forecast.values
+    hybrid_forecast = cached["es_forecast"] + cached["residual_forecast"]
     hybrid_forecast = np.maximum(hybrid_forecast, 0)
     hybrid_forecast = np.minimum(hybrid_forecast, 5)
 
@@ -1,65 +1,63 @@
+import os
+import sys
 import numpy as np
 import pandas as pd
-from sklearn.preprocessing import MinMaxScaler
-from sklearn.linear_model import LinearRegression
-from statsmodels.tsa.statespace.sarimax import SARIMAX
-from tensorflow.keras.models import Sequential
-from tensorflow.keras.layers import LSTM, Dense
+import tensorflow as tf
 from tensorflow.keras.optimizers import Nadam
-import math
-
-# Load bin data and cluster information
-df = pd.read_csv("cleaned_bin_data.csv")
-df["datetime"] = pd.to_datetime(df["date"] + " " + df["time"])
-df.sort_values(by="datetime", inplace=True)
-
-# Load cluster information
-clusters_df = pd.read_csv("clusters_of_mumbai_dataset.csv")
-
-# Group bins by cluster
-cluster_bins = {}
-for cluster in sorted(clusters_df["knn_cluster"].unique()):
-    cluster_bins[cluster] = clusters_df[clusters_df["knn_cluster"] == cluster][
-        "Bin Id's"
-    ].tolist()
-
-# Define time periods for training and testing
-train_end = pd.Timestamp("2025-03-05 23:59:59")
-test_start = pd.Timestamp("2025-03-06 00:00:00")
-test_end = pd.Timestamp("2025-03-07 00:00:00")
-
-# Get all bin IDs from the cluster data
-bins = clusters_df["Bin Id's"].tolist()
-time_steps = df.groupby("date")["time"].nunique().mode()[0]  # dynamic based on data
-
-# Helper functions
-
-
-def prepare_data(series, time_steps):
-    X, y = [], []
-    for i in range(len(series) - time_steps):
-        X.append(series[i : i + time_steps])
-        y.append(series[i + time_steps])
-    return np.array(X), np.array(y)
-
-
-def create_model(time_steps):
-    model = Sequential()
-    model.add(LSTM(50, activation="relu", input_shape=(time_steps, 1)))
-    model.add(Dense(1))
-    return model
-
-
-# Main processing for all bins
-results_hybrid = {}
-slopes = {}
-
-print("Processing forecasts for all bins...")
-for bin_id in bins:
-    try:
-        bin_data = df[df["Bin_ID"] == bin_id].set_index("datetime")
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".."))
+from Pipeline.bin_store import open_cleaned_store, readings_per_day
+from Pipeline.global_lstm import GlobalResidualLSTM
+from Pipeline.model_selection import cached_models, group_by_model
+from Pipeline.priorities import cluster_priorities, forecast_matrix, forecast_slopes
+from Pipeline.sarima_service import fit_sarima_batch
+from Pipeline.snapshot import publish_snapshot
+
+# The SARIMA stage runs in worker processes, so everything below only runs
+# when the file is executed directly and not when a worker re-imports it
+if __name__ == "__main__":
+    # Load bin data and cluster information
+    store = open_cleaned_store("mumbai_store")
+
+    # Load cluster information
+    clusters_df = pd.read_csv("clusters_of_mumbai_dataset.csv")
+
+    # Group bins by cluster
+    cluster_bins = {}
+    for cluster in sorted(clusters_df["knn_cluster"].unique()):
+        cluster_bins[cluster] = clusters_df[clusters_df["knn_cluster"] == cluster][
+            "Bin Id's"
+        ].tolist()
+
+    # Define time periods for training and testing
+    train_end = pd.Timestamp("2025-03-05 23:59:59")
+    test_start = pd.Timestamp("2025-03-06 00:00:00")
+    test_end = pd.Timestamp("2025-03-07 00:00:00")
+
+    # Get all bin IDs from the cluster data
+    bins = clusters_df["Bin Id's"].tolist()
+    time_steps = readings_per_day(
+        store.series(store.bins()[0])
+    )  # dynamic based on data
+
+    # Per-bin SARIMA time budget in seconds, and worker processes (None = all cores)
+    sarima_timeout = 600
+    sarima_workers = None
+
+    # Main processing for all bins
+    results_hybrid = {}
+    hybrid_forecasts = {}
+
+    # Collect every bin's training series first so all SARIMA fits can run
+    # together instead of one after another
+    train_series = {}
+    forecast_steps = {}
+    for bin_id in bins:
         # Skip bins with insufficient data
+        if bin_id not in store:
+            print(f"Skipping Bin {bin_id} due to insufficient data")
+            continue
+        bin_data = store.read_bin(bin_id, columns=["Fullness"])
         if len(bin_data) < time_steps + 1:
             print(f"Skipping Bin {bin_id} due to insufficient data")
             continue
@@ -74,126 +72,163 @@ for bin_id in bins:
             print(f"Skipping Bin {bin_id} due to no test data available")
             continue
 
-        forecast_steps = len(test)
-
-        # --- SARIMA ---
-        sarima_model = SARIMAX(train, order=(1, 1, 1), seasonal_order=(1, 1, 1, 30))
-        sarima_fit = sarima_model.fit(disp=False)
-
-        # Get fitted values for the training period
-        sarima_fitted = sarima_fit.fittedvalues
-
-        # Calculate residuals for the training period
-        residuals = train.values - sarima_fitted.values
-
-        # Prepare residuals for LSTM training
-        scaler = MinMaxScaler()
-        scaled_residuals = scaler.fit_transform(residuals.reshape(-1, 1))
+        train_series[bin_id] = train
+        forecast_steps[bin_id] = len(test)
 
-        # --- LSTM on Residuals ---
-        X_train, y_train = prepare_data(scaled_residuals, time_steps)
-        X_train = X_train.reshape((X_train.shape[0], time_steps, 1))
-
-        lstm_model = create_model(time_steps)
-        lstm_model.compile(optimizer=Nadam(), loss="mse")
-        lstm_model.fit(X_train, y_train, epochs=100, batch_size=32, verbose=0)
-
-        # Generate SARIMA forecasts for the test period
-        sarima_forecast = sarima_fit.forecast(steps=forecast_steps).values
+    # --- SARIMA (all bins in parallel) ---
+    # Seasonal period and orders are chosen per cluster from the data (the
+    # readings come several times a day, so a period of 30 is not a month)
+    # and cached in sarima_orders.json, so daily runs skip the search
+    fitted_clusters = {
+        cluster: [bin_id for bin_id in bin_ids if bin_id in train_series]
+        for cluster, bin_ids in cluster_bins.items()
+    }
+    models = cached_models(
+        {
+            cluster: {bin_id: train_series[bin_id].values for bin_id in bin_ids}
+            for cluster, bin_ids in fitted_clusters.items()
+            if bin_ids
+        },
+        "sarima_orders.json",
+        workers=sarima_workers,
+    )
+    batches = group_by_model(
+        models, fitted_clusters, ((1, 1, 1), (1, 1, 1, time_steps))
+    )
+
+    print("Fitting SARIMA models for all bins...")
+    sarima_results = {}
+    for (order, seasonal_order), batch_bins in batches.items():
+        print(f"SARIMA{order}x{seasonal_order} for {len(batch_bins)} bins")
+        sarima_results.update(
+            fit_sarima_batch(
+                {bin_id: train_series[bin_id] for bin_id in batch_bins},
+                forecast_steps=max(forecast_steps.values(), default=0),
+                order=order,
+                seasonal_order=seasonal_order,
+                workers=sarima_workers,
+                timeout=sarima_timeout,
+                # Fitted models are kept in sarima_store/ between runs; bins
+                # whose history only gained new readings are extended instead
+                # of refitted, with a full warm-started refit once a week of
+                # readings has accumulated
+                store_dir="sarima_store",
+                store_tag="priority_values",
+                refit_every=7 * time_steps,
+            )
+        )
 
-        # Generate LSTM residual forecasts
-        last_seq = scaled_residuals[-time_steps:].reshape(1, time_steps, 1)
-        lstm_preds = []
-        for _ in range(forecast_steps):
-            pred = lstm_model.predict(last_seq, verbose=0)
-            lstm_preds.append(pred[0, 0])
-            # Update the sequence for the next prediction
-            last_seq = np.append(last_seq[:, 1:, :], [[[pred[0, 0]]]], axis=1)
+    # Calculate residuals for the training period of every fitted bin; a bin
+    # whose fit or residuals are unusable is left out on its own
+    residuals_by_bin = {}
+    for bin_id, train in train_series.items():
+        sarima_result = sarima_results[bin_id]
+        if sarima_result["status"] != "ok":
+            print(f"Error processing Bin {bin_id}: {sarima_result['error']}")
+            continue
+        residuals = train.values - sarima_result["fitted"]
+        if (
+            not np.isfinite(sarima_result["forecast"]).all()
+            or not np.isfinite(residuals).all()
+        ):
+            print(f"Skipping Bin {bin_id}: SARIMA fit is not finite")
+            continue
+        residuals_by_bin[bin_id] = residuals
 
-        # Inverse transform LSTM predictions
-        lstm_residual_forecast = scaler.inverse_transform(
-            np.array(lstm_preds).reshape(-1, 1)
-        ).flatten()
+    # --- One LSTM on the residuals of all bins, embedded by bin ---
+    # The network is shared, so if training fails the SARIMA forecasts are
+    # used alone rather than losing every bin
+    print("Training residual LSTM for all bins...")
+    try:
+        lstm_model = GlobalResidualLSTM(time_steps, units=50, optimizer=Nadam())
+        lstm_model.fit(residuals_by_bin, epochs=100, batch_size=256)
+        lstm_residual_forecasts = lstm_model.forecast(
+            max(forecast_steps.values(), default=0)
+        )
+    except (ValueError, tf.errors.OpError) as e:
+        print(f"Residual LSTM failed, using SARIMA forecasts alone: {str(e)}")
+        lstm_residual_forecasts = {
+            bin_id: np.zeros(forecast_steps[bin_id]) for bin_id in residuals_by_bin
+        }
+
+    print("Processing forecasts for all bins...")
+    for bin_id, lstm_residual_forecast in lstm_residual_forecasts.items():
+        steps = forecast_steps[bin_id]
+        sarima_forecast = sarima_results[bin_id]["forecast"][:steps]
+        lstm_residual_forecast = lstm_residual_forecast[:steps]
 
         # --- Combined Forecast (SARIMA + Residual LSTM) ---
         hybrid_forecast = sarima_forecast + lstm_residual_forecast
-
-        # --- Calculate slope of the forecast ---
-        X = np.arange(len(hybrid_forecast)).reshape(-1, 1)
-        y = hybrid_forecast.reshape(-1, 1)
-        reg = LinearRegression().fit(X, y)
-        slope = reg.coef_[0][0]
-        slopes[bin_id] = slope
-
+        if not np.isfinite(hybrid_forecast).all():
+            print(f"Skipping Bin {bin_id}: hybrid forecast is not finite")
+            continue
+        hybrid_forecasts[bin_id] = hybrid_forecast
+
+    # --- Slopes of all forecasts at once (least squares over the horizon) ---
+    slopes = pd.Series(
+        forecast_slopes(forecast_matrix(hybrid_forecasts)),
+        index=pd.Index(list(hybrid_forecasts), name="Bin_ID"),
+        name="Slope",
+    )
+    for bin_id, slope in slopes.items():
         print(f"Bin {bin_id}: Forecast slope = {slope:.4f}")
 
-    except Exception as e:
-        print(f"Error processing Bin {bin_id}: {str(e)}")
-        continue
-
-# Calculate priorities by cluster
-print("\nCalculating priorities by cluster...")
-priorities_data = []
-
-for cluster, cluster_bin_ids in cluster_bins.items():
-    # Extract slopes for this cluster's bins
-    cluster_slopes = {
-        bin_id: slopes.get(bin_id) for bin_id in cluster_bin_ids if bin_id in slopes
-    }
-
-    if not cluster_slopes:
+    # Calculate priorities by cluster
+    print("\nCalculating priorities by cluster...")
+    # One row per (bin, cluster) membership of a bin with a forecast
+    priorities_df = (
+        clusters_df[["Bin Id's", "Location", "knn_cluster"]]
+        .rename(columns={"Bin Id's": "Bin_ID", "knn_cluster": "Cluster"})
+        .merge(slopes.reset_index(), on="Bin_ID")
+    )
+    for cluster in sorted(set(cluster_bins) - set(priorities_df["Cluster"])):
         print(f"No valid forecast data for any bin in Cluster {cluster}")
-        continue
-
-    # Calculate min and max slopes within this cluster
-    min_slope = min(cluster_slopes.values())
-    max_slope = max(cluster_slopes.values())
-    slope_range = max_slope - min_slope
-
-    # Assign priorities within this cluster
-    for bin_id, slope in cluster_slopes.items():
-        location = clusters_df[clusters_df["Bin Id's"] == bin_id]["Location"].values[0]
-
-        # Avoid division by zero if all slopes in cluster are the same
-        if slope_range == 0:
-            priority = 3  # Middle priority if all same
-        else:
-            # Normalize the slope to 0-1 range within this cluster
-            normalized_slope = (slope - min_slope) / slope_range
-            # Convert to priority 1-5
-            priority = math.ceil(normalized_slope * 4 + 1)
-
-        priorities_data.append(
-            {
-                "Bin_ID": bin_id,
-                "Location": location,
-                "Cluster": cluster,
-                "Slope": slope,
-                "Priority": priority,
-            }
-        )
 
-# Create and export the final DataFrame
-priorities_df = pd.DataFrame(priorities_data)
-priorities_df = priorities_df.sort_values(
-    by=["Cluster", "Priority"], ascending=[True, False]
-)
-
-# Export to CSV
-csv_filename = "bin_priorities_by_cluster.csv"
-priorities_df.to_csv(csv_filename, index=False)
-
-print(f"\nPriorities calculated and exported to {csv_filename}")
-print(f"Total bins processed: {len(priorities_data)} out of {len(bins)}")
-
-# Display a summary of the results
-print("\nSummary of bin priorities by cluster:")
-for cluster in sorted(cluster_bins.keys()):
-    cluster_data = priorities_df[priorities_df["Cluster"] == cluster]
-    if len(cluster_data) > 0:
-        print(f"\nCluster {cluster} ({len(cluster_data)} bins):")
-        print(
-            cluster_data[["Bin_ID", "Location", "Priority", "Slope"]].to_string(
-                index=False
+    # Slopes normalized to 0-1 within each cluster and bucketed into 1-5
+    # (3 for a cluster whose slopes are all the same)
+    priorities_df["Priority"] = cluster_priorities(
+        priorities_df["Slope"], priorities_df["Cluster"]
+    )
+
+    # Create and export the final DataFrame
+    priorities_df = priorities_df[
+        ["Bin_ID", "Location", "Cluster", "Slope", "Priority"]
+    ].sort_values(by=["Cluster", "Priority"], ascending=[True, False])
+
+    # Export to CSV
+    csv_filename = "bin_priorities_by_cluster.csv"
+    priorities_df.to_csv(csv_filename, index=False)
+
+    print(f"\nPriorities calculated and exported to {csv_filename}")
+    print(f"Total bins processed: {len(priorities_df)} out of {len(bins)}")
+
+    # Latest forecasts and priorities for the query API (Pipeline/priority_api.py)
+    snapshot_path = os.path.join("snapshots", "priorities.npz")
+    publish_snapshot(
+        snapshot_path,
+        priorities_df.rename(
+            columns={
+                "Bin_ID": "bin_id",
+                "Location": "location",
+                "Cluster": "cluster",
+                "Slope": "score",
+                "Priority": "priority",
+            }
+        ),
+        hybrid_forecasts,
+        {bin_id: train_series[bin_id].index[-1] for bin_id in hybrid_forecasts},
+        pd.Timedelta(days=1) / time_steps,
+    )
+    print(f"Snapshot published to {snapshot_path}")
+
+    # Display a summary of the results
+    print("\nSummary of bin priorities by cluster:")
+    for cluster in sorted(cluster_bins.keys()):
+        cluster_data = priorities_df[priorities_df["Cluster"] == cluster]
+        if len(cluster_data) > 0:
+            print(f"\nCluster {cluster} ({len(cluster_data)} bins):")
+            print(
+                cluster_data[["Bin_ID", "Location", "Priority", "Slope"]].to_string(
+                    index=False
+                )
             )
-        )
@@ -1,54 +1,41 @@
+import os
+import sys
 import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
 from sklearn.metrics import mean_squared_error, mean_absolute_error
-from sklearn.preprocessing import MinMaxScaler
-from statsmodels.tsa.statespace.sarimax import SARIMAX
 from statsmodels.tsa.holtwinters import ExponentialSmoothing
 from statsmodels.tsa.arima.model import ARIMA
-from tensorflow.keras.models import Sequential
-from tensorflow.keras.layers import LSTM, Dense
 from tensorflow.keras.optimizers import Nadam
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".."))
+from Pipeline.bin_store import open_cleaned_store, readings_per_day
+from Pipeline.global_lstm import GlobalResidualLSTM
+from Pipeline.model_store import SarimaModelStore, fit_sarima_warm, model_key
+
 # Load and preprocess data
-df = pd.read_csv("cleaned_bin_data.csv")
-df["datetime"] = pd.to_datetime(df["date"] + " " + df["time"])
-df.sort_values(by="datetime", inplace=True)
+store = open_cleaned_store("mumbai_store")
 
 train_end = pd.Timestamp("2025-03-05 23:59:59")
 test_start = pd.Timestamp("2025-03-06 00:00:00")
 test_end = pd.Timestamp("2025-03-07 00:00:00")
 
-# bins = df['Bin_ID'].unique()
+# bins = store.bins()
 
 
 bins = [1001, 1002, 1003, 1004, 1005, 1016, 1017, 1020, 1021, 1022, 1023]
 
 
-time_steps = df.groupby("date")["time"].nunique().mode()[0]  # dynamic
-
-# Helper functions
-
-
-def prepare_data(series, time_steps):
-    X, y = [], []
-    for i in range(len(series) - time_steps):
-        X.append(series[i : i + time_steps])
-        y.append(series[i + time_steps])
-    return np.array(X), np.array(y)
-
-
-def create_model(time_steps):
-    model = Sequential()
-    model.add(LSTM(50, activation="relu", input_shape=(time_steps, 1)))
-    model.add(Dense(1))
-    return model
+time_steps = readings_per_day(store.series(bins[0]))  # dynamic
 
+# Fitted SARIMA models are kept between runs and extended with new readings
+sarima_store = SarimaModelStore("sarima_store")
 
 results_hybrid = {}
+tests, sarima_forecasts, residuals_by_bin = {}, {}, {}
 
 for bin_id in bins:
-    bin_data = df[df["Bin_ID"] == bin_id].set_index("datetime")
+    bin_data = store.read_bin(bin_id, columns=["Fullness"])
     train = bin_data[bin_data.index <= train_end]["Fullness"]
     test = bin_data[(bin_data.index >= test_start) & (bin_data.index < test_end)][
         "Fullness"
@@ -56,37 +43,34 @@ for bin_id in bins:
     forecast_steps = len(test)
 
     # --- SARIMA Forecast ---
-    sarima_model = SARIMAX(train, order=(1, 1, 1), seasonal_order=(1, 1, 1, 30))
-    sarima_fit = sarima_model.fit(disp=False)
-    sarima_forecast = sarima_fit.forecast(steps=forecast_steps)
+    sarima_fit = fit_sarima_warm(
+        sarima_store,
+        model_key("sarima_lstm", bin_id, (1, 1, 1), (1, 1, 1, 30)),
+        train,
+        order=(1, 1, 1),
+        seasonal_order=(1, 1, 1, 30),
+        refit_every=7 * time_steps,
+    )
+    sarima_forecasts[bin_id] = sarima_fit.forecast(steps=forecast_steps)
+    tests[bin_id] = test
 
     # --- Residuals from Training Data ---
     sarima_fitted_train = sarima_fit.fittedvalues
-    residuals = train - sarima_fitted_train
-
-    # --- LSTM on Residuals ---
-    scaler = MinMaxScaler()
-    scaled_residuals = scaler.fit_transform(residuals.dropna().values.reshape(-1, 1))
-
-    X_train, y_train = prepare_data(scaled_residuals, time_steps)
-    X_train = X_train.reshape((X_train.shape[0], time_steps, 1))
+    residuals_by_bin[bin_id] = (train - sarima_fitted_train).dropna().values
 
-    lstm_model = create_model(time_steps)
-    lstm_model.compile(optimizer=Nadam(), loss="mse")
-    lstm_model.fit(X_train, y_train, epochs=100, batch_size=32, verbose=0)
+# --- One LSTM on the residuals of all bins ---
+lstm_model = GlobalResidualLSTM(time_steps, units=50, optimizer=Nadam())
+lstm_model.fit(residuals_by_bin, epochs=100, batch_size=256)
 
-    # Generate LSTM predictions on SARIMA forecast horizon
-    last_seq = scaled_residuals[-time_steps:].reshape(1, time_steps, 1)
-    lstm_preds = []
+# Generate LSTM predictions on SARIMA forecast horizon for every bin at once
+lstm_forecasts = lstm_model.forecast(max(len(test) for test in tests.values()))
 
-    for _ in range(forecast_steps):
-        pred = lstm_model.predict(last_seq, verbose=0)
-        lstm_preds.append(pred[0, 0])
-        last_seq = np.append(last_seq[:, 1:, :], [[[pred[0, 0]]]], axis=1)
-
-    lstm_forecast = scaler.inverse_transform(
-        np.array(lstm_preds).reshape(-1, 1)
-    ).flatten()
+for bin_id in bins:
+    if bin_id not in lstm_forecasts:
+        continue
+    test = tests[bin_id]
+    sarima_forecast = sarima_forecasts[bin_id]
+    lstm_forecast = lstm_forecasts[bin_id][: len(test)]
 
     # --- Hybrid Forecast = SARIMA + Residual LSTM ---
     hybrid_forecast = sarima_forecast.values + lstm_forecast
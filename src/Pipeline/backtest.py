@@ -0,0 +1,348 @@
+import argparse
+import os
+import time
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from Pipeline.model_benchmark import FAMILIES
+from Pipeline.online_es import HoltWintersState
+
+# Rolling-origin (walk-forward) evaluation. Every model family is fitted at
+# the first forecast origin and then carried forward: between two origins
+# only the readings that arrived in between are fed to the existing state
+# (a Kalman filter extension for ARIMA/SARIMA, the Holt-Winters recursions
+# for ES, a few epochs of further training on the new windows for the global
+# LSTM), and parameters are only re-estimated every refit_every origins.
+# Hybrids pass each component's one-step-ahead errors on to the next one,
+# exactly as their fit on the full history does.
+#
+# The state chain makes the origins of one bin sequential, so the work is
+# split the other way: bins are sharded across worker processes, and the
+# origins can also be cut into origin_blocks independent blocks (each one
+# starting with a fresh fit) when there are more cores than shards. LSTM
+# families train one network for all bins, so they are only split by block.
+#
+# The result is a tidy table with one row per family, bin, origin and
+# forecast step.
+
+
+class _SarimaComponent:
+    def __init__(self, order, seasonal_order=(0, 0, 0, 0)):
+        self.order = order
+        self.seasonal_order = seasonal_order
+        self.results = None
+
+    def start(self, values, warm=None):
+        from statsmodels.tsa.statespace.sarimax import SARIMAX
+
+        start_params = warm.results.params if warm is not None else None
+        self.results = SARIMAX(
+            values, order=self.order, seasonal_order=self.seasonal_order
+        ).fit(start_params=start_params, disp=False)
+        return np.asarray(self.results.fittedvalues)
+
+    def extend(self, values):
+        # One-step predictions of the new readings, then the state moves on
+        self.results = self.results.extend(values)
+        return np.asarray(self.results.fittedvalues)
+
+    def forecast(self, steps):
+        return np.asarray(self.results.forecast(steps))
+
+
+class _EsComponent:
+    def __init__(self, seasonal_periods, trend="add"):
+        self.seasonal_periods = seasonal_periods
+        self.trend = trend
+        self.state = None
+
+    def start(self, values, warm=None):
+        from statsmodels.tsa.holtwinters import ExponentialSmoothing
+
+        fit = ExponentialSmoothing(
+            values,
+            trend=self.trend,
+            seasonal="add",
+            seasonal_periods=self.seasonal_periods,
+        ).fit()
+        self.state = HoltWintersState.from_fit(fit)
+        return np.asarray(fit.fittedvalues)
+
+    def extend(self, values):
+        predictions = np.empty(len(values))
+        for i, y in enumerate(values):
+            predictions[i] = self.state.forecast_next()
+            self.state.update(y)
+        return predictions
+
+    def forecast(self, steps):
+        return self.state.forecast(steps)
+
+
+def _make_component(name, config):
+    if name == "arima":
+        return _SarimaComponent((1, 1, 1))
+    if name == "sarima":
+        return _SarimaComponent((1, 1, 1), (1, 1, 1, config["seasonal_periods"]))
+    if name == "es":
+        return _EsComponent(config["seasonal_periods"])
+    raise ValueError(f"unknown component {name}")
+
+
+class _Chain:
+    # The per-bin components of a family plus, for LSTM families, the
+    # residuals handed to the shared LSTM
+
+    def __init__(self, family, config):
+        self.names = [name for name in FAMILIES[family] if name != "lstm"]
+        self.config = config
+        self.components = None
+
+    def start(self, values):
+        warm = self.components
+        self.components = [_make_component(name, self.config) for name in self.names]
+        target = values
+        for i, component in enumerate(self.components):
+            target = target - component.start(target, warm[i] if warm else None)
+        return target
+
+    def extend(self, values):
+        target = values
+        for component in self.components:
+            target = target - component.extend(target)
+        return target
+
+    def forecast(self, steps):
+        total = np.zeros(steps)
+        for component in self.components:
+            total += component.forecast(steps)
+        return total
+
+
+def rolling_origins(length, initial, horizon, step=None, n_origins=None):
+    # Positions (number of readings seen) at which forecasts are made: the
+    # first after `initial` readings, then every `step` readings while a
+    # whole horizon of actuals is still left
+    step = step or horizon
+    origins = np.arange(initial, length - horizon + 1, step)
+    return origins[:n_origins] if n_origins else origins
+
+
+def _run_block(family, series, origins, horizon, config):
+    warnings.simplefilter("ignore")
+    chains = {bin_id: _Chain(family, config) for bin_id in series}
+    uses_lstm = "lstm" in FAMILIES[family]
+    lstm = None
+    rows = []
+    failed = set()
+    started = time.perf_counter()
+
+    for k, origin in enumerate(origins):
+        refit = k % config["refit_every"] == 0
+        previous = origins[k - 1] if k else None
+        residuals = {}
+        for bin_id, chain in chains.items():
+            if bin_id in failed:
+                continue
+            values = series[bin_id]
+            try:
+                if refit:
+                    residuals[bin_id] = chain.start(values[:origin])
+                else:
+                    residuals[bin_id] = chain.extend(values[previous:origin])
+            except Exception as error:
+                print(f"{family}: Bin {bin_id} failed at origin {origin}: {error}")
+                failed.add(bin_id)
+
+        if uses_lstm and residuals:
+            if refit or lstm is None:
+                from Pipeline.global_lstm import GlobalResidualLSTM
+
+                lstm = GlobalResidualLSTM(config["time_steps"], config["units"])
+                lstm.fit(residuals, epochs=config["epochs"], seed=0)
+            else:
+                lstm.update(residuals, epochs=config["update_epochs"], seed=0)
+            lstm_forecasts = lstm.forecast(horizon)
+
+        for bin_id in residuals:
+            forecast = chains[bin_id].forecast(horizon)
+            if uses_lstm:
+                if bin_id not in lstm_forecasts:
+                    continue
+                forecast = forecast + lstm_forecasts[bin_id]
+            actual = series[bin_id][origin : origin + horizon]
+            for h in range(horizon):
+                rows.append(
+                    (family, bin_id, int(origin), h + 1, forecast[h], actual[h])
+                )
+
+    table = pd.DataFrame(
+        rows, columns=["family", "bin_id", "origin", "step", "forecast", "actual"]
+    )
+    return table, time.perf_counter() - started
+
+
+def backtest(
+    series_by_bin,
+    families=("es",),
+    initial=None,
+    horizon=12,
+    step=None,
+    n_origins=None,
+    seasonal_periods=12,
+    refit_every=10,
+    workers=None,
+    origin_blocks=1,
+    lstm_config=None,
+):
+    # series_by_bin maps bin id -> readings (array or Series; a Series' index
+    # gives that bin's origin_time for each origin). initial defaults to ten
+    # seasons. Returns the tidy table and the seconds spent per family.
+    config = {
+        "seasonal_periods": seasonal_periods,
+        "refit_every": refit_every,
+        "time_steps": 12,
+        "units": 50,
+        "epochs": 5,
+        "update_epochs": 1,
+        **(lstm_config or {}),
+    }
+    indexes = {
+        bin_id: values.index
+        for bin_id, values in series_by_bin.items()
+        if isinstance(values, pd.Series)
+    }
+    series = {
+        bin_id: np.asarray(values, dtype=np.float64)
+        for bin_id, values in series_by_bin.items()
+    }
+    length = min(len(values) for values in series.values())
+    origins = rolling_origins(
+        length, initial or 10 * seasonal_periods, horizon, step, n_origins
+    )
+    if not len(origins):
+        raise ValueError("series are too short for any forecast origin")
+
+    workers = workers or os.cpu_count()
+    blocks = np.array_split(origins, min(origin_blocks, len(origins)))
+    tasks = []
+    for family in families:
+        n_shards = 1 if "lstm" in FAMILIES[family] else max(workers // len(blocks), 1)
+        shards = np.array_split(np.array(list(series), dtype=object), n_shards)
+        for shard in shards:
+            for block in blocks:
+                if len(shard):
+                    subset = {bin_id: series[bin_id] for bin_id in shard}
+                    tasks.append((family, subset, block, horizon, config))
+
+    tables, seconds = [], dict.fromkeys(families, 0.0)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for task, (table, elapsed) in zip(tasks, pool.map(_run_block, *zip(*tasks))):
+            tables.append(table)
+            seconds[task[0]] += elapsed
+
+    table = pd.concat(tables, ignore_index=True)
+    table["error"] = table["forecast"] - table["actual"]
+    if indexes:
+        # Origins are positions within each bin's own series, and bins are
+        # read at different times, so each row's time comes from its bin
+        times = pd.Series(pd.NaT, index=table.index, dtype="datetime64[ns]")
+        for bin_id, rows in table.groupby("bin_id").groups.items():
+            if bin_id in indexes:
+                positions = table.loc[rows, "origin"].to_numpy() - 1
+                times[rows] = indexes[bin_id][positions]
+        table["origin_time"] = times
+    return table, seconds
+
+
+def summarize(table, by=("family",)):
+    # RMSE and MAE over all forecasts, plus the mean and standard error of
+    # the per-origin RMSE, so differences between families can be judged
+    # against the spread across origins. An origin is a position (readings
+    # seen) shared by all bins; origin_time records when it fell for each.
+    by = list(by)
+    squared = table.assign(squared=table["error"] ** 2, absolute=table["error"].abs())
+    overall = squared.groupby(by).agg(
+        forecasts=("error", "size"),
+        rmse=("squared", lambda s: np.sqrt(s.mean())),
+        mae=("absolute", "mean"),
+    )
+    per_origin = squared.groupby(by + ["origin"])["squared"].mean().pow(0.5).groupby(by)
+    overall["origins"] = per_origin.size()
+    overall["origin_rmse_mean"] = per_origin.mean()
+    overall["origin_rmse_se"] = per_origin.std() / np.sqrt(per_origin.size())
+    return overall
+
+
+def paired_difference(table, family_a, family_b):
+    # Mean per-origin difference in squared error (a - b) over the bins and
+    # origins both families forecast, with its standard error and t statistic
+    # across origins; negative means family_a is more accurate
+    keys = ["bin_id", "origin", "step"]
+    a = table[table["family"] == family_a].set_index(keys)["error"]
+    b = table[table["family"] == family_b].set_index(keys)["error"]
+    a, b = a.align(b, join="inner")
+    loss = (a**2 - b**2).groupby(level="origin").mean()
+    se = loss.std() / np.sqrt(len(loss))
+    return {
+        "mean_difference": loss.mean(),
+        "standard_error": se,
+        "t": loss.mean() / se if se else np.nan,
+        "origins": len(loss),
+    }
+
+
+if __name__ == "__main__":
+    from Pipeline.bin_store import open_bin_store, open_cleaned_store
+
+    parser = argparse.ArgumentParser(description="Walk-forward model backtest")
+    parser.add_argument(
+        "--data", default=None, help="Build --store from this cleaned CSV instead"
+    )
+    parser.add_argument("--store", default=None, help="Default: <dataset>_store")
+    parser.add_argument("--dataset", choices=["australian", "mumbai"], default="mumbai")
+    parser.add_argument("--bins", type=int, nargs="*", help="Default: all bins")
+    parser.add_argument("--families", nargs="+", default=["es", "sarima", "es_sarima"])
+    parser.add_argument("--seasonal-periods", type=int, default=12)
+    parser.add_argument("--initial", type=int, default=None)
+    parser.add_argument("--horizon", type=int, default=12)
+    parser.add_argument("--step", type=int, default=None)
+    parser.add_argument("--origins", type=int, default=None)
+    parser.add_argument("--refit-every", type=int, default=10)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--origin-blocks", type=int, default=1)
+    parser.add_argument("--output", default="backtest.csv")
+    args = parser.parse_args()
+
+    unknown = set(args.families) - set(FAMILIES)
+    if unknown:
+        parser.error(
+            f"unknown families {sorted(unknown)}, choose from {list(FAMILIES)}"
+        )
+
+    args.store = args.store or f"{args.dataset}_store"
+    if args.data:
+        store = open_bin_store(args.data, args.store, args.dataset)
+    else:
+        store = open_cleaned_store(args.store)
+    bins = args.bins or store.bins()
+    table, seconds = backtest(
+        {bin_id: store.series(bin_id) for bin_id in bins},
+        args.families,
+        initial=args.initial,
+        horizon=args.horizon,
+        step=args.step,
+        n_origins=args.origins,
+        seasonal_periods=args.seasonal_periods,
+        refit_every=args.refit_every,
+        workers=args.workers,
+        origin_blocks=args.origin_blocks,
+    )
+    table.to_csv(args.output, index=False)
+    summary = summarize(table)
+    summary["seconds"] = pd.Series(seconds)
+    print(summary.round(4).to_string())
+    print(f"\nForecasts for every origin exported to {args.output}")
@@ -0,0 +1,397 @@
+import argparse
+import time
+import warnings
+
+import numpy as np
+
+from Pipeline.online_es import HoltWintersState
+
+# Additive Holt-Winters fitted for many bins at once. The level/trend/season
+# recursions (the same ones statsmodels and online_es use) run over a
+# (bins x time) array one time step at a time, so every step is a handful of
+# numpy operations across the whole fleet instead of a Python loop per bin.
+#
+# The fit minimizes the sum of squared one-step errors, as statsmodels does.
+# For fixed smoothing parameters those errors are affine in the initial
+# level, trend and seasons, so the best initial state is an exact least
+# squares solution, found by running the unit initial states through the
+# recursions alongside the data. The smoothing parameters are searched per
+# bin: a coarse grid over every bin and candidate at once, then a pattern
+# search that moves each bin to its best neighbouring point and halves the
+# step when none improves, alternating with re-solving the initial state
+# and with probes of the parameter edges (beta = 0, gamma = 0, and alphas
+# inside for bins stuck at alpha = 0 or 1) that get their own initial state.
+# Parameters are kept inside statsmodels' bounds (beta <= alpha and
+# gamma <= 1 - alpha) by searching u in the unit cube with alpha = u0,
+# beta = u1 * alpha and gamma = u2 * (1 - alpha).
+
+
+def _parameters(u):
+    alpha = u[..., 0]
+    return alpha, u[..., 1] * alpha, u[..., 2] * (1 - alpha)
+
+
+def _filter(
+    values, alpha, beta, gamma, level, trend, season, y_weight=None, keep="errors"
+):
+    # Runs the recursions for values (bins, time) with parameters and states
+    # of shape (bins, ...) and season (bins, ..., m); y_weight scales the
+    # data per trailing column (0 runs a column on its initial state alone).
+    # keep chooses what is returned of the one-step errors: all of them
+    # (bins, ..., time), their sum of squares, or their Gram matrix over the
+    # trailing column, so searches never hold a (candidates x time) array.
+    # Also returns the final states, the season ring starting at the slot
+    # of the next reading.
+    n, length = values.shape
+    m = season.shape[-1]
+    extra = (1,) * (level.ndim - 1)
+    level, trend = level.copy(), trend.copy()
+    # Season slots first, so the slot read and written each step is one
+    # contiguous block
+    season = np.moveaxis(season, -1, 0).copy()
+    if keep == "errors":
+        kept = np.empty(level.shape + (length,))
+    elif keep == "sse":
+        kept = np.zeros(level.shape)
+    else:
+        kept = np.zeros(level.shape + level.shape[-1:])
+        # Errors are buffered for a block of steps and multiplied out at once
+        block = np.empty(level.shape + (64,))
+    expected = np.empty(level.shape)
+    error = np.empty(level.shape)
+    for t in range(length):
+        y = values[:, t].reshape((n,) + extra)
+        if y_weight is not None:
+            y = y * y_weight
+        s = season[t % m]
+        np.add(level, trend, out=expected)
+        np.subtract(y, expected, out=error)
+        # season slot: gamma * (y - expected) + (1 - gamma) * s
+        seasonal = gamma * (error - s)
+        error -= s
+        if keep == "errors":
+            kept[..., t] = error
+        elif keep == "sse":
+            kept += error * error
+        else:
+            block[..., t % 64] = error
+            if t % 64 == 63 or t == length - 1:
+                used = block[..., : t % 64 + 1]
+                kept += used @ used.swapaxes(-1, -2)
+        # level: alpha * (y - s) + (1 - alpha) * expected = expected + alpha * error
+        new_level = expected + alpha * error
+        # trend: beta * (new_level - level) + (1 - beta) * trend
+        trend += beta * (new_level - level - trend)
+        s += seasonal
+        level = new_level
+    season = np.moveaxis(season, 0, -1)
+    return kept, level, trend, np.roll(season, -(length % m), axis=-1)
+
+
+def _sse(values, u, start, has_trend):
+    # Sum of squared errors for candidates u (bins, candidates, 3) from the
+    # initial states in start
+    alpha, beta, gamma = _parameters(u)
+    if not has_trend:
+        beta = np.zeros_like(beta)
+    level, trend, season = start
+    shape = u.shape[:-1]
+    sse, _, _, _ = _filter(
+        values,
+        alpha,
+        beta,
+        gamma,
+        np.broadcast_to(level[:, None], shape),
+        np.broadcast_to(trend[:, None], shape),
+        np.broadcast_to(season[:, None, :], shape + season.shape[-1:]),
+        keep="sse",
+    )
+    return sse
+
+
+def _best_start(values, u, m, has_trend):
+    # Initial (level, trend, season) minimizing the squared errors for the
+    # parameters u (bins, 3). Column 0 runs the data from a zero state and
+    # column j the unit initial state j with no data; the errors of any
+    # start are then column 0 plus the start's weights on the others.
+    n = len(values)
+    k = 1 + int(has_trend) + m
+    alpha, beta, gamma = (
+        np.broadcast_to(p[:, None], (n, k + 1)) for p in _parameters(u)
+    )
+    if not has_trend:
+        beta = np.zeros_like(beta)
+    unit = np.eye(k + 1)[:, 1:]
+    level = np.broadcast_to(unit[:, 0], (n, k + 1))
+    trend = np.broadcast_to(unit[:, 1] if has_trend else 0.0 * unit[:, 0], (n, k + 1))
+    season = np.broadcast_to(unit[:, k - m :], (n, k + 1, m))
+    y_weight = np.eye(k + 1)[0]
+    gram, _, _, _ = _filter(
+        values, alpha, beta, gamma, level, trend, season, y_weight, keep="gram"
+    )
+    # Level and seasons are only identified up to a shared constant, so the
+    # minimum-norm solution is taken
+    weights = -np.einsum("nij,nj->ni", np.linalg.pinv(gram[:, 1:, 1:]), gram[:, 1:, 0])
+    return (
+        weights[:, 0],
+        weights[:, 1] if has_trend else np.zeros(n),
+        weights[:, k - m :],
+    )
+
+
+def _heuristic_start(values, m, has_trend):
+    first = values[:, :m].mean(axis=1)
+    if has_trend and values.shape[1] >= 2 * m:
+        trend = (values[:, m : 2 * m].mean(axis=1) - first) / m
+    else:
+        trend = np.zeros(len(values))
+    return first, trend, values[:, :m] - first[:, None]
+
+
+def _neighbours(u, step, has_trend):
+    # u (bins, 3) moved by step[bin] down and up along each searched axis
+    axes = [0, 1, 2] if has_trend else [0, 2]
+    moves = np.zeros((2 * len(axes), 3))
+    for i, axis in enumerate(axes):
+        moves[2 * i, axis], moves[2 * i + 1, axis] = -1, 1
+    return np.clip(u[:, None, :] + step[:, None, None] * moves[None], 0.0, 1.0)
+
+
+def _pattern_search(values, u, sse, start, has_trend, step, min_step):
+    # Each bin moves to its best neighbour while that improves and halves
+    # its own step otherwise; only bins still above min_step are evaluated
+    step = np.full(len(u), step)
+    active = np.flatnonzero(step >= min_step)
+    while len(active):
+        candidates = _neighbours(u[active], step[active], has_trend)
+        scores = _sse(
+            values[active],
+            candidates,
+            tuple(state[active] for state in start),
+            has_trend,
+        )
+        best = scores.argmin(axis=1)
+        best_score = scores[np.arange(len(active)), best]
+        improved = best_score < sse[active] - 1e-12 * np.maximum(sse[active], 1.0)
+        moved = active[improved]
+        u[moved] = candidates[improved, best[improved]]
+        sse[moved] = best_score[improved]
+        step[active[~improved]] /= 2
+        active = active[step[active] >= min_step]
+    return u, sse
+
+
+def _probe(values, u, sse, start, candidate, rows, m, has_trend):
+    # Tries candidate (len(rows), 3) for the given rows, each with its own
+    # best initial state, and keeps it where it lowers the SSE
+    rows = np.asarray(rows)
+    if not len(rows):
+        return u, sse, start
+    probe_start = _best_start(values[rows], candidate, m, has_trend)
+    probe_sse = _sse(values[rows], candidate[:, None], probe_start, has_trend)[:, 0]
+    better = probe_sse < sse[rows]
+    moved = rows[better]
+    u[moved], sse[moved] = candidate[better], probe_sse[better]
+    start = tuple(a.copy() for a in start)
+    for a, b in zip(start, probe_start):
+        a[moved] = b[better]
+    return u, sse, start
+
+
+# Smoothing levels tried for a bin whose search ended on alpha = 0 or 1
+ALPHA_PROBES = (0.05, 0.1, 0.2, 0.3, 0.5, 0.7, 0.8, 0.9, 0.95)
+
+
+def fit_holt_winters(values, seasonal_periods, trend="add", grid=4, rounds=2):
+    # values is a (bins, time) array without gaps; returns a
+    # BatchHoltWinters with one fitted model per row. Without a trend the
+    # grid has grid**1.5 points per axis, the same number of candidates as
+    # the three-parameter grid.
+    values = np.asarray(values, dtype=np.float64)
+    if values.ndim != 2 or np.isnan(values).any():
+        raise ValueError("values must be a 2-d array without NaN")
+    m = seasonal_periods
+    if values.shape[1] < 2 * m:
+        raise ValueError(f"need at least two seasons ({2 * m} readings) per bin")
+    has_trend = trend is not None
+    n = len(values)
+    if not has_trend:
+        grid = int(round(grid**1.5))
+
+    # Coarse grid for every bin at once, from the heuristic initial states
+    start = _heuristic_start(values, m, has_trend)
+    points = (np.arange(grid) + 0.5) / grid
+    axes = [points, points if has_trend else [0.0], points]
+    candidates = np.stack(np.meshgrid(*axes, indexing="ij"), -1).reshape(-1, 3)
+    candidates = np.broadcast_to(candidates, (n,) + candidates.shape)
+    scores = _sse(values, candidates, start, has_trend)
+    u = candidates[np.arange(n), scores.argmin(axis=1)].copy()
+
+    step = 0.5 / grid
+    start = _best_start(values, u, m, has_trend)
+    sse = _sse(values, u[:, None], start, has_trend)[:, 0]
+    everything = np.arange(n)
+    for round_ in range(rounds):
+        u, sse = _pattern_search(
+            values, u, sse, start, has_trend, step / 2**round_, 1e-3
+        )
+        start = _best_start(values, u, m, has_trend)
+        sse = _sse(values, u[:, None], start, has_trend)[:, 0]
+        # With the initial state held fixed the search rarely walks onto
+        # beta = 0 or gamma = 0, where statsmodels often ends up, so those
+        # edges are tried with their own best initial state
+        for axes in ([2], [1], [1, 2]) if has_trend else ([2],):
+            edge = u.copy()
+            edge[:, axes] = 0.0
+            u, sse, start = _probe(
+                values, u, sse, start, edge, everything, m, has_trend
+            )
+        # The reverse happens at alpha = 1 (or 0): the initial state solved
+        # there makes every step inwards look worse, so a few smoothing
+        # levels inside are tried (keeping the bin's beta and gamma, which
+        # u only encodes relative to alpha), again each with its own initial
+        # state, and the next round refines the best of them
+        stuck = np.flatnonzero((u[:, 0] > 1 - 1e-3) | (u[:, 0] < 1e-3))
+        _, beta, gamma = _parameters(u[stuck])
+        for alpha in ALPHA_PROBES:
+            inside = np.stack(
+                [
+                    np.full(len(stuck), alpha),
+                    np.minimum(beta / alpha, 1.0),
+                    np.minimum(gamma / (1 - alpha), 1.0),
+                ],
+                axis=-1,
+            )
+            u, sse, start = _probe(values, u, sse, start, inside, stuck, m, has_trend)
+    return BatchHoltWinters(values, u, start, m, has_trend)
+
+
+class BatchHoltWinters:
+    def __init__(self, values, u, start, seasonal_periods, has_trend):
+        self.seasonal_periods = seasonal_periods
+        self.has_trend = has_trend
+        self.alpha, self.beta, self.gamma = _parameters(u)
+        if not has_trend:
+            self.beta = np.zeros_like(self.beta)
+        self.initial_level, self.initial_trend, self.initial_season = start
+        errors, self.level, self.trend, self.season = _filter(
+            values,
+            self.alpha,
+            self.beta,
+            self.gamma,
+            self.initial_level,
+            self.initial_trend,
+            self.initial_season,
+        )
+        self.fittedvalues = values - errors
+        self.sse = (errors**2).sum(axis=1)
+
+    def forecast(self, steps):
+        # (bins, steps) forecasts from the end of the data
+        horizon = np.arange(1, steps + 1)
+        season = self.season[:, (horizon - 1) % self.seasonal_periods]
+        return self.level[:, None] + self.trend[:, None] * horizon + season
+
+    def state(self, row):
+        # Final state of one bin as an online_es.HoltWintersState, to carry
+        # on updating it reading by reading
+        return HoltWintersState(
+            self.level[row],
+            self.trend[row] if self.has_trend else None,
+            self.season[row],
+            self.alpha[row],
+            self.beta[row],
+            self.gamma[row],
+        )
+
+
+def fit_holt_winters_batch(series_by_bin, seasonal_periods, trend="add", **options):
+    # Bin -> (fittedvalues, BatchHoltWinters, row) for series of any length:
+    # missing readings are dropped and bins of equal length fitted together
+    values = {
+        bin_id: np.asarray(series, dtype=np.float64)
+        for bin_id, series in series_by_bin.items()
+    }
+    values = {bin_id: v[~np.isnan(v)] for bin_id, v in values.items()}
+    by_length = {}
+    for bin_id, v in values.items():
+        by_length.setdefault(len(v), []).append(bin_id)
+
+    fits = {}
+    for length, bin_ids in by_length.items():
+        if length < 2 * seasonal_periods:
+            for bin_id in bin_ids:
+                print(f"Skipping Bin {bin_id}: fewer than two seasons of data")
+            continue
+        batch = fit_holt_winters(
+            np.stack([values[b] for b in bin_ids]), seasonal_periods, trend, **options
+        )
+        for row, bin_id in enumerate(bin_ids):
+            fits[bin_id] = (batch.fittedvalues[row], batch, row)
+    return fits
+
+
+def compare_with_statsmodels(
+    n_bins=200, days=60, seasonal_periods=12, trend="add", seed=0
+):
+    # Times the batched fit against statsmodels on a synthetic fleet and
+    # reports how far the two fits and their forecasts are apart
+    from statsmodels.tsa.holtwinters import ExponentialSmoothing
+
+    from Pipeline.model_benchmark import synthetic_fleet
+
+    fleet = synthetic_fleet(n_bins, days, seed)
+    values = np.stack(list(fleet.values()))
+    horizon = seasonal_periods * 2
+
+    started = time.perf_counter()
+    batch = fit_holt_winters(values, seasonal_periods, trend)
+    batch_seconds = time.perf_counter() - started
+    batch_forecast = batch.forecast(horizon)
+
+    started = time.perf_counter()
+    sse, forecasts = [], []
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        for row in values:
+            fit = ExponentialSmoothing(
+                row, trend=trend, seasonal="add", seasonal_periods=seasonal_periods
+            ).fit()
+            sse.append(fit.sse)
+            forecasts.append(fit.forecast(horizon))
+    statsmodels_seconds = time.perf_counter() - started
+    sse, forecasts = np.array(sse), np.array(forecasts)
+
+    ratio = batch.sse / np.maximum(sse, 1e-12)
+    return {
+        "bins": n_bins,
+        "trend": trend,
+        "readings_per_bin": values.shape[1],
+        "batch_seconds": round(batch_seconds, 2),
+        "statsmodels_seconds": round(statsmodels_seconds, 2),
+        "median_sse_ratio": round(float(np.median(ratio)), 4),
+        "worst_sse_ratio": round(float(ratio.max()), 4),
+        "bins_with_lower_sse": int((ratio <= 1 + 1e-6).sum()),
+        "median_forecast_gap": round(
+            float(np.median(np.abs(batch_forecast - forecasts))), 4
+        ),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Batched Holt-Winters against statsmodels"
+    )
+    parser.add_argument("--bins", type=int, default=200)
+    parser.add_argument("--days", type=int, default=60)
+    parser.add_argument("--seasonal-periods", type=int, default=12)
+    parser.add_argument(
+        "--trend", choices=["add", "none"], default="add", help="none: level only"
+    )
+    args = parser.parse_args()
+
+    trend = None if args.trend == "none" else args.trend
+    for key, value in compare_with_statsmodels(
+        args.bins, args.days, args.seasonal_periods, trend
+    ).items():
+        print(f"{key}: {value}")
@@ -0,0 +1,264 @@
+import argparse
+import json
+import os
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+# Bin-partitioned columnar copy of the cleaned datasets. Each bin has its own
+# directory of Parquet parts (bin_id=<id>/part-00000.parquet, ...) sorted by
+# timestamp, so loading one bin opens only that bin's files and only the
+# requested columns, instead of parsing the whole CSV and masking it per bin.
+# New readings are added as extra parts; existing parts are never rewritten,
+# only superseded as a whole by a compacted part (part-NNNNN.compacted.parquet).
+
+# Column types of the cleaned CSVs; anything not listed is left to pandas
+AUSTRALIAN_DTYPES = {
+    "Bin ID": "int64",
+    "Fullness": "int8",
+    "fullnessThreshold": "int8",
+    "reason": "category",
+    "year": "int16",
+    "month": "int8",
+    "day": "int8",
+    "day_of_week": "int8",
+    "fullness_change": "float32",
+}
+MUMBAI_DTYPES = {
+    "Bin_ID": "int64",
+    "Fullness": "int8",
+    "date": "str",
+    "time": "str",
+}
+
+
+def load_australian_csv(csv_path):
+    df = pd.read_csv(csv_path, dtype=AUSTRALIAN_DTYPES)
+    df["timestamp"] = pd.to_datetime(df["timestamp"], format="%Y-%m-%d")
+    return df.rename(columns={"Bin ID": "bin_id"})
+
+
+def load_mumbai_csv(csv_path):
+    df = pd.read_csv(csv_path, dtype=MUMBAI_DTYPES)
+    df["timestamp"] = pd.to_datetime(
+        df["date"] + " " + df["time"], format="%Y-%m-%d %H:%M"
+    )
+    return df.drop(columns=["date", "time"]).rename(columns={"Bin_ID": "bin_id"})
+
+
+LOADERS = {"australian": load_australian_csv, "mumbai": load_mumbai_csv}
+COMPACTED = ".compacted.parquet"
+
+
+def _part_number(name):
+    return int(name[len("part-") :].split(".")[0])
+
+
+class BinStore:
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _bin_dir(self, bin_id):
+        return os.path.join(self.directory, f"bin_id={bin_id}")
+
+    def _parts(self, bin_id):
+        bin_dir = self._bin_dir(bin_id)
+        if not os.path.isdir(bin_dir):
+            raise KeyError(f"Bin {bin_id} is not in the store at {self.directory}")
+        # Sorted by part number, which outgrows the zero padding eventually
+        names = sorted(
+            (name for name in os.listdir(bin_dir) if name.endswith(".parquet")),
+            key=_part_number,
+        )
+        # A compacted part holds every reading of the parts numbered before
+        # it, which are left behind only if replace was interrupted
+        compacted = [i for i, name in enumerate(names) if name.endswith(COMPACTED)]
+        if compacted:
+            names = names[compacted[-1] :]
+        return [os.path.join(bin_dir, name) for name in names]
+
+    def _next_part(self, bin_dir, suffix=".parquet"):
+        numbers = [
+            _part_number(name)
+            for name in os.listdir(bin_dir)
+            if name.endswith(".parquet")
+        ]
+        return os.path.join(bin_dir, f"part-{max(numbers, default=-1) + 1:05d}{suffix}")
+
+    def bins(self):
+        bins = []
+        for name in sorted(os.listdir(self.directory)):
+            if name.startswith("bin_id="):
+                bin_id = name[len("bin_id=") :]
+                bins.append(int(bin_id) if bin_id.lstrip("-").isdigit() else bin_id)
+        return bins
+
+    def __contains__(self, bin_id):
+        return os.path.isdir(self._bin_dir(bin_id))
+
+    def append(self, df):
+        # df needs a bin_id and a timestamp column; each bin's rows become one
+        # new part in its directory. The frame is sorted and converted to
+        # Arrow once, and every part is a slice of that one table.
+        df = df.sort_values(["bin_id", "timestamp"], kind="stable")
+        bin_ids = df["bin_id"].to_numpy()
+        starts = np.flatnonzero(np.r_[True, bin_ids[1:] != bin_ids[:-1]])
+        stops = np.r_[starts[1:], len(df)]
+        table = pa.Table.from_pandas(df.drop(columns="bin_id"), preserve_index=False)
+        for start, stop in zip(starts, stops):
+            bin_dir = self._bin_dir(bin_ids[start])
+            os.makedirs(bin_dir, exist_ok=True)
+            path = self._next_part(bin_dir)
+            tmp_path = f"{path}.tmp"
+            pq.write_table(table.slice(start, stop - start), tmp_path)
+            os.replace(tmp_path, path)
+
+    def remove(self, bin_id):
+        bin_dir = self._bin_dir(bin_id)
+        for name in os.listdir(bin_dir):
+            os.remove(os.path.join(bin_dir, name))
+        os.rmdir(bin_dir)
+
+    def replace(self, bin_id, rows):
+        # Rewrites a bin as a single part holding rows (without a bin_id
+        # column), e.g. after re-sorting readings that arrived out of order.
+        # The new part is renamed into place before the old ones are deleted,
+        # and supersedes them from that moment, so a crash at any point
+        # leaves either the old parts or the compacted one readable.
+        bin_dir = self._bin_dir(bin_id)
+        old_parts = [
+            os.path.join(bin_dir, name)
+            for name in os.listdir(bin_dir)
+            if name.endswith(".parquet")
+        ]
+        path = self._next_part(bin_dir, COMPACTED)
+        tmp_path = f"{path}.tmp"
+        rows = rows.sort_values("timestamp", kind="stable")
+        pq.write_table(pa.Table.from_pandas(rows, preserve_index=False), tmp_path)
+        os.replace(tmp_path, path)
+        for old_path in old_parts:
+            os.remove(old_path)
+
+    def compact(self, bin_id, max_parts=1):
+        # Rewrites the bin as one part once it has more than max_parts parts,
+        # so a bin that keeps receiving small appends is still read from a
+        # bounded number of files; returns whether it was rewritten
+        if len(self._parts(bin_id)) <= max_parts:
+            return False
+        self.replace(bin_id, self.read_bin(bin_id).reset_index())
+        return True
+
+    def read_bin(self, bin_id, columns=None):
+        # Returns the bin's rows indexed by timestamp, with only the given
+        # columns read from disk
+        read_columns = None if columns is None else ["timestamp", *columns]
+        frames = [
+            pd.read_parquet(path, columns=read_columns) for path in self._parts(bin_id)
+        ]
+        df = frames[0] if len(frames) == 1 else pd.concat(frames, ignore_index=True)
+        # Parts written at different times have different categories, which
+        # concat turns into plain objects
+        for column, dtype in frames[0].dtypes.items():
+            if isinstance(dtype, pd.CategoricalDtype) and df[column].dtype != dtype:
+                df[column] = df[column].astype("category")
+        df = df.set_index("timestamp")
+        if not df.index.is_monotonic_increasing:
+            df = df.sort_index(kind="stable")
+        return df
+
+    def series(self, bin_id, column="Fullness"):
+        return self.read_bin(bin_id, columns=[column])[column].rename(bin_id)
+
+    def read(self, bins=None, columns=None):
+        # Long frame for several bins at once, with the bin in a bin_id column
+        frames = []
+        for bin_id in self.bins() if bins is None else bins:
+            df = self.read_bin(bin_id, columns).reset_index()
+            df.insert(0, "bin_id", bin_id)
+            frames.append(df)
+        return pd.concat(frames, ignore_index=True)
+
+    def last_timestamps(self):
+        # Newest reading per bin, read from the Parquet footers only
+        last = {}
+        for bin_id in self.bins():
+            newest = None
+            for path in self._parts(bin_id):
+                metadata = pq.ParquetFile(path).metadata
+                column = metadata.schema.to_arrow_schema().get_field_index("timestamp")
+                for i in range(metadata.num_row_groups):
+                    stats = metadata.row_group(i).column(column).statistics
+                    if stats is not None and stats.has_min_max:
+                        value = pd.Timestamp(stats.max)
+                        newest = value if newest is None else max(newest, value)
+            last[bin_id] = newest
+        return last
+
+
+def readings_per_day(series):
+    # Most common number of readings per calendar day, i.e. the daily period
+    return int(series.groupby(series.index.normalize()).size().mode()[0])
+
+
+def build_bin_store(csv_path, directory, dataset="australian"):
+    df = LOADERS[dataset](csv_path)
+    store = BinStore(directory)
+    if store.bins():
+        raise ValueError(f"{directory} already holds a store; remove it to rebuild")
+    store.append(df)
+    with open(os.path.join(directory, "_source.json"), "w") as f:
+        json.dump(_source_stamp(csv_path, dataset), f)
+    return store
+
+
+def _source_stamp(csv_path, dataset):
+    stat = os.stat(csv_path)
+    return {
+        "path": os.path.abspath(csv_path),
+        "dataset": dataset,
+        "size": stat.st_size,
+        "mtime": stat.st_mtime,
+    }
+
+
+def open_bin_store(csv_path, directory, dataset="australian"):
+    # Build the store from the CSV on first use, and rebuild it if the CSV
+    # has changed since; otherwise the CSV is not touched at all
+    stamp_path = os.path.join(directory, "_source.json")
+    if os.path.exists(stamp_path):
+        with open(stamp_path) as f:
+            if json.load(f) == _source_stamp(csv_path, dataset):
+                return BinStore(directory)
+        store = BinStore(directory)
+        for bin_id in store.bins():
+            store.remove(bin_id)
+        os.remove(stamp_path)
+    return build_bin_store(csv_path, directory, dataset)
+
+
+def open_cleaned_store(directory):
+    # The store Pipeline/cleaning.py keeps up to date, read in place rather
+    # than exported to a CSV and converted back into another store
+    if not os.path.isdir(directory) or not any(
+        name.startswith("bin_id=") for name in os.listdir(directory)
+    ):
+        raise FileNotFoundError(
+            f"No cleaned store at {directory}; run python -m Pipeline.cleaning first"
+        )
+    return BinStore(directory)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Convert a cleaned bin CSV into a bin-partitioned Parquet store"
+    )
+    parser.add_argument("dataset", choices=sorted(LOADERS))
+    parser.add_argument("csv_path")
+    parser.add_argument("directory")
+    args = parser.parse_args()
+
+    store = open_bin_store(args.csv_path, args.directory, args.dataset)
+    print(f"{len(store.bins())} bins in {args.directory}")
@@ -0,0 +1,500 @@
+import argparse
+import hashlib
+import json
+import os
+import time
+import warnings
+
+import numpy as np
+import pandas as pd
+
+from Pipeline.bin_store import BinStore
+from Pipeline.fullness import AUSTRALIAN_SCALE, MUMBAI_SCALE, remap_levels
+
+# Incremental cleaning of the raw fill-level feeds into bin-partitioned
+# Parquet stores (Pipeline/bin_store.py). A raw CSV is read in chunks with
+# explicit column types, timestamps are parsed with a fixed format (for the
+# Australian feed only rows that do not match fall back to the slow inferred
+# parser), fullness is remapped from 0-10 to 0-5 with a lookup table, and
+# each chunk's rows are appended to their bins as new Parquet parts.
+#
+# A state file in the store records how far into the raw file the last run
+# got (as a byte offset), so a run only reads the rows added to the feed
+# since. The two feeds differ in what happens otherwise:
+#
+# - Australian (Wyndham): the feed is only ever appended to. Each bin's
+#   newest reading is kept so fullness_change continues from it. Rows that
+#   arrive older than their bin's newest reading are kept; that bin alone is
+#   re-sorted and its changes recomputed at the end of the run. If the raw
+#   file was replaced, the store is rebuilt from scratch.
+# - Mumbai (synthetic): the generator rewrites the whole file, usually with
+#   a later end date. Each bin has a high-water timestamp, and only rows
+#   newer than it are remapped and appended, so a re-delivered reading is
+#   never stored twice. With rows in time order, as the generator writes
+#   them, every new part starts after the bin's previous one and the store
+#   stays sorted without re-sorting anything; a bin whose new rows arrive
+#   out of order is sorted once at the end of the run. If the file was
+#   replaced it is scanned from the start, but still only the new rows are
+#   cleaned and written.
+
+AUSTRALIAN_RAW_DTYPES = {
+    "Bin ID": "category",
+    "Fullness": "int8",
+    "fullnessThreshold": "int8",
+    "reason": "category",
+    "timestamp": "str",
+}
+# The generator names the Mumbai columns dustbin_id and filled_capacity; the
+# cleaned data and the model scripts use Bin_ID and Fullness
+MUMBAI_RAW_NAMES = {"dustbin_id": "Bin_ID", "filled_capacity": "Fullness"}
+MUMBAI_RAW_DTYPES = {
+    "entry_ID": "int64",
+    "Bin_ID": "int64",
+    "location": "category",
+    "Fullness": "int8",
+    "date": "category",
+    "time": "category",
+    "day_of_week": "category",
+    "fill_category": "category",
+}
+STATE_FILE = "_cleaning.json"
+
+
+def parse_timestamps(values, timestamp_format):
+    # Fixed-format parsing; rows the format does not match are retried with
+    # the day-first inferred parser the research script used, and rows
+    # neither can parse become NaT
+    parsed = pd.to_datetime(values, format=timestamp_format, errors="coerce")
+    failed = parsed.isna() & values.notna()
+    if failed.any():
+        parsed[failed] = pd.to_datetime(
+            values[failed], dayfirst=True, errors="coerce", format="mixed"
+        )
+    return parsed, int(failed.sum())
+
+
+class _Window:
+    # File object over bytes [start, end) of a file, so pandas parses just
+    # the rows appended since the last run and never a half-written last line
+    def __init__(self, f, start, end):
+        f.seek(start)
+        self.f = f
+        self.remaining = end - start
+
+    def read(self, size=-1):
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.f.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def __iter__(self):
+        while True:
+            line = self.f.readline(self.remaining)
+            if not line:
+                return
+            self.remaining -= len(line)
+            yield line
+
+
+def _complete_end(path):
+    # Offset just after the last newline, i.e. the end of the last whole row
+    size = os.path.getsize(path)
+    with open(path, "rb") as f:
+        position = size
+        while position > 0:
+            step = min(65536, position)
+            f.seek(position - step)
+            block = f.read(step)
+            newline = block.rfind(b"\n")
+            if newline >= 0:
+                return position - step + newline + 1
+            position -= step
+    return 0
+
+
+def _head_hash(path, length):
+    with open(path, "rb") as f:
+        return hashlib.sha1(f.read(min(length, 65536))).hexdigest()
+
+
+def _load_state(store, raw_path, columns):
+    # Previous run's state (or None), and whether it was for this raw file
+    # and the file has only grown since, so the run can carry on from its
+    # offset
+    path = os.path.join(store.directory, STATE_FILE)
+    if not os.path.exists(path):
+        return None, False
+    with open(path) as f:
+        state = json.load(f)
+    grown = (
+        state["raw"] == os.path.abspath(raw_path)
+        and state["header"] == columns
+        and os.path.getsize(raw_path) >= state["offset"]
+        and _head_hash(raw_path, state["offset"]) == state["head_hash"]
+    )
+    return state, grown
+
+
+def _save_state(store, state):
+    path = os.path.join(store.directory, STATE_FILE)
+    with open(f"{path}.tmp", "w") as f:
+        json.dump(state, f)
+    os.replace(f"{path}.tmp", path)
+
+
+def clean_chunk(chunk, timestamp_format, last):
+    # Cleans one raw chunk; last maps bin id -> [newest timestamp, fullness]
+    # and is updated. Returns the cleaned rows sorted by bin and time, the
+    # bins that received rows older than their newest reading, and counts of
+    # dropped and fallback-parsed rows.
+    timestamps, fallback = parse_timestamps(chunk["timestamp"], timestamp_format)
+    levels = chunk["Fullness"].to_numpy()
+    valid = timestamps.notna().to_numpy() & (levels >= 0) & (levels <= 10)
+    dropped = int(len(chunk) - valid.sum())
+
+    df = chunk[valid].rename(columns={"Bin ID": "bin_id"})
+    df["timestamp"] = timestamps[valid]
+    df["Fullness"] = remap_levels(df["Fullness"].to_numpy(), AUSTRALIAN_SCALE)
+    df = df.sort_values(["bin_id", "timestamp"], kind="stable")
+    df["bin_id"] = df["bin_id"].cat.remove_unused_categories()
+
+    # Calendar features straight from the datetime64 values
+    stamps = df["timestamp"].dt
+    df["year"] = stamps.year.astype(np.int16)
+    df["month"] = stamps.month.astype(np.int8)
+    df["day"] = stamps.day.astype(np.int8)
+    df["day_of_week"] = stamps.dayofweek.astype(np.int8)
+
+    # Change since the previous reading of the same bin, which for a bin's
+    # first row in the chunk is its last reading from earlier chunks or runs
+    codes = df["bin_id"].cat.codes.to_numpy()
+    fullness = df["Fullness"].to_numpy()
+    previous = np.empty(len(df), dtype=np.float32)
+    first = np.ones(len(df), dtype=bool)
+    first[1:] = codes[1:] != codes[:-1]
+    previous[~first] = fullness[np.flatnonzero(~first) - 1]
+    categories = df["bin_id"].cat.categories
+    for row in np.flatnonzero(first):
+        seen = last.get(str(categories[codes[row]]))
+        previous[row] = fullness[row] if seen is None else seen[1]
+    df["fullness_change"] = fullness - previous
+
+    # Newest reading per bin, and bins whose rows go back past it
+    unordered = set()
+    ends = np.append(np.flatnonzero(first)[1:], len(df)) - 1
+    times = df["timestamp"].to_numpy()
+    for start, end in zip(np.flatnonzero(first), ends):
+        bin_id = str(categories[codes[start]])
+        seen = last.get(bin_id)
+        if seen is not None and pd.Timestamp(times[start]) < pd.Timestamp(seen[0]):
+            unordered.add(bin_id)
+        if seen is None or pd.Timestamp(times[end]) >= pd.Timestamp(seen[0]):
+            last[bin_id] = [pd.Timestamp(times[end]).isoformat(), int(fullness[end])]
+    return df, unordered, dropped, fallback
+
+
+def _reorder(store, bin_id, last):
+    # Re-sorts a bin that received late readings and recomputes its changes
+    rows = store.read_bin(bin_id).reset_index()
+    rows = rows.sort_values("timestamp", kind="stable")
+    rows["fullness_change"] = (
+        rows["Fullness"].astype(np.float32).diff().fillna(0).astype(np.float32)
+    )
+    store.replace(bin_id, rows)
+    last[bin_id] = [
+        rows["timestamp"].iloc[-1].isoformat(),
+        int(rows["Fullness"].iloc[-1]),
+    ]
+
+
+def _line_end(f, position, end):
+    # First row boundary at or after position (and not past end)
+    if position >= end:
+        return end
+    f.seek(position)
+    return min(position + len(f.readline()), end)
+
+
+def _raw_blocks(raw_path, state, names, dtypes, chunk_bytes):
+    # Rows from state["offset"] up to the last whole row, in blocks of about
+    # chunk_bytes that end on a row boundary; yields each block with the
+    # offset just after it, for the caller to record once the block is stored
+    end = _complete_end(raw_path)
+    offset = state["offset"]
+    with open(raw_path, "rb") as f:
+        while offset < end:
+            stop = _line_end(f, offset + chunk_bytes, end)
+            chunk = pd.read_csv(
+                _Window(f, offset, stop), names=names, header=None, dtype=dtypes
+            )
+            yield chunk, stop
+            offset = stop
+
+
+def _advance(store, state, raw_path, stop):
+    state["offset"] = stop
+    state["head_hash"] = _head_hash(raw_path, stop)
+    _save_state(store, state)
+
+
+def clean_australian(
+    raw_path,
+    directory,
+    timestamp_format="%d-%m-%Y",
+    chunk_bytes=64 * 2**20,
+):
+    # Brings the store in directory up to date with raw_path; returns a
+    # summary of the run. The new bytes are cleaned in blocks that end on a
+    # row boundary, and the state is saved after every block, so a run that
+    # is interrupted resumes from the last whole block without appending
+    # any row twice.
+    started = time.perf_counter()
+    store = BinStore(directory)
+    with open(raw_path, "rb") as f:
+        header = f.readline()
+    columns = header.decode().strip().split(",")
+    state, grown = _load_state(store, raw_path, columns)
+    if not grown:
+        if state is not None:
+            print(f"{raw_path} was replaced since the last run; rebuilding")
+        for bin_id in store.bins():
+            store.remove(bin_id)
+        state = {
+            "raw": os.path.abspath(raw_path),
+            "header": columns,
+            "offset": len(header),
+            "last": {},
+            "unordered": [],
+        }
+
+    summary = {"rows": 0, "dropped": 0, "fallback_parsed": 0}
+    dtypes = {c: t for c, t in AUSTRALIAN_RAW_DTYPES.items() if c in columns}
+    unordered = set(state["unordered"])
+    for chunk, stop in _raw_blocks(raw_path, state, columns, dtypes, chunk_bytes):
+        df, late, dropped, fallback = clean_chunk(
+            chunk, timestamp_format, state["last"]
+        )
+        store.append(df)
+        unordered |= late
+        summary["rows"] += len(df)
+        summary["dropped"] += dropped
+        summary["fallback_parsed"] += fallback
+        state["unordered"] = sorted(unordered)
+        _advance(store, state, raw_path, stop)
+
+    # Bins that received readings older than ones already stored
+    for bin_id in sorted(unordered):
+        _reorder(store, bin_id, state["last"])
+    state["unordered"] = []
+    state.setdefault("head_hash", _head_hash(raw_path, state["offset"]))
+    _save_state(store, state)
+
+    # The fallback parser is much slower; if most rows needed it the
+    # format is almost certainly wrong for this feed
+    if summary["fallback_parsed"] > summary["rows"] / 2:
+        warnings.warn(
+            f"{summary['fallback_parsed']} of {summary['rows'] + summary['dropped']} "
+            f"timestamps in {raw_path} did not match {timestamp_format!r} and "
+            "were parsed by the slow fallback; pass the feed's format"
+        )
+    summary["reordered_bins"] = len(unordered)
+    summary["bins"] = len(state["last"])
+    summary["seconds"] = round(time.perf_counter() - started, 2)
+    return summary
+
+
+def clean_mumbai_chunk(chunk, watermarks):
+    # Cleans one raw chunk, keeping only rows newer than their bin's
+    # high-water timestamp (watermarks, a datetime Series indexed by bin id).
+    # Returns the cleaned rows and the counts of invalid and already stored
+    # rows that were dropped.
+
+    # date and time are read as categoricals, so each distinct value is
+    # parsed once and the timestamps are assembled from the codes
+    days = pd.to_datetime(
+        chunk["date"].cat.categories, format="%Y-%m-%d", errors="coerce"
+    )
+    hours = pd.to_datetime(
+        chunk["time"].cat.categories, format="%H:%M", errors="coerce"
+    ) - pd.Timestamp("1900-01-01")
+    # Code -1 (a missing value) picks the NaT appended at the end
+    timestamps = (
+        np.append(days.to_numpy(), np.datetime64("NaT"))[chunk["date"].cat.codes]
+        + np.append(hours.to_numpy(), np.timedelta64("NaT"))[chunk["time"].cat.codes]
+    )
+    levels = chunk["Fullness"].to_numpy()
+    valid = ~np.isnat(timestamps) & (levels >= 0) & (levels <= 10)
+
+    mark = watermarks.reindex(chunk["Bin_ID"]).to_numpy()
+    new = valid & (np.isnat(mark) | (timestamps > mark))
+
+    df = chunk[new].drop(columns=["date", "time"]).rename(columns={"Bin_ID": "bin_id"})
+    df["timestamp"] = timestamps[new]
+    df["Fullness"] = remap_levels(df["Fullness"].to_numpy(), MUMBAI_SCALE)
+    return df, int(len(chunk) - valid.sum()), int(valid.sum() - new.sum())
+
+
+def _stamps(mapping):
+    # {bin id: ISO timestamp} from the state file as a datetime Series
+    return pd.Series(
+        pd.to_datetime(list(mapping.values())),
+        index=pd.Index([int(bin_id) for bin_id in mapping], dtype="int64"),
+        dtype="datetime64[ns]",
+    )
+
+
+def _stamp_dict(stamps):
+    return {str(bin_id): stamp.isoformat() for bin_id, stamp in stamps.items()}
+
+
+def clean_mumbai(raw_path, directory, chunk_bytes=64 * 2**20):
+    # Brings the store in directory up to date with raw_path; returns a
+    # summary of the run. Work is proportional to the rows added since the
+    # last run when the file was appended to, and the file is scanned once
+    # (without cleaning or writing the old rows) when it was regenerated.
+    # Rows are compared with the watermarks as they were when the run
+    # started, so the order of the rows within the file does not matter;
+    # a bin whose new rows arrive out of order is sorted once at the end.
+    started = time.perf_counter()
+    store = BinStore(directory)
+    with open(raw_path, "rb") as f:
+        header = f.readline()
+    columns = header.decode().strip().split(",")
+    names = [MUMBAI_RAW_NAMES.get(c, c) for c in columns]
+
+    state, grown = _load_state(store, raw_path, columns)
+    if state is None:
+        # A store without a state file (e.g. one built from the cleaned CSV)
+        # starts from its newest stored readings
+        newest = {
+            str(bin_id): stamp.isoformat()
+            for bin_id, stamp in store.last_timestamps().items()
+            if stamp is not None
+        }
+        state = {"watermarks": newest, "newest": newest, "unordered": []}
+    elif not grown:
+        print(f"{raw_path} was replaced since the last run; rescanning it")
+        state["watermarks"] = state["newest"]
+    if not grown:
+        state.update(raw=os.path.abspath(raw_path), header=columns, offset=len(header))
+    # watermarks stay fixed for the run (and across an interrupted one);
+    # newest follows the rows stored so far
+    watermarks = _stamps(state["watermarks"])
+    newest = _stamps(state["newest"])
+
+    summary = {"rows": 0, "dropped": 0, "already_stored": 0}
+    dtypes = {c: t for c, t in MUMBAI_RAW_DTYPES.items() if c in names}
+    unordered = set(state["unordered"])
+    for chunk, stop in _raw_blocks(raw_path, state, names, dtypes, chunk_bytes):
+        df, dropped, stored = clean_mumbai_chunk(chunk, watermarks)
+        if len(df):
+            store.append(df)
+            span = df.groupby("bin_id")["timestamp"].agg(["min", "max"])
+            behind = (span["min"] < newest.reindex(span.index)).to_numpy()
+            unordered |= set(span.index[behind].tolist())
+            newest = pd.concat([newest, span["max"]]).groupby(level=0).max()
+            state["newest"] = _stamp_dict(newest)
+            state["unordered"] = sorted(unordered)
+        summary["rows"] += len(df)
+        summary["dropped"] += dropped
+        summary["already_stored"] += stored
+        _advance(store, state, raw_path, stop)
+
+    for bin_id in sorted(unordered):
+        store.replace(bin_id, store.read_bin(bin_id).reset_index())
+    state["unordered"] = []
+    state["watermarks"] = state["newest"]
+    state.setdefault("head_hash", _head_hash(raw_path, state["offset"]))
+    _save_state(store, state)
+
+    summary["reordered_bins"] = len(unordered)
+    summary["bins"] = len(newest)
+    summary["seconds"] = round(time.perf_counter() - started, 2)
+    return summary
+
+
+def export_csv(directory, csv_path, dataset="australian"):
+    # The whole store as one CSV in the research scripts' layout (bins in
+    # order, each sorted by time), for code that still reads the CSV
+    store = BinStore(directory)
+    if dataset == "mumbai":
+        df = store.read(sorted(store.bins())).rename(columns={"bin_id": "Bin_ID"})
+        # date and time back as strings, formatting each distinct value once
+        day = df["timestamp"].dt.normalize()
+        dates = pd.Categorical(day)
+        hours = pd.Categorical(df["timestamp"] - day)
+        df["date"] = pd.Categorical.from_codes(
+            dates.codes, dates.categories.strftime("%Y-%m-%d")
+        )
+        df["time"] = pd.Categorical.from_codes(
+            hours.codes,
+            (pd.Timestamp("1900-01-01") + hours.categories).strftime("%H:%M"),
+        )
+        df = df.drop(columns="timestamp")
+        with open(os.path.join(directory, STATE_FILE)) as f:
+            header = json.load(f)["header"]
+        columns = [MUMBAI_RAW_NAMES.get(c, c) for c in header]
+    else:
+        df = store.read().rename(columns={"bin_id": "Bin ID"})
+        columns = [
+            "Bin ID",
+            "Fullness",
+            "fullnessThreshold",
+            "timestamp",
+            "reason",
+            "year",
+            "month",
+            "day",
+            "day_of_week",
+            "fullness_change",
+        ]
+    df[[c for c in columns if c in df] + [c for c in df if c not in columns]].to_csv(
+        csv_path, index=False
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Clean a raw fill-level feed into a Parquet store"
+    )
+    parser.add_argument(
+        "--dataset", choices=["australian", "mumbai"], default="australian"
+    )
+    parser.add_argument("--raw", default=None)
+    parser.add_argument("--store", default=None)
+    parser.add_argument(
+        "--timestamp-format", default="%d-%m-%Y", help="Australian feed only"
+    )
+    parser.add_argument(
+        "--chunk-mb", type=int, default=64, help="Raw bytes cleaned per block"
+    )
+    parser.add_argument(
+        "--csv", default=None, help="Also export the whole store to this CSV"
+    )
+    args = parser.parse_args()
+
+    if args.dataset == "mumbai":
+        args.raw = args.raw or "synthetic_mumbai_waste_data.csv"
+        args.store = args.store or "mumbai_store"
+        summary = clean_mumbai(args.raw, args.store, args.chunk_mb * 2**20)
+        print(
+            f"{summary['rows']} new rows for {summary['bins']} bins in "
+            f"{summary['seconds']}s ({summary['dropped']} dropped, "
+            f"{summary['already_stored']} already stored)"
+        )
+    else:
+        args.raw = args.raw or "wyndham_smartbin_filllevel.csv"
+        args.store = args.store or "australian_store"
+        summary = clean_australian(
+            args.raw, args.store, args.timestamp_format, args.chunk_mb * 2**20
+        )
+        print(
+            f"{summary['rows']} new rows for {summary['bins']} bins in "
+            f"{summary['seconds']}s ({summary['dropped']} dropped, "
+            f"{summary['fallback_parsed']} timestamps not in "
+            f"{args.timestamp_format!r}, {summary['reordered_bins']} bins re-sorted)"
+        )
+    if args.csv:
+        export_csv(args.store, args.csv, args.dataset)
+        print(f"Cleaned dataset saved as: {args.csv}")
@@ -0,0 +1,40 @@
+import json
+
+import pandas as pd
+
+# Cluster membership for the priority pipelines. A pipeline config either
+# lists the bins of each cluster itself or points at a membership table such
+# as clusters_of_mumbai_dataset.csv (one row per bin with its cluster label).
+
+
+def read_membership(csv_path, bin_column="Bin Id's", cluster_column="knn_cluster"):
+    df = pd.read_csv(csv_path, usecols=[bin_column, cluster_column])
+    return {
+        cluster: group[bin_column].tolist()
+        for cluster, group in df.groupby(cluster_column, sort=True)
+    }
+
+
+def load_pipeline_config(path):
+    with open(path) as f:
+        config = json.load(f)
+
+    if "membership" in config:
+        membership = config["membership"]
+        config["clusters"] = read_membership(
+            membership["path"],
+            membership.get("bin_column", "Bin Id's"),
+            membership.get("cluster_column", "knn_cluster"),
+        )
+    if not config.get("clusters"):
+        raise ValueError(f"{path} defines no clusters")
+    return config
+
+
+def cluster_of(clusters):
+    # Bin -> cluster lookup; a bin listed in several clusters keeps the first
+    lookup = {}
+    for cluster, bin_ids in clusters.items():
+        for bin_id in bin_ids:
+            lookup.setdefault(bin_id, cluster)
+    return lookup
@@ -0,0 +1,132 @@
+import argparse
+import asyncio
+import time
+
+import numpy as np
+import pandas as pd
+
+from Pipeline.http_server import request_json
+
+# Simulated NodeMCU fleet for exercising the ingestion server locally. Each
+# device is a bin whose rubbish level rises by a random amount every reading
+# interval and drops to empty once it is nearly full; it reports the
+# ultrasonic distance from the lid like the HC-SR04 firmware does. Devices
+# share a few keep-alive connections, and simulated time can run faster than
+# real time, so a day of 10-minute readings takes seconds.
+
+
+async def run_connection(
+    host, port, bin_ids, start, readings, interval, speedup, depth_cm, seed, stats
+):
+    rng = np.random.default_rng(seed)
+    reader, writer = await asyncio.open_connection(host, port)
+    filled = rng.uniform(0, 0.5, len(bin_ids))
+    try:
+        for tick in range(readings):
+            tick_started = time.perf_counter()
+            timestamp = (start + tick * pd.Timedelta(seconds=interval)).isoformat()
+            filled += rng.gamma(2.0, 0.01, len(bin_ids))
+            filled[filled > 0.95] = 0.0
+            distance = depth_cm * (1 - np.minimum(filled, 1.0))
+
+            for bin_id, d in zip(bin_ids, distance):
+                reading = {
+                    "bin_id": int(bin_id),
+                    "timestamp": timestamp,
+                    "distance_cm": round(float(d), 1),
+                }
+                while True:
+                    sent = time.perf_counter()
+                    status, _ = await request_json(
+                        reader, writer, "POST", "/readings", reading
+                    )
+                    stats["latency"].append(time.perf_counter() - sent)
+                    if status != 503:
+                        break
+                    # Back-pressure from the server: wait and resend
+                    stats["retries"] += 1
+                    await asyncio.sleep(1)
+                stats["sent"] += 1
+
+            remaining = interval / speedup - (time.perf_counter() - tick_started)
+            if remaining > 0:
+                await asyncio.sleep(remaining)
+    finally:
+        writer.close()
+
+
+async def simulate(
+    host="127.0.0.1",
+    port=8000,
+    n_bins=1000,
+    readings=144,
+    interval=600,
+    speedup=600.0,
+    connections=16,
+    first_bin_id=1,
+    depth_cm=100.0,
+    seed=0,
+):
+    start = pd.Timestamp.now().floor("D") - pd.Timedelta(seconds=interval * readings)
+    bin_ids = np.arange(first_bin_id, first_bin_id + n_bins)
+    stats = {"sent": 0, "retries": 0, "latency": []}
+    wall_start = time.perf_counter()
+    await asyncio.gather(
+        *(
+            run_connection(
+                host,
+                port,
+                shard,
+                start,
+                readings,
+                interval,
+                speedup,
+                depth_cm,
+                [seed, i],
+                stats,
+            )
+            for i, shard in enumerate(np.array_split(bin_ids, connections))
+            if len(shard)
+        )
+    )
+    wall = time.perf_counter() - wall_start
+    latency = np.asarray(stats["latency"]) * 1000
+    print(
+        f"{stats['sent']} readings from {n_bins} bins in {wall:.1f}s "
+        f"({stats['sent'] / wall:.0f}/s), {stats['retries']} retries after 503"
+    )
+    print(
+        f"Request latency ms: p50 {np.percentile(latency, 50):.2f}, "
+        f"p99 {np.percentile(latency, 99):.2f}, max {latency.max():.2f}"
+    )
+    return stats
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Simulated NodeMCU bin fleet")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--bins", type=int, default=1000)
+    parser.add_argument("--readings", type=int, default=144)
+    parser.add_argument("--interval", type=int, default=600)
+    parser.add_argument("--speedup", type=float, default=600.0)
+    parser.add_argument("--connections", type=int, default=16)
+    parser.add_argument("--first-bin-id", type=int, default=1)
+    parser.add_argument("--depth-cm", type=float, default=100.0)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    asyncio.run(
+        simulate(
+            args.host,
+            args.port,
+            args.bins,
+            args.readings,
+            args.interval,
+            args.speedup,
+            args.connections,
+            args.first_bin_id,
+            args.depth_cm,
+            args.seed,
+        )
+    )
@@ -0,0 +1,84 @@
+import hashlib
+import json
+import os
+import zipfile
+
+import numpy as np
+
+from Pipeline.model_store import history_hash
+
+# Content-addressed cache of fitted components and forecasts. An entry's key
+# is a hash of the training data and of everything that configures the model
+# (orders, seasonal periods, LSTM settings, horizon), so a changed reading or
+# setting gives a new key and stale entries are simply never hit again. Each
+# entry is one .npz file; hits refresh its mtime, and once the directory
+# grows past max_bytes the least recently used entries are deleted.
+
+
+def forecast_key(data, model, **config):
+    # data is one series, or a dict of series for models trained on several
+    # bins at once
+    if isinstance(data, dict):
+        data_hash = {str(bin_id): history_hash(data[bin_id]) for bin_id in data}
+    else:
+        data_hash = history_hash(data)
+    payload = json.dumps(
+        {"model": model, "config": config, "data": data_hash},
+        sort_keys=True,
+        default=str,
+    )
+    return hashlib.sha1(payload.encode()).hexdigest()
+
+
+class ForecastCache:
+    def __init__(self, directory, max_bytes=256 * 2**20):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.npz")
+
+    def load(self, key):
+        path = self._path(key)
+        try:
+            with np.load(path) as entry:
+                record = {name: entry[name] for name in entry.files}
+        except FileNotFoundError:
+            return None
+        except (zipfile.BadZipFile, EOFError, OSError, ValueError):
+            # A truncated or corrupt entry is a miss; it is deleted so the
+            # forecast is recomputed and saved again
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            return None
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            # Evicted by another process since it was read
+            pass
+        return record
+
+    def save(self, key, record):
+        record = {name: np.asarray(value) for name, value in record.items()}
+        path = self._path(key)
+        tmp_path = f"{path}.tmp.npz"
+        np.savez(tmp_path, **record)
+        os.replace(tmp_path, path)
+        self._evict()
+        return record
+
+    def _evict(self):
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith(".npz") and ".tmp" not in name:
+                stat = os.stat(os.path.join(self.directory, name))
+                entries.append((stat.st_mtime, stat.st_size, name))
+        total = sum(size for _, size, _ in entries)
+        for _, size, name in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            os.remove(os.path.join(self.directory, name))
+            total -= size
@@ -0,0 +1,26 @@
+import numpy as np
+
+# Conversions to the 0-5 fullness scale the models are trained on. Raw levels
+# are on a 0-10 scale and are mapped with a lookup table indexed by the level
+# (the Australian and Mumbai data use different bucketings). Ultrasonic
+# sensors report the distance from the lid to the rubbish, which is turned
+# into a 0-10 level from the bin's depth first.
+
+AUSTRALIAN_SCALE = np.array([0, 1, 1, 2, 2, 3, 3, 4, 4, 5, 5], dtype=np.int8)
+MUMBAI_SCALE = np.array([0, 0, 1, 1, 2, 2, 3, 3, 4, 4, 5], dtype=np.int8)
+
+
+def remap_levels(levels, scale=AUSTRALIAN_SCALE):
+    # Values outside 0-10 raise an IndexError rather than being passed through
+    return scale[np.asarray(levels, dtype=np.intp)]
+
+
+def distance_to_level(distance_cm, depth_cm):
+    # A reading further than the depth (sensor seeing past the bottom) counts
+    # as empty
+    filled = 1 - np.asarray(distance_cm, dtype=np.float64) / depth_cm
+    return np.clip(np.rint(filled * 10), 0, 10).astype(np.int8)
+
+
+def distance_to_fullness(distance_cm, depth_cm, scale=AUSTRALIAN_SCALE):
+    return remap_levels(distance_to_level(distance_cm, depth_cm), scale)
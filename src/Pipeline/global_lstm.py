@@ -0,0 +1,136 @@
+import numpy as np
+from sklearn.preprocessing import MinMaxScaler
+from tensorflow.keras.layers import (
+    LSTM,
+    Concatenate,
+    Dense,
+    Embedding,
+    Flatten,
+    Input,
+    RepeatVector,
+)
+from tensorflow.keras.models import Model
+
+from Pipeline.rollout import recursive_forecast
+from Pipeline.windows import window_dataset
+
+# One residual LSTM shared by every bin. Windows from all bins are stacked
+# into a single training set and each window carries the index of its bin (or
+# cluster), which is looked up in an embedding and fed to the LSTM alongside
+# the residuals. The graph is built and compiled once for the whole fleet.
+
+
+def build_global_model(
+    time_steps, n_groups, units=50, embedding_dim=4, activation="relu"
+):
+    residuals = Input(shape=(time_steps, 1), name="residuals")
+    group = Input(shape=(1,), dtype="int32", name="group")
+    embedded = Flatten()(Embedding(n_groups, embedding_dim)(group))
+    features = Concatenate()([residuals, RepeatVector(time_steps)(embedded)])
+    hidden = LSTM(units, activation=activation)(features)
+    return Model([residuals, group], Dense(1)(hidden))
+
+
+class GlobalResidualLSTM:
+    def __init__(
+        self,
+        time_steps,
+        units=50,
+        embedding_dim=4,
+        optimizer="adam",
+        groups=None,
+    ):
+        # groups maps a bin ID to the label it is embedded by (e.g. its
+        # cluster); by default every bin gets its own embedding
+        self.time_steps = time_steps
+        self.units = units
+        self.embedding_dim = embedding_dim
+        self.optimizer = optimizer
+        self.groups = groups
+        self.model = None
+
+    def _group_of(self, bin_id):
+        return self.groups.get(bin_id, bin_id) if self.groups else bin_id
+
+    def fit(self, residuals_by_bin, epochs=20, batch_size=256, verbose=0, seed=None):
+        self.scalers, self.scaled = {}, {}
+        labels = dict.fromkeys(self._group_of(bin_id) for bin_id in residuals_by_bin)
+        self.group_index = {label: i for i, label in enumerate(labels)}
+
+        for bin_id, residuals in residuals_by_bin.items():
+            residuals = np.asarray(residuals, dtype=np.float64)
+            residuals = residuals[~np.isnan(residuals)]
+            if len(residuals) <= self.time_steps:
+                print(f"Skipping Bin {bin_id}: not enough residuals for the LSTM")
+                continue
+
+            scaler = MinMaxScaler()
+            scaled = scaler.fit_transform(residuals.reshape(-1, 1)).ravel()
+            self.scalers[bin_id], self.scaled[bin_id] = scaler, scaled
+
+        if not self.scaled:
+            raise ValueError("No bin has enough residuals to train the LSTM")
+
+        # Windows are streamed batch by batch from views over the scaled
+        # series instead of being stacked into one array up front
+        dataset = window_dataset(
+            self.scaled,
+            self.time_steps,
+            batch_size,
+            group_ids=[self.group_index[self._group_of(b)] for b in self.scaled],
+            with_groups=True,
+            seed=seed,
+        )
+        self.model = build_global_model(
+            self.time_steps, len(self.group_index), self.units, self.embedding_dim
+        )
+        self.model.compile(optimizer=self.optimizer, loss="mse")
+        self.model.fit(dataset, epochs=epochs, shuffle=False, verbose=verbose)
+        return self
+
+    def update(
+        self, new_residuals_by_bin, epochs=1, batch_size=256, verbose=0, seed=None
+    ):
+        # Appends new residuals, scaled with each bin's existing scaler, and
+        # continues training the same network on just the windows that end
+        # in the new readings instead of training a new one from scratch
+        recent = {}
+        for bin_id, residuals in new_residuals_by_bin.items():
+            if bin_id not in self.scaled:
+                continue
+            residuals = np.asarray(residuals, dtype=np.float64)
+            residuals = residuals[~np.isnan(residuals)]
+            if not len(residuals):
+                continue
+            scaled = self.scalers[bin_id].transform(residuals.reshape(-1, 1)).ravel()
+            self.scaled[bin_id] = np.concatenate([self.scaled[bin_id], scaled])
+            recent[bin_id] = self.scaled[bin_id][-(len(scaled) + self.time_steps) :]
+
+        if recent and epochs:
+            dataset = window_dataset(
+                recent,
+                self.time_steps,
+                batch_size,
+                group_ids=[self.group_index[self._group_of(b)] for b in recent],
+                with_groups=True,
+                seed=seed,
+            )
+            self.model.fit(dataset, epochs=epochs, shuffle=False, verbose=verbose)
+        return self
+
+    def forecast(self, steps):
+        # Recursive forecast for every fitted bin at once, one model call per
+        # step on a (n_bins, time_steps, 1) batch
+        bin_ids = list(self.scaled)
+        windows = np.stack([self.scaled[b][-self.time_steps :] for b in bin_ids])
+        group_ids = np.array(
+            [self.group_index[self._group_of(bin_id)] for bin_id in bin_ids]
+        )
+        preds = recursive_forecast(self.model, windows, steps, [group_ids])
+
+        return {
+            bin_id: self.scalers[bin_id]
+            .inverse_transform(preds[i].reshape(-1, 1))
+            .flatten()
+            for i, bin_id in enumerate(bin_ids)
+        }
@@ -0,0 +1,121 @@
+import asyncio
+import json
+from urllib.parse import parse_qs, urlsplit
+
+# Minimal HTTP/1.1 JSON server on asyncio streams, enough for the device
+# ingestion and query endpoints without a web framework. A handler is an
+# async function (method, path, query, body) -> (status, payload[, headers])
+# where query maps parameter names to their last value and payload is
+# serialized as JSON. Connections are kept alive between requests.
+
+REASONS = {
+    200: "OK",
+    202: "Accepted",
+    400: "Bad Request",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    413: "Payload Too Large",
+    500: "Internal Server Error",
+    503: "Service Unavailable",
+}
+
+
+class HttpError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+async def _read_request(reader, max_body):
+    request_line = await reader.readline()
+    if not request_line:
+        return None
+    try:
+        method, target, _ = request_line.decode("latin-1").split(" ", 2)
+    except ValueError:
+        raise HttpError(400, "Malformed request line")
+
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+
+    length = int(headers.get("content-length", 0))
+    if length > max_body:
+        raise HttpError(413, f"Body larger than {max_body} bytes")
+    body = await reader.readexactly(length) if length else b""
+
+    url = urlsplit(target)
+    query = {name: values[-1] for name, values in parse_qs(url.query).items()}
+    return method.upper(), url.path, query, body, headers
+
+
+def _response(status, payload, headers=None, keep_alive=True):
+    body = json.dumps(payload, default=str).encode()
+    lines = [
+        f"HTTP/1.1 {status} {REASONS.get(status, '')}",
+        "Content-Type: application/json",
+        f"Content-Length: {len(body)}",
+        f"Connection: {'keep-alive' if keep_alive else 'close'}",
+    ]
+    lines += [f"{name}: {value}" for name, value in (headers or {}).items()]
+    return ("\r\n".join(lines) + "\r\n\r\n").encode() + body
+
+
+async def serve_http(handler, host="0.0.0.0", port=8000, max_body=1 << 20):
+    async def connection(reader, writer):
+        try:
+            while True:
+                try:
+                    request = await _read_request(reader, max_body)
+                    if request is None:
+                        break
+                    method, path, query, body, headers = request
+                    result = await handler(method, path, query, body)
+                    status, payload = result[:2]
+                    extra = result[2] if len(result) > 2 else None
+                    keep_alive = headers.get("connection", "").lower() != "close"
+                except HttpError as error:
+                    status, extra, keep_alive = error.status, None, False
+                    payload = {"error": error.message}
+                except Exception as error:
+                    status, extra, keep_alive = 500, None, False
+                    payload = {"error": f"{type(error).__name__}: {error}"}
+                writer.write(_response(status, payload, extra, keep_alive))
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    return await asyncio.start_server(connection, host, port)
+
+
+async def request_json(reader, writer, method, path, payload=None):
+    # Client side of the same protocol, over an already open connection
+    body = b"" if payload is None else json.dumps(payload).encode()
+    writer.write(
+        (
+            f"{method} {path} HTTP/1.1\r\nHost: envirosage\r\n"
+            f"Content-Type: application/json\r\nContent-Length: {len(body)}\r\n\r\n"
+        ).encode()
+        + body
+    )
+    await writer.drain()
+
+    status = int((await reader.readline()).split()[1])
+    length = 0
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        if name.strip().lower() == "content-length":
+            length = int(value)
+    return status, json.loads(await reader.readexactly(length)) if length else None
@@ -0,0 +1,378 @@
+import argparse
+import asyncio
+import json
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+from Pipeline.bin_store import BinStore
+from Pipeline.fullness import AUSTRALIAN_SCALE, distance_to_fullness, remap_levels
+from Pipeline.http_server import serve_http
+from Pipeline.online_es import OnlineHoltWinters
+
+# Ingestion service for the NodeMCU bins. Devices POST readings to /readings
+# (one JSON object or a list), each with a bin_id, an optional ISO timestamp
+# and either the ultrasonic distance_cm (plus the bin's depth_cm if it is not
+# the default) or a 0-10 level. Readings are validated and converted to the
+# 0-5 fullness scale on the request path and queued; a single batcher task
+# drains the queue in micro-batches, feeds every reading to the streaming
+# forecaster and buffers them per bin until a whole part is worth writing to
+# the bin store, where a bin is compacted into one part once it has more
+# than max_parts of them. Requests that would push the backlog past
+# max_pending are refused with 503 and a Retry-After header, so a slow disk
+# or forecaster pushes back on the devices instead of growing memory without
+# bound.
+# Timestamps are kept as naive UTC: timestamps with an offset are converted,
+# and ones without are read in the feed's configured timezone.
+
+MAX_CLOCK_SKEW = pd.Timedelta(minutes=5)
+
+
+def utc_now():
+    return pd.Timestamp.now(tz="UTC").tz_localize(None)
+
+
+def parse_reading(
+    item, default_depth_cm, scale=AUSTRALIAN_SCALE, now=None, timezone="UTC"
+):
+    if not isinstance(item, dict):
+        raise ValueError("reading must be a JSON object")
+    try:
+        bin_id = int(item["bin_id"])
+    except (KeyError, TypeError, ValueError):
+        raise ValueError("bin_id must be an integer")
+
+    now = now or utc_now()
+    if "timestamp" in item:
+        try:
+            timestamp = pd.Timestamp(item["timestamp"])
+        except (TypeError, ValueError):
+            raise ValueError("timestamp must be an ISO date and time")
+        if pd.isna(timestamp):
+            raise ValueError("timestamp must be an ISO date and time")
+        if timestamp.tzinfo is None:
+            # Wall-clock times that a DST change skips or repeats are rejected
+            timestamp = timestamp.tz_localize(
+                timezone, ambiguous="NaT", nonexistent="NaT"
+            )
+            if pd.isna(timestamp):
+                raise ValueError(f"timestamp is ambiguous or invalid in {timezone}")
+        timestamp = timestamp.tz_convert(None)
+    else:
+        timestamp = now
+    if timestamp > now + MAX_CLOCK_SKEW:
+        raise ValueError(f"timestamp {timestamp} is in the future")
+
+    if "distance_cm" in item:
+        try:
+            distance = float(item["distance_cm"])
+            depth = float(item.get("depth_cm", default_depth_cm))
+        except (TypeError, ValueError):
+            raise ValueError("distance_cm and depth_cm must be numbers")
+        if not (
+            np.isfinite(distance) and np.isfinite(depth) and distance >= 0 and depth > 0
+        ):
+            raise ValueError("distance_cm must be >= 0 and depth_cm > 0")
+        fullness = int(distance_to_fullness(distance, depth, scale))
+    elif "level" in item:
+        level = item["level"]
+        if (
+            not isinstance(level, int)
+            or isinstance(level, bool)
+            or not 0 <= level <= 10
+        ):
+            raise ValueError("level must be an integer from 0 to 10")
+        fullness = int(remap_levels(level, scale))
+    else:
+        raise ValueError("reading needs distance_cm or level")
+    return bin_id, timestamp, fullness
+
+
+class ForecastUpdater:
+    # Keeps an online Holt-Winters state per bin. A bin becomes ready once
+    # min_history readings are known for it (from the store plus new
+    # readings); its first parameter estimate is the only expensive step, so
+    # ready bins are fitted a few at a time within a time budget per batch.
+    # After that each reading is one O(1) update and the bin's next-horizon
+    # forecast is refreshed.
+
+    def __init__(
+        self,
+        store,
+        seasonal_periods=144,
+        horizon=144,
+        trend=None,
+        refit_every=None,
+        min_history=None,
+    ):
+        self.store = store
+        self.horizon = horizon
+        self.model = OnlineHoltWinters(seasonal_periods, trend, refit_every)
+        self.min_history = min_history or 2 * seasonal_periods
+        self.pending = {}
+        self.ready = {}
+        self.latest = {}
+
+    def _history(self, bin_id):
+        if bin_id not in self.pending:
+            self.pending[bin_id] = (
+                list(self.store.series(bin_id).values) if bin_id in self.store else []
+            )
+        return self.pending[bin_id]
+
+    def update(self, bin_id, timestamp, fullness):
+        if bin_id in self.model.states:
+            self.model.update(bin_id, fullness)
+            self.latest[bin_id] = (
+                timestamp,
+                self.model.forecast(bin_id, self.horizon),
+            )
+            return
+        history = self._history(bin_id)
+        history.append(fullness)
+        if len(history) >= self.min_history:
+            self.ready[bin_id] = timestamp
+
+    def fit_ready(self, budget_seconds):
+        deadline = time.perf_counter() + budget_seconds
+        while self.ready and time.perf_counter() < deadline:
+            bin_id = next(iter(self.ready))
+            timestamp = self.ready.pop(bin_id)
+            self.model.fit(bin_id, self.pending.pop(bin_id))
+            self.latest[bin_id] = (timestamp, self.model.forecast(bin_id, self.horizon))
+
+
+class IngestServer:
+    def __init__(
+        self,
+        store,
+        forecaster=None,
+        depth_cm=100.0,
+        scale=AUSTRALIAN_SCALE,
+        batch_size=5000,
+        batch_interval=1.0,
+        max_pending=200_000,
+        rows_per_part=144,
+        flush_interval=3600.0,
+        max_parts=48,
+        fit_budget=0.2,
+        timezone="UTC",
+    ):
+        # Fails here rather than on the first reading if the name is unknown
+        pd.Timestamp.now(tz=timezone)
+        self.store = store
+        self.forecaster = forecaster
+        self.depth_cm = depth_cm
+        self.scale = scale
+        self.batch_size = batch_size
+        self.batch_interval = batch_interval
+        self.max_pending = max_pending
+        self.rows_per_part = rows_per_part
+        self.flush_interval = flush_interval
+        self.max_parts = max_parts
+        self.fit_budget = fit_budget
+        self.timezone = timezone
+
+        self.queue = asyncio.Queue()
+        self.pending = 0
+        self.buffered = 0
+        self.buffers = {}
+        self.buffered_since = {}
+        self.last_seen = {
+            bin_id: ts for bin_id, ts in store.last_timestamps().items() if ts
+        }
+        self.counts = {
+            "accepted": 0,
+            "rejected": 0,
+            "stale": 0,
+            "written": 0,
+            "compacted": 0,
+        }
+        self.store_lock = threading.Lock()
+
+    async def handle(self, method, path, query, body):
+        if path == "/readings":
+            if method != "POST":
+                return 405, {"error": "use POST"}
+            return self.accept(body)
+        if path == "/health":
+            return 200, {
+                "pending": self.pending,
+                "buffered": self.buffered,
+                "bins": len(self.last_seen),
+                "forecasts": len(self.forecaster.latest) if self.forecaster else 0,
+                **self.counts,
+            }
+        return 404, {"error": f"no route {path}"}
+
+    def accept(self, body):
+        try:
+            items = json.loads(body)
+        except ValueError:
+            return 400, {"error": "body is not valid JSON"}
+        if not isinstance(items, list):
+            items = [items]
+
+        if self.pending + len(items) > self.max_pending:
+            return 503, {"error": "ingest backlog is full"}, {"Retry-After": "1"}
+
+        readings, errors = [], []
+        now = utc_now()
+        for i, item in enumerate(items):
+            try:
+                readings.append(
+                    parse_reading(item, self.depth_cm, self.scale, now, self.timezone)
+                )
+            except ValueError as error:
+                errors.append({"index": i, "error": str(error)})
+        self.counts["rejected"] += len(errors)
+        if not readings:
+            return 400, {"accepted": 0, "rejected": errors}
+
+        self.pending += len(readings)
+        self.queue.put_nowait(readings)
+        return 202, {"accepted": len(readings), "rejected": errors}
+
+    async def batcher(self):
+        # Runs until it takes the None that run() queues on shutdown, so
+        # every reading accepted before that is still processed
+        loop = asyncio.get_running_loop()
+        stopping = False
+        while not stopping:
+            try:
+                batch = await asyncio.wait_for(self.queue.get(), self.flush_interval)
+            except asyncio.TimeoutError:
+                # Quiet period: still write out buffers that have waited long
+                await loop.run_in_executor(None, self.flush)
+                continue
+            if batch is None:
+                break
+            deadline = loop.time() + self.batch_interval
+            while len(batch) < self.batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    readings = await asyncio.wait_for(self.queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if readings is None:
+                    stopping = True
+                    break
+                batch += readings
+            # The forecaster and Parquet writes are CPU/disk bound and run
+            # off the event loop; the pending count only drops once they are
+            # done, which is what throttles the devices
+            await loop.run_in_executor(None, self.process, batch)
+            self.pending -= len(batch)
+
+    def process(self, batch):
+        batch.sort(key=lambda reading: (reading[0], reading[1]))
+        for bin_id, timestamp, fullness in batch:
+            last = self.last_seen.get(bin_id)
+            if last is not None and timestamp <= last:
+                # Duplicate or out-of-order reading
+                self.counts["stale"] += 1
+                continue
+            self.last_seen[bin_id] = timestamp
+            self.buffers.setdefault(bin_id, []).append((timestamp, fullness))
+            self.buffered += 1
+            self.buffered_since.setdefault(bin_id, time.monotonic())
+            if self.forecaster is not None:
+                self.forecaster.update(bin_id, timestamp, fullness)
+            self.counts["accepted"] += 1
+        if self.forecaster is not None:
+            self.forecaster.fit_ready(self.fit_budget)
+        self.flush()
+
+    def flush(self, force=False):
+        # Write out the bins with a full part's worth of readings, or whose
+        # oldest buffered reading has waited flush_interval seconds
+        now = time.monotonic()
+        ready = [
+            bin_id
+            for bin_id, rows in self.buffers.items()
+            if force
+            or len(rows) >= self.rows_per_part
+            or now - self.buffered_since[bin_id] >= self.flush_interval
+        ]
+        if not ready:
+            return
+        frames = []
+        for bin_id in ready:
+            rows = self.buffers.pop(bin_id)
+            del self.buffered_since[bin_id]
+            timestamps, fullness = zip(*rows)
+            frames.append(
+                pd.DataFrame(
+                    {
+                        "bin_id": bin_id,
+                        "timestamp": pd.DatetimeIndex(timestamps),
+                        "Fullness": np.asarray(fullness, dtype=np.int8),
+                    }
+                )
+            )
+        written = sum(len(frame) for frame in frames)
+        with self.store_lock:
+            self.store.append(pd.concat(frames, ignore_index=True))
+            for bin_id in ready:
+                self.counts["compacted"] += self.store.compact(bin_id, self.max_parts)
+        self.buffered -= written
+        self.counts["written"] += written
+
+    async def run(self, host="0.0.0.0", port=8000):
+        server = await serve_http(self.handle, host, port)
+        batcher = asyncio.create_task(self.batcher())
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            # Readings that were already accepted are not dropped on shutdown
+            self.queue.put_nowait(None)
+            await batcher
+            self.flush(force=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Bin reading ingestion server")
+    parser.add_argument("--store", default="live_store")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--depth-cm", type=float, default=100.0)
+    parser.add_argument("--batch-size", type=int, default=5000)
+    parser.add_argument("--batch-interval", type=float, default=1.0)
+    parser.add_argument("--max-pending", type=int, default=200_000)
+    parser.add_argument("--rows-per-part", type=int, default=144)
+    parser.add_argument(
+        "--max-parts", type=int, default=48, help="Compact a bin past this many parts"
+    )
+    parser.add_argument("--seasonal-periods", type=int, default=144)
+    parser.add_argument(
+        "--timezone", default="UTC", help="Timezone of timestamps without an offset"
+    )
+    parser.add_argument("--no-forecast", action="store_true")
+    args = parser.parse_args()
+
+    store = BinStore(args.store)
+    forecaster = (
+        None
+        if args.no_forecast
+        else ForecastUpdater(store, args.seasonal_periods, args.seasonal_periods)
+    )
+    server = IngestServer(
+        store,
+        forecaster,
+        depth_cm=args.depth_cm,
+        batch_size=args.batch_size,
+        batch_interval=args.batch_interval,
+        max_pending=args.max_pending,
+        rows_per_part=args.rows_per_part,
+        max_parts=args.max_parts,
+        timezone=args.timezone,
+    )
+    try:
+        asyncio.run(server.run(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
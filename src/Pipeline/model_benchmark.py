@@ -0,0 +1,422 @@
+import argparse
+import datetime
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+import warnings
+
+import numpy as np
+import pandas as pd
+
+from Pipeline.fullness import MUMBAI_SCALE, remap_levels
+
+# Speed and accuracy benchmark for the model families. A synthetic fleet of
+# any size is generated with generate.py's vectorized engine (Mumbai-style
+# bins, 12 readings a day, remapped to the 0-5 scale like the cleaners do),
+# the last `steps` readings of every bin are held out, and each family is
+# fitted and forecast on every bin. Hybrids stack their components the way
+# the Final_Models scripts do: each component is fitted to the residuals of
+# the ones before it and the forecasts are summed.
+#
+# Every family runs in its own fresh process, so its peak memory is its own:
+# the max RSS of that process and how far it rose above the RSS the process
+# started the family with (which counts TensorFlow for the LSTM families).
+# Memory is not traced allocation by allocation, since that would distort
+# the timings. The LSTM is one global
+# network for the fleet, so its per-bin times are the fleet time divided by
+# the number of bins. Results go to one JSON file per run, tagged with the
+# git commit, and --compare prints the change between two such files.
+
+REPO_ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..")
+GENERATOR_DIR = os.path.join(REPO_ROOT, "research", "Generation_Cleaning", "Indian")
+CLUSTERS_CSV = os.path.join(REPO_ROOT, "Datasets", "clusters_of_mumbai_dataset.csv")
+
+FAMILIES = {
+    "arima": ["arima"],
+    "sarima": ["sarima"],
+    "es": ["es"],
+    "lstm": ["lstm"],
+    "es_sarima": ["es", "sarima"],
+    "sarima_es": ["sarima", "es"],
+    "es_lstm": ["es", "lstm"],
+    "sarima_lstm": ["sarima", "lstm"],
+    "es_sarima_lstm": ["es", "sarima", "lstm"],
+}
+
+
+def synthetic_fleet(n_bins, days, seed=0, clusters_csv=CLUSTERS_CSV):
+    # Bins are drawn (with replacement) from the Mumbai locations and given
+    # new ids, so clusters and holiday effects follow the real layout
+    if GENERATOR_DIR not in sys.path:
+        sys.path.append(GENERATOR_DIR)
+    import random
+
+    from generate import (
+        HolidayCalendar,
+        categorize_bins,
+        ensure_religion_diversity,
+        generate_waste_frame,
+        get_holidays,
+        load_bin_data,
+    )
+
+    rng = random.Random(seed)
+    bin_df = load_bin_data(clusters_csv, rng)
+    bin_df = bin_df.sample(n_bins, replace=True, random_state=seed).reset_index(
+        drop=True
+    )
+    bin_df["Bin Id's"] = np.arange(1, n_bins + 1)
+    bin_df = ensure_religion_diversity(bin_df, rng)
+    hindu_holidays, islamic_holidays = get_holidays()
+    calendar = HolidayCalendar({"hindu": hindu_holidays, "islamic": islamic_holidays})
+    start_date = datetime.date(2024, 1, 1)
+    frame = generate_waste_frame(
+        bin_df,
+        categorize_bins(bin_df, rng),
+        start_date,
+        start_date + datetime.timedelta(days=days - 1),
+        calendar,
+        seed=seed,
+    )
+    fullness = remap_levels(frame["filled_capacity"].to_numpy(), MUMBAI_SCALE)
+    return {
+        bin_id: fullness[rows].astype(np.float64)
+        for bin_id, rows in frame.groupby("dustbin_id").indices.items()
+    }
+
+
+def _fit_statsmodels(component, values, seasonal_periods):
+    from statsmodels.tsa.holtwinters import ExponentialSmoothing
+    from statsmodels.tsa.statespace.sarimax import SARIMAX
+
+    if component == "arima":
+        fit = SARIMAX(values, order=(1, 1, 1)).fit(disp=False)
+    elif component == "sarima":
+        fit = SARIMAX(
+            values, order=(1, 1, 1), seasonal_order=(1, 1, 1, seasonal_periods)
+        ).fit(disp=False)
+    else:
+        fit = ExponentialSmoothing(
+            values, trend="add", seasonal="add", seasonal_periods=seasonal_periods
+        ).fit()
+    return fit, np.asarray(fit.fittedvalues)
+
+
+def run_family(family, train, steps, seasonal_periods, lstm_config):
+    # Returns one row per bin with fit and forecast seconds and the forecast
+    components = FAMILIES[family]
+    target = dict(train)
+    forecasts = {bin_id: np.zeros(steps) for bin_id in train}
+    fit_seconds = dict.fromkeys(train, 0.0)
+    forecast_seconds = dict.fromkeys(train, 0.0)
+    errors = {}
+
+    for component in components:
+        if component == "lstm":
+            from Pipeline.global_lstm import GlobalResidualLSTM
+
+            bins = [bin_id for bin_id in target if bin_id not in errors]
+            try:
+                started = time.perf_counter()
+                model = GlobalResidualLSTM(
+                    lstm_config["time_steps"], lstm_config["units"]
+                )
+                model.fit(
+                    {bin_id: target[bin_id] for bin_id in bins},
+                    epochs=lstm_config["epochs"],
+                    batch_size=lstm_config["batch_size"],
+                    seed=0,
+                )
+                fitted_at = time.perf_counter()
+                lstm_forecasts = model.forecast(steps)
+                done = time.perf_counter()
+            except Exception as error:
+                # The network is shared, so a failed fit fails every bin in it
+                for bin_id in bins:
+                    errors[bin_id] = f"{component}: {type(error).__name__}: {error}"
+                continue
+            # Bins with too few residuals for a window are left out of the fit
+            for bin_id in bins:
+                if bin_id not in lstm_forecasts:
+                    errors[bin_id] = f"{component}: not enough residuals"
+            for bin_id in lstm_forecasts:
+                fit_seconds[bin_id] += (fitted_at - started) / len(lstm_forecasts)
+                forecast_seconds[bin_id] += (done - fitted_at) / len(lstm_forecasts)
+                forecasts[bin_id] += lstm_forecasts[bin_id]
+            continue
+
+        for bin_id, values in target.items():
+            if bin_id in errors:
+                continue
+            try:
+                started = time.perf_counter()
+                fit, fitted = _fit_statsmodels(component, values, seasonal_periods)
+                fitted_at = time.perf_counter()
+                forecast = np.asarray(fit.forecast(steps))
+                forecast_seconds[bin_id] += time.perf_counter() - fitted_at
+            except Exception as error:
+                errors[bin_id] = f"{component}: {type(error).__name__}: {error}"
+                continue
+            fit_seconds[bin_id] += fitted_at - started
+            forecasts[bin_id] += forecast
+            target[bin_id] = values - fitted
+
+    return [
+        {
+            "bin_id": int(bin_id),
+            "fit_seconds": fit_seconds[bin_id],
+            "forecast_seconds": forecast_seconds[bin_id],
+            "forecast": None if bin_id in errors else forecasts[bin_id].tolist(),
+            "error": errors.get(bin_id),
+        }
+        for bin_id in train
+    ]
+
+
+def _max_rss_mb():
+    # ru_maxrss is in KiB on Linux and bytes on macOS
+    scale = 1 if sys.platform == "darwin" else 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale / 2**20
+
+
+def _measured_family(family, train, steps, seasonal_periods, lstm_config):
+    # Runs in the family's own process
+    warnings.simplefilter("ignore")
+    baseline = _max_rss_mb()
+    started = time.perf_counter()
+    rows = run_family(family, train, steps, seasonal_periods, lstm_config)
+    wall = time.perf_counter() - started
+    peak = _max_rss_mb()
+    return rows, {
+        "wall_seconds": wall,
+        "max_rss_mb": peak,
+        "rss_growth_mb": peak - baseline,
+    }
+
+
+def _git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=REPO_ROOT,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmark(
+    families=tuple(FAMILIES),
+    n_bins=20,
+    days=60,
+    steps=12,
+    seasonal_periods=12,
+    lstm_config=None,
+    seed=0,
+    isolate=True,
+):
+    lstm_config = {
+        "time_steps": 12,
+        "units": 50,
+        "epochs": 5,
+        "batch_size": 256,
+        **(lstm_config or {}),
+    }
+    series = synthetic_fleet(n_bins, days, seed)
+    train = {bin_id: values[:-steps] for bin_id, values in series.items()}
+    actual = {bin_id: values[-steps:] for bin_id, values in series.items()}
+
+    results = {
+        "meta": {
+            "commit": _git_commit(),
+            "created": datetime.datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "cpus": os.cpu_count(),
+            "config": {
+                "bins": n_bins,
+                "days": days,
+                "steps": steps,
+                "seasonal_periods": seasonal_periods,
+                "lstm": lstm_config,
+                "seed": seed,
+            },
+        },
+        "families": {},
+        "bins": [],
+    }
+    # Children inherit the environment, and TensorFlow reads this on import
+    os.environ.setdefault("TF_CPP_MIN_LOG_LEVEL", "3")
+    context = multiprocessing.get_context("spawn")
+    for family in families:
+        print(f"Benchmarking {family}...")
+        arguments = (family, train, steps, seasonal_periods, lstm_config)
+        if isolate:
+            with context.Pool(1) as pool:
+                rows, memory = pool.apply(_measured_family, arguments)
+        else:
+            rows, memory = _measured_family(*arguments)
+
+        errors = []
+        for row in rows:
+            forecast = row.pop("forecast")
+            if forecast is not None:
+                error = np.asarray(forecast) - actual[row["bin_id"]]
+                row["rmse"] = float(np.sqrt(np.mean(error**2)))
+                row["mae"] = float(np.mean(np.abs(error)))
+                errors.append(error)
+            results["bins"].append({"family": family, **row})
+
+        table = pd.DataFrame(rows)
+        pooled = np.concatenate(errors) if errors else np.array([np.nan])
+        results["families"][family] = {
+            "bins_ok": len(errors),
+            "bins_failed": len(rows) - len(errors),
+            "fit_seconds": float(table["fit_seconds"].sum()),
+            "fit_seconds_per_bin": float(table["fit_seconds"].mean()),
+            "forecast_ms_per_bin": float(table["forecast_seconds"].mean() * 1000),
+            "rmse": float(np.sqrt(np.mean(pooled**2))),
+            "mae": float(np.mean(np.abs(pooled))),
+            "rmse_per_bin_median": float(table.get("rmse", pd.Series()).median()),
+            **memory,
+        }
+    return results
+
+
+def summary_table(results):
+    return pd.DataFrame(results["families"]).T
+
+
+def within_budget(results, fleet_size, budget_seconds, workers=1):
+    # Families whose fit + forecast for the whole fleet (scaled from the
+    # per-bin times) fits the budget, most accurate first
+    table = summary_table(results)
+    seconds = (
+        (table["fit_seconds_per_bin"] + table["forecast_ms_per_bin"] / 1000)
+        * fleet_size
+        / workers
+    )
+    table = table.assign(projected_seconds=seconds)
+    return table[seconds <= budget_seconds].sort_values("rmse")
+
+
+def compare(before, after):
+    # Ratio after / before for the speed, memory and accuracy columns of the
+    # families present in both runs (> 1 means slower, bigger or worse)
+    columns = [
+        "fit_seconds_per_bin",
+        "forecast_ms_per_bin",
+        "max_rss_mb",
+        "rss_growth_mb",
+        "rmse",
+        "mae",
+    ]
+    old, new = summary_table(before), summary_table(after)
+    families = old.index.intersection(new.index)
+    columns = [c for c in columns if c in old.columns and c in new.columns]
+    return (
+        new.loc[families, columns].astype(float)
+        / old.loc[families, columns].astype(float)
+    ).round(3)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Model family benchmark")
+    parser.add_argument("--families", nargs="+", default=list(FAMILIES))
+    parser.add_argument("--bins", type=int, default=20)
+    parser.add_argument("--days", type=int, default=60)
+    parser.add_argument("--steps", type=int, default=12)
+    parser.add_argument("--seasonal-periods", type=int, default=12)
+    parser.add_argument("--lstm-epochs", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output-dir", default="benchmark_results")
+    parser.add_argument(
+        "--in-process",
+        action="store_true",
+        help="Run every family in this process (memory figures are then shared)",
+    )
+    parser.add_argument(
+        "--budget",
+        type=float,
+        nargs=2,
+        metavar=("FLEET_SIZE", "SECONDS"),
+        help="Also list the families that fit this fleet in this many seconds",
+    )
+    parser.add_argument(
+        "--compare",
+        nargs=2,
+        metavar=("BEFORE", "AFTER"),
+        help="Compare two result files instead of running",
+    )
+    args = parser.parse_args()
+
+    if args.compare:
+        with open(args.compare[0]) as f:
+            before = json.load(f)
+        with open(args.compare[1]) as f:
+            after = json.load(f)
+        print(
+            f"{after['meta']['commit']} relative to {before['meta']['commit']} "
+            "(> 1 is slower, bigger or less accurate):"
+        )
+        print(compare(before, after).to_string())
+        sys.exit()
+
+    unknown = set(args.families) - set(FAMILIES)
+    if unknown:
+        parser.error(
+            f"unknown families {sorted(unknown)}, choose from {list(FAMILIES)}"
+        )
+
+    results = run_benchmark(
+        args.families,
+        args.bins,
+        args.days,
+        args.steps,
+        args.seasonal_periods,
+        {"epochs": args.lstm_epochs},
+        args.seed,
+        isolate=not args.in_process,
+    )
+    os.makedirs(args.output_dir, exist_ok=True)
+    output = os.path.join(
+        args.output_dir,
+        f"{results['meta']['commit'] or 'nogit'}-"
+        f"{results['meta']['created'].replace(':', '')}.json",
+    )
+    with open(output, "w") as f:
+        json.dump(results, f, indent=1)
+
+    print(
+        summary_table(results)[
+            [
+                "bins_ok",
+                "fit_seconds_per_bin",
+                "forecast_ms_per_bin",
+                "max_rss_mb",
+                "rss_growth_mb",
+                "rmse",
+                "mae",
+            ]
+        ]
+        .astype(float)
+        .round(3)
+        .to_string()
+    )
+    if args.budget:
+        fleet_size, seconds = args.budget
+        print(f"\nFamilies that fit {int(fleet_size)} bins in {seconds:g}s:")
+        print(
+            within_budget(results, fleet_size, seconds)[["projected_seconds", "rmse"]]
+            .astype(float)
+            .round(3)
+            .to_string()
+        )
+    print(f"\nResults written to {output}")
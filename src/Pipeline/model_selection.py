@@ -0,0 +1,398 @@
+import argparse
+import json
+import os
+import time
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+# Seasonal period and SARIMA order selection for a bin or a cluster of bins.
+#
+# The period is read off the data: the periodograms of the (differenced,
+# standardized) series are averaged, the strongest peaks are turned into
+# candidate periods, and the candidate with the highest autocorrelation at
+# its lag wins. A period matters a lot for cost: the SARIMAX state vector
+# grows with (P + D) * m, so a wrong m of 35 instead of 7 makes every fit
+# several times slower for no gain.
+#
+# Orders are searched stepwise (Hyndman-Khandakar): a few starting models,
+# then the neighbours of the best one (p, q, P, Q one up or down) until no
+# neighbour improves the criterion. A cluster is scored on a sample of its
+# bins over a recent window, and a candidate is dropped as soon as it trails
+# the best model by more than prune_margin per bin fitted so far, so clearly
+# worse candidates cost one fit instead of one per sampled bin. Clusters are
+# searched in parallel, and the choice is cached per cluster so daily runs
+# only search again when the membership changed or the entry is too old.
+
+
+def autocorrelation(values, max_lag):
+    # Sample ACF up to max_lag via the FFT
+    values = np.asarray(values, dtype=np.float64)
+    values = values - values.mean()
+    n = len(values)
+    spectrum = np.fft.rfft(values, 2 * n)
+    acov = np.fft.irfft(spectrum * np.conj(spectrum))[: max_lag + 1]
+    return acov / acov[0] if acov[0] > 0 else np.zeros(max_lag + 1)
+
+
+def _prepared(values):
+    values = np.asarray(values, dtype=np.float64)
+    values = np.diff(values[~np.isnan(values)])
+    std = values.std()
+    return (values - values.mean()) / std if std > 0 else None
+
+
+def dominant_period(series_list, max_period=None, peaks=5, min_acf=0.2):
+    # Shared seasonal period of one or more series, or 0 if none has a
+    # clear one. Peaks of the pooled periodogram give the candidates (and
+    # their neighbours, as a frequency bin rarely lands on an exact period);
+    # the mean ACF at each candidate's lag decides.
+    prepared = [p for p in map(_prepared, series_list) if p is not None]
+    if not prepared:
+        return 0
+    n = min(len(p) for p in prepared)
+    max_period = min(max_period or n // 3, n // 3)
+    if max_period < 2:
+        return 0
+    spectrum = np.mean([np.abs(np.fft.rfft(p[-n:])) ** 2 for p in prepared], axis=0)
+    frequencies = np.arange(len(spectrum))
+    usable = (frequencies > 0) & (n / np.maximum(frequencies, 1) <= max_period)
+    usable &= n / np.maximum(frequencies, 1) >= 2
+    strongest = frequencies[usable][np.argsort(spectrum[usable])[::-1][:peaks]]
+
+    candidates = set()
+    for k in strongest:
+        period = int(round(n / k))
+        candidates.update(range(max(period - 1, 2), min(period + 1, max_period) + 1))
+    if not candidates:
+        return 0
+    acf = np.mean([autocorrelation(p, max_period) for p in prepared], axis=0)
+    # A multiple of the true period scores nearly as well; prefer the
+    # shortest candidate within 10% of the best
+    scores = {period: acf[period] for period in candidates}
+    best = max(scores.values())
+    if best < min_acf:
+        return 0
+    return min(period for period, score in scores.items() if score >= 0.9 * best)
+
+
+def seasonal_strength(values, period):
+    # 1 - var(remainder) / var(seasonal + remainder) after removing a
+    # centred moving-average trend and the mean seasonal profile
+    values = pd.Series(np.asarray(values, dtype=np.float64)).interpolate()
+    trend = values.rolling(period, center=True, min_periods=1).mean()
+    detrended = (values - trend).to_numpy()
+    phase = np.arange(len(detrended)) % period
+    profile = np.bincount(phase, weights=detrended, minlength=period) / np.bincount(
+        phase, minlength=period
+    )
+    remainder = detrended - profile[phase]
+    variance = detrended.var()
+    return max(0.0, 1 - remainder.var() / variance) if variance > 0 else 0.0
+
+
+def differencing_orders(values, period, max_d=2, alpha=0.05):
+    # (d, D): one seasonal difference if the seasonality is strong, then
+    # KPSS tests for the number of ordinary differences
+    from statsmodels.tsa.stattools import kpss
+
+    values = np.asarray(values, dtype=np.float64)
+    values = values[~np.isnan(values)]
+    D = int(period > 1 and seasonal_strength(values, period) >= 0.64)
+    if D:
+        values = values[period:] - values[:-period]
+    d = 0
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        while d < max_d and len(values) > 10 and np.ptp(values) > 0:
+            if kpss(values, regression="c", nlags="auto")[1] >= alpha:
+                break
+            values = np.diff(values)
+            d += 1
+    return d, D
+
+
+def _score(values, order, seasonal_order, criterion, maxiter):
+    from statsmodels.tsa.statespace.sarimax import SARIMAX
+
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        try:
+            fit = SARIMAX(values, order=order, seasonal_order=seasonal_order).fit(
+                disp=False, maxiter=maxiter
+            )
+        except (np.linalg.LinAlgError, ValueError):
+            return np.inf
+    score = getattr(fit, criterion)
+    return score if np.isfinite(score) else np.inf
+
+
+def search_order(
+    series_list,
+    period,
+    criterion="aic",
+    max_p=3,
+    max_q=3,
+    max_P=1,
+    max_Q=1,
+    window=None,
+    sample_bins=5,
+    prune_margin=10.0,
+    maxiter=50,
+    seed=0,
+):
+    # Stepwise search for one set of series sharing an order. Returns
+    # (order, seasonal_order, mean criterion per bin, number of models fitted).
+    rng = np.random.default_rng(seed)
+    series_list = [np.asarray(s, dtype=np.float64) for s in series_list]
+    series_list = [s[~np.isnan(s)] for s in series_list]
+    if len(series_list) > sample_bins:
+        picks = rng.choice(len(series_list), sample_bins, replace=False)
+        series_list = [series_list[i] for i in sorted(picks)]
+    # A recent window bounds the cost of every fit; by default 20 seasons
+    window = window or max(20 * period, 200)
+    series_list = [s[-window:] for s in series_list]
+
+    seasonal = period > 1
+    # The differencing most of the sampled bins need
+    d, D = (
+        int(np.median(column))
+        for column in zip(*(differencing_orders(s, period) for s in series_list))
+    )
+    if not seasonal:
+        max_P = max_Q = 0
+
+    def models(p, q, P, Q):
+        return (p, d, q), (P, D, Q, period if seasonal else 0)
+
+    scores = {}
+
+    def evaluate(candidate, best_scores):
+        # Per-bin criterion of one (p, q, P, Q), or None once it trails the
+        # best per-bin scores by more than prune_margin per bin
+        order, seasonal_order = models(*candidate)
+        per_bin = []
+        for i, values in enumerate(series_list):
+            per_bin.append(_score(values, order, seasonal_order, criterion, maxiter))
+            if best_scores is not None:
+                gap = sum(per_bin) - sum(best_scores[: i + 1])
+                if gap > prune_margin * (i + 1):
+                    return None
+        return per_bin
+
+    def valid(candidate):
+        p, q, P, Q = candidate
+        return (
+            0 <= p <= max_p and 0 <= q <= max_q and 0 <= P <= max_P and 0 <= Q <= max_Q
+        )
+
+    starts = [(2, 2, 1, 1), (0, 0, 0, 0), (1, 0, 1, 0), (0, 1, 0, 1)]
+    best, best_scores = None, None
+    for candidate in dict.fromkeys(
+        tuple(min(v, m) for v, m in zip(c, (max_p, max_q, max_P, max_Q)))
+        for c in starts
+    ):
+        per_bin = evaluate(candidate, best_scores)
+        scores[candidate] = per_bin
+        if per_bin is not None and (best is None or sum(per_bin) < sum(best_scores)):
+            best, best_scores = candidate, per_bin
+
+    improved = best is not None
+    while improved:
+        improved = False
+        p, q, P, Q = best
+        neighbours = [
+            (p + dp, q + dq, P, Q) for dp, dq in [(1, 0), (-1, 0), (0, 1), (0, -1)]
+        ]
+        neighbours += [(p + 1, q + 1, P, Q), (p - 1, q - 1, P, Q)]
+        neighbours += [
+            (p, q, P + dP, Q + dQ) for dP, dQ in [(1, 0), (-1, 0), (0, 1), (0, -1)]
+        ]
+        for candidate in neighbours:
+            if candidate in scores or not valid(candidate):
+                continue
+            per_bin = evaluate(candidate, best_scores)
+            scores[candidate] = per_bin
+            if per_bin is not None and sum(per_bin) < sum(best_scores):
+                best, best_scores = candidate, per_bin
+                improved = True
+                break
+
+    if best is None or not np.isfinite(sum(best_scores)):
+        raise ValueError("no candidate model could be fitted")
+    order, seasonal_order = models(*best)
+    return order, seasonal_order, sum(best_scores) / len(best_scores), len(scores)
+
+
+def select_model(series_list, criterion="aic", max_period=None, **search):
+    # Period plus SARIMA order for one bin or cluster, as a cache entry
+    started = time.perf_counter()
+    period = dominant_period(series_list, max_period)
+    order, seasonal_order, score, fitted = search_order(
+        series_list, period, criterion, **search
+    )
+    return {
+        "period": period,
+        "order": list(order),
+        "seasonal_order": list(seasonal_order),
+        "criterion": criterion,
+        "score": float(score),
+        "models_fitted": fitted,
+        "search_seconds": round(time.perf_counter() - started, 2),
+    }
+
+
+def select_models(groups, workers=None, **options):
+    # groups maps a key (cluster or bin) to its series; every group is
+    # searched in its own worker process
+    keys = list(groups)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {
+            key: pool.submit(select_model, list(groups[key]), **options) for key in keys
+        }
+        results = {}
+        for key in keys:
+            try:
+                results[key] = futures[key].result()
+            except Exception as error:
+                print(f"Model selection failed for {key}: {error}")
+    return results
+
+
+class OrderCache:
+    # Chosen models per cluster in one JSON file. An entry is reused while
+    # its cluster has the same bins and it is younger than max_age_days.
+
+    def __init__(self, path, max_age_days=30):
+        self.path = path
+        self.max_age_days = max_age_days
+        self.entries = {}
+        if os.path.exists(path):
+            with open(path) as f:
+                self.entries = json.load(f)
+
+    def get(self, key, bin_ids):
+        entry = self.entries.get(str(key))
+        if entry is None or entry.get("bins") != sorted(map(str, bin_ids)):
+            return None
+        age = pd.Timestamp.now() - pd.Timestamp(entry["selected_at"])
+        if self.max_age_days is not None and age > pd.Timedelta(days=self.max_age_days):
+            return None
+        return entry
+
+    def put(self, key, bin_ids, entry):
+        # Returns the entry as stored, whatever its age limit
+        self.entries[str(key)] = {
+            **entry,
+            "bins": sorted(map(str, bin_ids)),
+            "selected_at": pd.Timestamp.now().isoformat(timespec="seconds"),
+        }
+        return self.entries[str(key)]
+
+    def save(self):
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.entries, f, indent=2, sort_keys=True)
+        os.replace(tmp_path, self.path)
+
+
+def cached_models(
+    series_by_cluster,
+    cache_path,
+    max_age_days=30,
+    workers=None,
+    force=False,
+    **options,
+):
+    # series_by_cluster maps cluster -> {bin_id: series}. Returns cluster ->
+    # entry, searching only the clusters without a usable cached entry (or
+    # every cluster with force).
+    cache = OrderCache(cache_path, max_age_days)
+    chosen, missing = {}, {}
+    for cluster, series_by_bin in series_by_cluster.items():
+        entry = None if force else cache.get(cluster, series_by_bin)
+        if entry is None:
+            missing[cluster] = series_by_bin
+        else:
+            chosen[cluster] = entry
+    if missing:
+        print(f"Selecting models for {len(missing)} clusters...")
+        found = select_models(
+            {cluster: s.values() for cluster, s in missing.items()},
+            workers=workers,
+            **options,
+        )
+        for cluster, entry in found.items():
+            chosen[cluster] = cache.put(cluster, missing[cluster], entry)
+        cache.save()
+    return chosen
+
+
+def group_by_model(entries, clusters, default):
+    # (order, seasonal_order) -> bins using it, so each distinct model can be
+    # fitted as one batch. Clusters without an entry get default; a bin in
+    # several clusters goes with the first, as in clusters.cluster_of.
+    batches, seen = {}, set()
+    for cluster, bin_ids in clusters.items():
+        entry = entries.get(cluster)
+        key = (
+            (tuple(entry["order"]), tuple(entry["seasonal_order"]))
+            if entry
+            else default
+        )
+        for bin_id in bin_ids:
+            if bin_id not in seen:
+                seen.add(bin_id)
+                batches.setdefault(key, []).append(bin_id)
+    return batches
+
+
+if __name__ == "__main__":
+    from Pipeline.bin_store import open_bin_store, open_cleaned_store
+    from Pipeline.clusters import read_membership
+
+    parser = argparse.ArgumentParser(description="Seasonal period and SARIMA search")
+    parser.add_argument(
+        "--data", default=None, help="Build --store from this cleaned CSV instead"
+    )
+    parser.add_argument("--store", default=None, help="Default: <dataset>_store")
+    parser.add_argument("--dataset", choices=["australian", "mumbai"], default="mumbai")
+    parser.add_argument("--membership", default="clusters_of_mumbai_dataset.csv")
+    parser.add_argument("--cache", default="sarima_orders.json")
+    parser.add_argument("--criterion", choices=["aic", "bic"], default="aic")
+    parser.add_argument("--max-age-days", type=float, default=30)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument(
+        "--force", action="store_true", help="Search again even if cached"
+    )
+    args = parser.parse_args()
+
+    args.store = args.store or f"{args.dataset}_store"
+    if args.data:
+        store = open_bin_store(args.data, args.store, args.dataset)
+    else:
+        store = open_cleaned_store(args.store)
+    series_by_cluster = {
+        cluster: {
+            bin_id: store.series(bin_id).values for bin_id in bins if bin_id in store
+        }
+        for cluster, bins in read_membership(args.membership).items()
+    }
+    series_by_cluster = {c: s for c, s in series_by_cluster.items() if s}
+    entries = cached_models(
+        series_by_cluster,
+        args.cache,
+        max_age_days=args.max_age_days,
+        workers=args.workers,
+        force=args.force,
+        criterion=args.criterion,
+    )
+    for cluster, entry in entries.items():
+        print(
+            f"Cluster {cluster}: period {entry['period']}, "
+            f"SARIMA{tuple(entry['order'])}x{tuple(entry['seasonal_order'])}, "
+            f"{entry['criterion'].upper()} {entry['score']:.1f} per bin"
+        )
+    print(f"Models cached in {args.cache}")
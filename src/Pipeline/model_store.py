@@ -0,0 +1,157 @@
+import hashlib
+import os
+
+import numpy as np
+import pandas as pd
+from statsmodels.tsa.statespace.initialization import Initialization
+from statsmodels.tsa.statespace.sarimax import SARIMAX
+
+# On-disk store of fitted SARIMA models, one .npz file per key (see model_key
+# for the batch scripts' keys). Each record keeps the estimated parameters, the fitted values and
+# the Kalman filter's one-step-ahead state after the last observation, which
+# is enough to pick a model up again without refitting it.
+
+
+def history_hash(values):
+    values = np.ascontiguousarray(np.asarray(values, dtype=np.float64))
+    return hashlib.sha1(values.tobytes()).hexdigest()
+
+
+def model_key(tag, bin_id, order, seasonal_order):
+    # One record per script (or data source), bin and model, so scripts that
+    # fit other orders or histories for the same bin do not overwrite each
+    # other's records and force a cold fit on every alternate run
+    order = "-".join(str(int(term)) for term in order)
+    seasonal_order = "-".join(str(int(term)) for term in seasonal_order)
+    return f"{tag}_{bin_id}_{order}_{seasonal_order}"
+
+
+class SarimaModelStore:
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.npz")
+
+    def load(self, key):
+        path = self._path(key)
+        if not os.path.exists(path):
+            return None
+        with np.load(path) as record:
+            return {name: record[name] for name in record.files}
+
+    def save(self, key, record):
+        # Write to a temporary file first so readers never see half a record
+        path = self._path(key)
+        tmp_path = f"{path}.tmp.npz"
+        np.savez(tmp_path, **record)
+        os.replace(tmp_path, path)
+
+
+class WarmSarimaFit:
+    def __init__(self, results, fittedvalues, mode):
+        self.results = results
+        self.fittedvalues = fittedvalues
+        self.params = results.params
+        self.mode = mode
+
+    def forecast(self, steps=1):
+        return self.results.forecast(steps=steps)
+
+
+def make_record(
+    params, state, state_cov, fitted, order, seasonal_order, series, since_refit
+):
+    return {
+        "params": np.asarray(params),
+        "order": np.asarray(order),
+        "seasonal_order": np.asarray(seasonal_order),
+        "nobs": np.asarray(len(series)),
+        "history_hash": np.asarray(history_hash(series)),
+        "fitted": np.asarray(fitted, dtype=np.float64),
+        "state": np.asarray(state),
+        "state_cov": np.asarray(state_cov),
+        "since_refit": np.asarray(since_refit),
+    }
+
+
+def fit_sarima_warm(
+    store,
+    key,
+    series,
+    order=(1, 1, 1),
+    seasonal_order=(1, 1, 1, 30),
+    refit_every=None,
+    **fit_kwargs,
+):
+    fit_kwargs.setdefault("disp", False)
+    record = store.load(key)
+    same_model = (
+        record is not None
+        and tuple(record["order"]) == tuple(order)
+        and tuple(record["seasonal_order"]) == tuple(seasonal_order)
+    )
+    values = np.asarray(series, dtype=np.float64)
+    nobs = int(record["nobs"]) if same_model else 0
+    new_obs = len(values) - nobs
+    since_refit = int(record["since_refit"]) + new_obs if same_model else 0
+
+    # Extend: the stored history is unchanged and only new readings arrived,
+    # so they are filtered from the saved state with the saved parameters
+    if (
+        same_model
+        and new_obs > 0
+        and (refit_every is None or since_refit < refit_every)
+        and str(record["history_hash"]) == history_hash(values[:nobs])
+    ):
+        model = SARIMAX(series[nobs:], order=order, seasonal_order=seasonal_order)
+        model.ssm.initialization = Initialization(
+            model.k_states,
+            "known",
+            constant=record["state"],
+            stationary_cov=record["state_cov"],
+        )
+        results = model.filter(record["params"])
+        fitted = np.concatenate([record["fitted"], np.asarray(results.fittedvalues)])
+        mode = "extend"
+
+    # Reuse: nothing changed since the last run, so the saved parameters are
+    # applied to the history without running the optimizer
+    elif (
+        same_model
+        and new_obs == 0
+        and str(record["history_hash"]) == history_hash(values)
+    ):
+        model = SARIMAX(series, order=order, seasonal_order=seasonal_order)
+        results = model.filter(record["params"])
+        fitted = np.asarray(results.fittedvalues)
+        mode = "reuse"
+
+    # Warm start: same model but the history changed or a refit is due, so the
+    # optimizer starts from the previous parameters instead of from scratch
+    else:
+        if same_model:
+            fit_kwargs.setdefault("start_params", record["params"])
+        model = SARIMAX(series, order=order, seasonal_order=seasonal_order)
+        results = model.fit(**fit_kwargs)
+        fitted = np.asarray(results.fittedvalues)
+        since_refit = 0
+        mode = "warm" if same_model else "fit"
+
+    store.save(
+        key,
+        make_record(
+            results.params,
+            results.predicted_state[:, -1],
+            results.predicted_state_cov[:, :, -1],
+            fitted,
+            order,
+            seasonal_order,
+            values,
+            since_refit,
+        ),
+    )
+    if isinstance(series, pd.Series):
+        fitted = pd.Series(fitted, index=series.index)
+    return WarmSarimaFit(results, fitted, mode)
@@ -0,0 +1,116 @@
+import warnings
+from collections import deque
+
+import numpy as np
+from statsmodels.tsa.holtwinters import ExponentialSmoothing
+
+# Additive Holt-Winters kept up to date one reading at a time. The smoothing
+# parameters and the starting level/trend/season are estimated by statsmodels
+# on a window of history; after that each new reading only runs the three
+# smoothing recursions (the same ones statsmodels uses), so an update and a
+# next-step forecast are a handful of float operations per bin. The
+# parameters are re-estimated on the recent history every refit_every
+# readings.
+
+
+class HoltWintersState:
+    __slots__ = ("level", "trend", "season", "position", "alpha", "beta", "gamma")
+
+    def __init__(self, level, trend, season, alpha, beta=0.0, gamma=0.0, position=0):
+        # season is a ring of the last seasonal_periods seasonal terms;
+        # season[position] is the one the next reading falls on. trend is
+        # None for models without a trend component
+        self.level = float(level)
+        self.trend = None if trend is None else float(trend)
+        self.season = [float(s) for s in season]
+        self.position = position
+        self.alpha, self.beta, self.gamma = float(alpha), float(beta), float(gamma)
+
+    @classmethod
+    def from_fit(cls, es_fit):
+        # Final state of a fitted statsmodels HoltWintersResults
+        params = es_fit.params
+        m = es_fit.model.seasonal_periods
+        has_trend = es_fit.model.trend is not None
+        return cls(
+            es_fit.level[-1],
+            es_fit.trend[-1] if has_trend else None,
+            es_fit.season[-m:],
+            params["smoothing_level"],
+            params["smoothing_trend"] if has_trend else 0.0,
+            params["smoothing_seasonal"],
+        )
+
+    def update(self, y):
+        trend = self.trend or 0.0
+        expected = self.level + trend
+        seasonal = self.season[self.position]
+
+        level = self.alpha * (y - seasonal) + (1 - self.alpha) * expected
+        if self.trend is not None:
+            self.trend = self.beta * (level - self.level) + (1 - self.beta) * trend
+        self.season[self.position] = (
+            self.gamma * (y - expected) + (1 - self.gamma) * seasonal
+        )
+        self.level = level
+        self.position = (self.position + 1) % len(self.season)
+
+    def forecast_next(self):
+        return self.level + (self.trend or 0.0) + self.season[self.position]
+
+    def forecast(self, steps=1):
+        m = len(self.season)
+        horizon = np.arange(1, steps + 1)
+        season = np.asarray(self.season)[(self.position + horizon - 1) % m]
+        return self.level + (self.trend or 0.0) * horizon + season
+
+
+class OnlineHoltWinters:
+    def __init__(self, seasonal_periods, trend="add", refit_every=None, history=None):
+        # history is how many recent readings are kept for re-estimation
+        # (ten seasons by default)
+        self.seasonal_periods = seasonal_periods
+        self.trend = trend
+        self.refit_every = refit_every
+        self.history = history or 10 * seasonal_periods
+        self.states = {}
+        self.recent = {}
+        self.since_refit = {}
+
+    def _estimate(self, values):
+        model = ExponentialSmoothing(
+            values,
+            trend=self.trend,
+            seasonal="add",
+            seasonal_periods=self.seasonal_periods,
+        )
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            return HoltWintersState.from_fit(model.fit())
+
+    def fit(self, bin_id, series):
+        values = np.asarray(series, dtype=np.float64)
+        values = values[~np.isnan(values)]
+        self.states[bin_id] = self._estimate(values[-self.history :])
+        self.recent[bin_id] = deque(values[-self.history :], maxlen=self.history)
+        self.since_refit[bin_id] = 0
+        return self.states[bin_id]
+
+    def update(self, bin_id, y):
+        # Returns the forecast for the reading after y
+        state = self.states[bin_id]
+        state.update(y)
+        self.recent[bin_id].append(y)
+        self.since_refit[bin_id] += 1
+
+        if self.refit_every and self.since_refit[bin_id] >= self.refit_every:
+            state = self.refit(bin_id)
+        return state.forecast_next()
+
+    def refit(self, bin_id):
+        self.states[bin_id] = self._estimate(np.asarray(self.recent[bin_id]))
+        self.since_refit[bin_id] = 0
+        return self.states[bin_id]
+
+    def forecast(self, bin_id, steps=1):
+        return self.states[bin_id].forecast(steps)
@@ -0,0 +1,60 @@
+import numpy as np
+import pandas as pd
+
+# Priority computation for whole fleets at once. Forecasts are stacked into a
+# (bins x horizon) matrix (shorter forecasts padded with NaN), the trend of
+# every row is one closed-form least-squares slope against the shared time
+# axis, and slopes are min/max normalized within each cluster and bucketed
+# into priorities 1-5 with array operations only.
+
+
+def forecast_matrix(forecasts, bin_ids=None):
+    bin_ids = list(forecasts) if bin_ids is None else list(bin_ids)
+    horizon = max((len(forecasts[bin_id]) for bin_id in bin_ids), default=0)
+    matrix = np.full((len(bin_ids), horizon), np.nan, dtype=np.float64)
+    for row, bin_id in enumerate(bin_ids):
+        values = np.asarray(forecasts[bin_id], dtype=np.float64)
+        matrix[row, : len(values)] = values
+    return matrix
+
+
+def forecast_slopes(matrix):
+    # Slope of y = a + b*t fitted to each row over t = 0, 1, ..., ignoring NaN.
+    # With t centred on each row's own mean the intercept drops out:
+    # b = sum(tc * y) / sum(tc^2). Rows with fewer than two points have no
+    # trend and get 0, as LinearRegression gives for a single point.
+    matrix = np.asarray(matrix, dtype=np.float64)
+    observed = np.isfinite(matrix)
+    t = np.arange(matrix.shape[1], dtype=np.float64)
+    if observed.all():
+        # Same time axis for every row: a single matrix-vector product
+        centred = t - t.mean()
+        spread = centred @ centred
+        if spread == 0:
+            return np.zeros(len(matrix))
+        return matrix @ centred / spread
+    t_mean = (observed * t).sum(axis=1) / np.maximum(observed.sum(axis=1), 1)
+    centred = np.where(observed, t - t_mean[:, None], 0.0)
+    values = np.where(observed, matrix, 0.0)
+    spread = (centred**2).sum(axis=1)
+    return np.divide(
+        (centred * values).sum(axis=1),
+        spread,
+        out=np.zeros(len(matrix)),
+        where=spread > 0,
+    )
+
+
+def cluster_priorities(scores, clusters):
+    # Normalizes scores to 0-1 within each cluster and maps them to 1-5
+    # (ceil(4 * normalized + 1)); a cluster whose scores are all equal gets 3
+    scores = pd.Series(np.asarray(scores, dtype=np.float64))
+    grouped = scores.groupby(np.asarray(clusters), sort=False)
+    low = grouped.transform("min").to_numpy()
+    span = grouped.transform("max").to_numpy() - low
+    normalized = np.divide(
+        scores.to_numpy() - low, span, out=np.zeros(len(scores)), where=span > 0
+    )
+    priorities = np.ceil(normalized * 4 + 1).astype(np.int8)
+    priorities[span == 0] = 3
+    return priorities
@@ -0,0 +1,154 @@
+import argparse
+import asyncio
+import os
+import time
+
+import pandas as pd
+
+from Pipeline.http_server import serve_http
+from Pipeline.snapshot import load_snapshot
+
+# Read-only query API over the latest priority snapshot, for the dispatch
+# tools. The snapshot file is loaded into memory with its indexes built, and
+# every request is answered from that in-memory copy:
+#   GET /bins/<bin_id>                          priority of one bin
+#   GET /clusters/<cluster>/top?k=10            highest priority bins
+#   GET /crossing?threshold=4&hours=24[&at=..]  bins predicted to reach the
+#                                               threshold within N hours
+#   GET /health, POST /reload
+# The file is polled for changes (and reloaded on POST /reload). A new
+# snapshot is loaded and indexed off the event loop and then swapped in with
+# a single assignment, so a request sees either the old snapshot or the new
+# one, never a mix, and queries are not blocked while a reload runs.
+
+
+class PriorityApi:
+    def __init__(self, path, poll_interval=5.0):
+        self.path = path
+        self.poll_interval = poll_interval
+        self.snapshot = None
+        self.stat = None
+        self.loaded_at = None
+
+    def reload(self, force=False):
+        # Returns True when a new snapshot was swapped in
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return False
+        if not force and self.stat and stat.st_mtime_ns == self.stat.st_mtime_ns:
+            return False
+        snapshot, stat = load_snapshot(self.path)
+        self.snapshot, self.stat, self.loaded_at = snapshot, stat, pd.Timestamp.now()
+        return True
+
+    async def watch(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            try:
+                await loop.run_in_executor(None, self.reload)
+            except Exception as error:
+                # Keep serving the previous snapshot
+                print(f"Could not load {self.path}: {error}")
+
+    async def handle(self, method, path, query, body):
+        parts = path.strip("/").split("/")
+        if parts == ["reload"]:
+            if method != "POST":
+                return 405, {"error": "use POST"}
+            loop = asyncio.get_running_loop()
+            swapped = await loop.run_in_executor(None, self.reload, True)
+            return 200, {"reloaded": swapped, "bins": len(self.snapshot or ())}
+        if method != "GET":
+            return 405, {"error": "use GET"}
+        return self.query(parts, query)
+
+    def query(self, parts, query):
+        # The lookups themselves never wait on anything, so they run inline
+        # on the event loop
+        snapshot = self.snapshot
+        if parts == ["health"]:
+            return 200, {
+                "snapshot": self.path,
+                "bins": len(snapshot or ()),
+                "loaded_at": self.loaded_at,
+            }
+        if snapshot is None:
+            return 503, {"error": f"no snapshot loaded from {self.path}"}
+
+        try:
+            if len(parts) == 2 and parts[0] == "bins":
+                record = snapshot.bin(int(parts[1]))
+                if record is None:
+                    return 404, {"error": f"bin {parts[1]} is not in the snapshot"}
+                return 200, record
+            if len(parts) == 3 and parts[0] == "clusters" and parts[2] == "top":
+                k = int(query.get("k", 10))
+                if parts[1] not in snapshot.ranking:
+                    return 404, {"error": f"cluster {parts[1]} is not in the snapshot"}
+                return 200, {"cluster": parts[1], "bins": snapshot.top(parts[1], k)}
+            if parts == ["crossing"]:
+                threshold = float(query.get("threshold", 4))
+                hours = float(query.get("hours", 24))
+                bins = snapshot.crossing(threshold, hours, query.get("at"))
+                return 200, {"threshold": threshold, "hours": hours, "bins": bins}
+        except ValueError as error:
+            return 400, {"error": str(error)}
+        return 404, {"error": f"no route /{'/'.join(parts)}"}
+
+    async def run(self, host="0.0.0.0", port=8001):
+        self.reload()
+        server = await serve_http(self.handle, host, port)
+        watcher = asyncio.create_task(self.watch())
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            watcher.cancel()
+
+
+def time_queries(api, repeat=10000):
+    # Mean in-process time per query in microseconds, without the HTTP layer
+    snapshot = api.snapshot
+    bin_id = int(snapshot.bin_ids[0])
+    cluster = str(snapshot.clusters[0])
+    at = pd.Timestamp(snapshot.origin.min())
+    queries = {
+        "bin": (["bins", str(bin_id)], {}),
+        "top": (["clusters", cluster, "top"], {"k": "10"}),
+        "crossing": (["crossing"], {"threshold": "4", "hours": "24", "at": at}),
+    }
+    timings = {}
+    for name, (parts, query) in queries.items():
+        started = time.perf_counter()
+        for _ in range(repeat):
+            api.query(parts, query)
+        timings[name] = (time.perf_counter() - started) / repeat * 1e6
+    return timings
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Bin priority query API")
+    parser.add_argument("--snapshot", default="snapshots/priorities.npz")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--poll-interval", type=float, default=5.0)
+    parser.add_argument(
+        "--time-queries",
+        action="store_true",
+        help="Print the in-process time per query type and exit",
+    )
+    args = parser.parse_args()
+
+    api = PriorityApi(args.snapshot, args.poll_interval)
+    if args.time_queries:
+        if not api.reload():
+            raise SystemExit(f"No snapshot at {args.snapshot}")
+        for name, micros in time_queries(api).items():
+            print(f"{name}: {micros:.1f} us per query")
+    else:
+        try:
+            asyncio.run(api.run(args.host, args.port))
+        except KeyboardInterrupt:
+            pass
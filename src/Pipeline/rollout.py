@@ -0,0 +1,25 @@
+import numpy as np
+
+# Recursive multi-step forecasting for a whole batch of bins. The windows of
+# all bins live in one preallocated (n_bins, time_steps + steps, 1) buffer:
+# each step reads the last time_steps columns as the model input and writes
+# the prediction into the next free column, so no window is rebuilt with
+# np.append/np.roll and the model is called once per step for every bin.
+# The model is called directly instead of through Model.predict, which sets
+# up a new data pipeline on every call.
+
+
+def recursive_forecast(model, windows, steps, extra_inputs=None):
+    windows = np.asarray(windows, dtype=np.float32)
+    n_bins, time_steps = windows.shape[:2]
+    buffer = np.empty((n_bins, time_steps + steps, 1), dtype=np.float32)
+    buffer[:, :time_steps, 0] = windows.reshape(n_bins, time_steps)
+
+    for step in range(steps):
+        window = buffer[:, step : step + time_steps]
+        inputs = [window, *extra_inputs] if extra_inputs else window
+        buffer[:, time_steps + step, 0] = np.asarray(model(inputs, training=False))[
+            :, 0
+        ]
+
+    return buffer[:, time_steps:, 0].astype(np.float64)
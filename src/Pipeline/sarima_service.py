@@ -0,0 +1,259 @@
+import os
+import time
+import warnings
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+    as_completed,
+    wait,
+)
+from concurrent.futures.process import BrokenProcessPool
+
+import numpy as np
+from statsmodels.tsa.statespace.sarimax import SARIMAX
+
+from Pipeline.model_store import SarimaModelStore, fit_sarima_warm, model_key
+
+# Parallel SARIMA fitting for many bins at once. Each bin is fitted in its own
+# task, so a slow or failing bin only affects its own entry in the results.
+# A worker process that dies (out of memory, a crash in native code) breaks
+# the whole pool and fails every bin still pending in it; those bins are
+# then refitted in a process each, so only the bin that killed its worker
+# is lost.
+#
+# The per-bin timeout is checked by the optimizer after every iteration,
+# which stops most slow fits cleanly but cannot interrupt one long step (a
+# likelihood evaluation, the initial filter, extend or forecast). The parent
+# therefore also holds every bin to HARD_TIMEOUT_FACTOR times its timeout,
+# counted from when the bin was handed to a worker; a bin past that is
+# marked as timed out and its pool is killed, which sends the other bins
+# still in that pool down the same refit path as a dead worker.
+
+HARD_TIMEOUT_FACTOR = 2
+
+
+class FitTimeout(Exception):
+    pass
+
+
+def fit_sarima(
+    bin_id,
+    series,
+    order,
+    seasonal_order,
+    forecast_steps,
+    timeout=None,
+    store_dir=None,
+    refit_every=None,
+    store_tag="sarima",
+):
+    start = time.perf_counter()
+
+    # Called by the optimizer after every iteration, which lets a fit that
+    # runs past its budget be abandoned without killing the worker; this is
+    # only a soft limit, the hard one is enforced by fit_sarima_batch
+    def check_deadline(params):
+        if timeout is not None and time.perf_counter() - start > timeout:
+            raise FitTimeout(f"Bin {bin_id} exceeded {timeout}s")
+
+    result = {"bin_id": bin_id, "status": "ok", "error": None}
+    try:
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter("always")
+            if store_dir is None:
+                model = SARIMAX(series, order=order, seasonal_order=seasonal_order)
+                fit = model.fit(disp=False, callback=check_deadline)
+                fitted, mode = fit.fittedvalues, "fit"
+            else:
+                warm_fit = fit_sarima_warm(
+                    SarimaModelStore(store_dir),
+                    model_key(store_tag, bin_id, order, seasonal_order),
+                    series,
+                    order=order,
+                    seasonal_order=seasonal_order,
+                    refit_every=refit_every,
+                    callback=check_deadline,
+                )
+                fit, fitted, mode = (
+                    warm_fit.results,
+                    warm_fit.fittedvalues,
+                    warm_fit.mode,
+                )
+            # Extended and reused fits never ran the optimizer
+            retvals = getattr(fit, "mle_retvals", None) or {}
+            result.update(
+                {
+                    "mode": mode,
+                    "fitted": np.asarray(fitted),
+                    "forecast": np.asarray(fit.forecast(steps=forecast_steps)),
+                    "params": np.asarray(fit.params),
+                    "aic": fit.aic,
+                    "bic": fit.bic,
+                    "converged": bool(retvals.get("converged", True)),
+                }
+            )
+        result["warnings"] = sorted({str(w.message) for w in caught})
+    except FitTimeout as e:
+        result.update({"status": "timeout", "error": str(e)})
+    except (np.linalg.LinAlgError, ValueError) as e:
+        result.update({"status": "failed", "error": f"{type(e).__name__}: {e}"})
+
+    result["fit_seconds"] = time.perf_counter() - start
+    return result
+
+
+def _kill_workers(pool):
+    # ProcessPoolExecutor has no public way to stop a worker that is busy
+    for process in list(pool._processes.values()):
+        process.kill()
+
+
+def _hard_timeout(timeout):
+    return None if timeout is None else HARD_TIMEOUT_FACTOR * timeout
+
+
+def _timed_out(bin_id, timeout, seconds):
+    return {
+        "bin_id": bin_id,
+        "status": "timeout",
+        "error": f"Bin {bin_id} exceeded {timeout}s and its worker was stopped",
+        "fit_seconds": seconds,
+    }
+
+
+def _fit_isolated(args):
+    # One bin in a worker process of its own, killed if it overruns
+    bin_id, timeout = args[0], args[5]
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=1) as pool:
+        future = pool.submit(fit_sarima, *args)
+        try:
+            return future.result(timeout=_hard_timeout(timeout))
+        except TimeoutError:
+            _kill_workers(pool)
+            return _timed_out(bin_id, timeout, time.perf_counter() - start)
+
+
+def _worker_error(bin_id, error, wall_start):
+    return {
+        "bin_id": bin_id,
+        "status": "error",
+        "error": f"{type(error).__name__}: {error}",
+        "fit_seconds": time.perf_counter() - wall_start,
+    }
+
+
+def fit_sarima_batch(
+    series_by_bin,
+    forecast_steps,
+    order=(1, 1, 1),
+    seasonal_order=(1, 1, 1, 30),
+    workers=None,
+    timeout=None,
+    store_dir=None,
+    refit_every=None,
+    store_tag="sarima",
+):
+    # store_tag names the script or data source in the model store keys
+    results = {}
+    wall_start = time.perf_counter()
+    tasks = {
+        bin_id: (
+            bin_id,
+            series,
+            order,
+            seasonal_order,
+            forecast_steps,
+            timeout,
+            store_dir,
+            refit_every,
+            store_tag,
+        )
+        for bin_id, series in series_by_bin.items()
+    }
+
+    hard_timeout = _hard_timeout(timeout)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {
+            pool.submit(fit_sarima, *task): bin_id for bin_id, task in tasks.items()
+        }
+        # A future counts as running once it is queued for a worker, which
+        # can be one task early; the factor on the timeout absorbs that
+        started, pending, last_check = {}, set(futures), 0.0
+        while pending:
+            done, pending = wait(
+                pending,
+                timeout=None if hard_timeout is None else 1.0,
+                return_when=FIRST_COMPLETED,
+            )
+            for future in done:
+                bin_id = futures[future]
+                error = future.exception()
+                if error is None:
+                    results[bin_id] = future.result()
+                elif not isinstance(error, BrokenProcessPool):
+                    results[bin_id] = _worker_error(bin_id, error, wall_start)
+            if hard_timeout is None:
+                continue
+            now = time.perf_counter()
+            if now - last_check < 1.0:
+                continue
+            last_check = now
+            overdue = []
+            for future in pending:
+                if future.running():
+                    started.setdefault(future, now)
+                    if now - started[future] > hard_timeout:
+                        overdue.append(future)
+            if overdue:
+                for future in overdue:
+                    results[futures[future]] = _timed_out(
+                        futures[future], timeout, now - started[future]
+                    )
+                _kill_workers(pool)
+                break
+
+    # A worker died (or was killed for overrunning) and took the pool down
+    # with it; the bins it had not finished are refitted one process each,
+    # several at a time
+    unfinished = [bin_id for bin_id in tasks if bin_id not in results]
+    if unfinished:
+        print(
+            f"SARIMA: a worker process died or was stopped; refitting "
+            f"{len(unfinished)} unfinished bins in separate processes"
+        )
+        with ThreadPoolExecutor(max_workers=workers or os.cpu_count()) as threads:
+            futures = {
+                threads.submit(_fit_isolated, tasks[bin_id]): bin_id
+                for bin_id in unfinished
+            }
+            for future in as_completed(futures):
+                bin_id = futures[future]
+                error = future.exception()
+                if error is None:
+                    results[bin_id] = future.result()
+                else:
+                    results[bin_id] = _worker_error(bin_id, error, wall_start)
+
+    wall_seconds = time.perf_counter() - wall_start
+    print_fit_report(results, wall_seconds)
+    return {bin_id: results[bin_id] for bin_id in series_by_bin}
+
+
+def print_fit_report(results, wall_seconds):
+    fit_seconds = [result["fit_seconds"] for result in results.values()]
+    failed = [result for result in results.values() if result["status"] != "ok"]
+    print(
+        f"SARIMA: fitted {len(results) - len(failed)}/{len(results)} bins in "
+        f"{wall_seconds:.2f}s wall-clock ({sum(fit_seconds):.2f}s total fit time)"
+    )
+    for bin_id, result in sorted(
+        results.items(), key=lambda item: item[1]["fit_seconds"], reverse=True
+    ):
+        mode = f" ({result['mode']})" if "mode" in result else ""
+        print(
+            f"  Bin {bin_id}: {result['status']}{mode} in {result['fit_seconds']:.2f}s"
+        )
+    for result in failed:
+        print(f"  Bin {result['bin_id']} {result['status']}: {result['error']}")
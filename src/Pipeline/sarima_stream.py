@@ -0,0 +1,171 @@
+from collections import deque
+
+import numpy as np
+
+from Pipeline.model_store import fit_sarima_warm, make_record
+
+# Live SARIMA per bin. Each bin is fitted once through the model store, after
+# which its state-space matrices and the Kalman filter's predicted state and
+# covariance are kept in memory. A new reading is a single Kalman update on
+# that state, and forecasts are read off the current state. Parameters are
+# only re-estimated every refit_every readings, or earlier when the
+# standardized one-step errors drift away from what the model expects.
+#
+# Only the last `window` readings (ten seasons by default) are kept per bin,
+# so a long-running server's memory and the cost of each refit stay fixed;
+# refits and checkpoints cover that window. A batch run over a longer
+# history than the checkpointed window warm-starts from its parameters
+# rather than extending it.
+
+
+class _BinFilter:
+    def __init__(self, results, history, fitted, window, since_refit=0):
+        ssm = results.filter_results
+        self.params = np.asarray(results.params)
+        self.design = ssm.design[0, :, 0]
+        self.obs_intercept = ssm.obs_intercept[0, 0]
+        self.obs_cov = ssm.obs_cov[0, 0, 0]
+        self.transition = ssm.transition[:, :, 0]
+        self.state_intercept = ssm.state_intercept[:, 0]
+        selection = ssm.selection[:, :, 0]
+        self.state_noise = selection @ ssm.state_cov[:, :, 0] @ selection.T
+        self.state = results.predicted_state[:, -1].copy()
+        self.state_cov = results.predicted_state_cov[:, :, -1].copy()
+        self.history = deque(history, maxlen=window)
+        self.fitted = deque(fitted, maxlen=window)
+        self.since_refit = since_refit
+        self.drift = 1.0
+        self.since_drift_reset = 0
+
+    def predict(self):
+        return self.design @ self.state + self.obs_intercept
+
+    def update(self, y, drift_weight):
+        T, P = self.transition, self.state_cov
+        prediction = self.predict()
+        self.history.append(y)
+        self.fitted.append(prediction)
+        self.since_refit += 1
+
+        if np.isnan(y):
+            # Missing reading: propagate the state without a correction
+            self.state = T @ self.state + self.state_intercept
+            self.state_cov = T @ P @ T.T + self.state_noise
+            return
+
+        PZ = P @ self.design
+        innovation = y - prediction
+        innovation_var = self.design @ PZ + self.obs_cov
+        gain = T @ PZ / innovation_var
+        self.state = T @ self.state + self.state_intercept + gain * innovation
+        self.state_cov = (
+            T @ P @ T.T - np.outer(gain, gain) * innovation_var + self.state_noise
+        )
+
+        # Exponentially weighted mean of the squared standardized innovation,
+        # which stays around 1 while the model fits the data
+        z2 = innovation**2 / innovation_var
+        self.drift += drift_weight * (z2 - self.drift)
+        self.since_drift_reset += 1
+
+    def forecast(self, steps):
+        state = self.state
+        forecasts = np.empty(steps)
+        for h in range(steps):
+            forecasts[h] = self.design @ state + self.obs_intercept
+            state = self.transition @ state + self.state_intercept
+        return forecasts
+
+
+class SarimaStream:
+    def __init__(
+        self,
+        store,
+        order=(1, 1, 1),
+        seasonal_order=(1, 1, 1, 30),
+        refit_every=None,
+        drift_threshold=4.0,
+        drift_span=50,
+        window=None,
+    ):
+        # drift_threshold is the level the weighted mean squared standardized
+        # error must reach (after drift_span readings) to force a refit;
+        # window defaults to ten seasons (500 readings without a seasonal part)
+        self.store = store
+        self.order = order
+        self.seasonal_order = seasonal_order
+        self.refit_every = refit_every
+        self.drift_threshold = drift_threshold
+        self.drift_span = drift_span
+        self.window = window or (
+            10 * seasonal_order[3] if seasonal_order[3] > 1 else 500
+        )
+        self.bins = {}
+
+    def start(self, bin_id, series):
+        # Picks the bin up from the model store (extending or reusing a saved
+        # fit where possible) and keeps its filter state in memory
+        values = np.asarray(series, dtype=np.float64)
+        fit = fit_sarima_warm(
+            self.store, bin_id, values, self.order, self.seasonal_order
+        )
+        since_refit = int(self.store.load(bin_id)["since_refit"])
+        self.bins[bin_id] = _BinFilter(
+            fit.results, values, fit.fittedvalues, self.window, since_refit
+        )
+        return self.bins[bin_id]
+
+    def refit(self, bin_id):
+        # Warm-started refit on the recent window, then back to streaming
+        history = np.asarray(self.bins[bin_id].history)
+        fit = fit_sarima_warm(
+            self.store,
+            bin_id,
+            history,
+            self.order,
+            self.seasonal_order,
+            refit_every=1,
+        )
+        self.bins[bin_id] = _BinFilter(
+            fit.results, history, fit.fittedvalues, self.window
+        )
+        return self.bins[bin_id]
+
+    def drifting(self, bin_id):
+        bin_filter = self.bins[bin_id]
+        return (
+            bin_filter.since_drift_reset >= self.drift_span
+            and bin_filter.drift > self.drift_threshold
+        )
+
+    def update(self, bin_id, y):
+        # Returns the forecast for the next reading
+        bin_filter = self.bins[bin_id]
+        bin_filter.update(float(y), 2 / (self.drift_span + 1))
+
+        refit_due = self.refit_every and bin_filter.since_refit >= self.refit_every
+        if refit_due or self.drifting(bin_id):
+            bin_filter = self.refit(bin_id)
+        return bin_filter.predict()
+
+    def forecast(self, bin_id, steps=1):
+        return self.bins[bin_id].forecast(steps)
+
+    def checkpoint(self, bin_id):
+        # Writes the current state and window to the model store, so a later
+        # batch run on that window plus new readings extends from here
+        # instead of refitting
+        bin_filter = self.bins[bin_id]
+        self.store.save(
+            bin_id,
+            make_record(
+                bin_filter.params,
+                bin_filter.state,
+                bin_filter.state_cov,
+                bin_filter.fitted,
+                self.order,
+                self.seasonal_order,
+                np.asarray(bin_filter.history),
+                bin_filter.since_refit,
+            ),
+        )
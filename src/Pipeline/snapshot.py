@@ -0,0 +1,157 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+from Pipeline.priorities import forecast_matrix
+
+# Forecast and priority snapshots for the query API. A priority run publishes
+# one .npz file holding every bin's cluster, priority and score next to its
+# forecast trajectory; the file is written under a temporary name and moved
+# into place, so readers only ever see a complete snapshot. Loading a
+# snapshot builds the indexes the queries need up front:
+#   - bin id -> row, with the response record for each bin prebuilt
+#   - per cluster, the bins ranked by priority (then score), so top-k is a
+#     slice
+#   - per threshold level, the bins sorted by the time their forecast first
+#     reaches it, so "crossing within N hours" is one binary search
+# Thresholds other than the precomputed levels are answered by scanning the
+# running maximum of the forecasts instead.
+
+LEVELS = (1, 2, 3, 4, 5)
+
+
+def publish_snapshot(path, priorities, forecasts, origins, step):
+    # priorities has bin_id, cluster, priority, score and optionally location
+    # columns; forecasts and origins map bin id -> forecast values and the
+    # timestamp of the last reading they follow; step is the time between
+    # forecast points, one Timedelta for all bins or a dict by bin id
+    priorities = priorities.reset_index(drop=True)
+    bin_ids = priorities["bin_id"].to_numpy(dtype=np.int64)
+    # Bins with shorter forecasts are padded with NaN
+    matrix = forecast_matrix(forecasts, bin_ids).astype(np.float32)
+
+    steps = [step[bin_id] if isinstance(step, dict) else step for bin_id in bin_ids]
+    location = (
+        priorities["location"]
+        if "location" in priorities
+        else pd.Series("", index=priorities.index)
+    )
+    arrays = {
+        "bin_id": bin_ids,
+        "cluster": priorities["cluster"].astype(str).to_numpy(dtype=str),
+        "priority": priorities["priority"].to_numpy(dtype=np.int8),
+        "score": priorities["score"].to_numpy(dtype=np.float64),
+        "location": location.astype(str).to_numpy(dtype=str),
+        "origin": pd.DatetimeIndex([origins[bin_id] for bin_id in bin_ids])
+        .as_unit("ns")
+        .asi8,
+        "step": pd.TimedeltaIndex(steps).as_unit("ns").asi8,
+        "forecast": matrix,
+    }
+
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        np.savez(f, **arrays)
+    os.replace(tmp_path, path)
+
+
+class PrioritySnapshot:
+    def __init__(self, arrays, levels=LEVELS):
+        self.bin_ids = arrays["bin_id"]
+        self.clusters = arrays["cluster"]
+        self.priority = arrays["priority"]
+        self.score = arrays["score"]
+        self.origin = arrays["origin"]
+        self.step = arrays["step"]
+        self.forecast = arrays["forecast"]
+
+        self.records = [
+            {
+                "bin_id": int(bin_id),
+                "cluster": str(cluster),
+                "priority": int(priority),
+                "score": float(score),
+                "location": str(location),
+                "forecast_origin": pd.Timestamp(origin).isoformat(),
+            }
+            for bin_id, cluster, priority, score, location, origin in zip(
+                self.bin_ids,
+                self.clusters,
+                self.priority,
+                self.score,
+                arrays["location"],
+                self.origin,
+            )
+        ]
+        self.row = {int(bin_id): row for row, bin_id in enumerate(self.bin_ids)}
+
+        ranked = np.lexsort((-self.score, -self.priority))
+        self.ranking = {}
+        for row in ranked:
+            self.ranking.setdefault(str(self.clusters[row]), []).append(
+                self.records[row]
+            )
+
+        # Running maximum along the horizon: a bin has crossed a threshold
+        # by step h once any of its first h forecasts reaches it (NaN padding
+        # is skipped by fmax)
+        self.peak = np.fmax.accumulate(self.forecast, axis=1)
+        self.crossings = {float(level): self._crossing_index(level) for level in levels}
+
+    def _crossing_times(self, threshold):
+        if not self.peak.shape[1]:
+            return np.full(len(self.bin_ids), np.iinfo(np.int64).max)
+        reached = self.peak >= threshold
+        crossed = reached.any(axis=1)
+        first = reached.argmax(axis=1)
+        times = self.origin + (first + 1) * self.step
+        return np.where(crossed, times, np.iinfo(np.int64).max)
+
+    def _crossing_index(self, threshold):
+        times = self._crossing_times(threshold)
+        order = np.argsort(times, kind="stable")
+        order = order[times[order] != np.iinfo(np.int64).max]
+        entries = [
+            {**self.records[row], "crossing_time": pd.Timestamp(times[row]).isoformat()}
+            for row in order
+        ]
+        return times[order], entries
+
+    def bin(self, bin_id):
+        row = self.row.get(bin_id)
+        return None if row is None else self.records[row]
+
+    def top(self, cluster, k=10):
+        return self.ranking.get(str(cluster), [])[:k]
+
+    def crossing(self, threshold, hours, at=None):
+        # Bins whose forecast reaches threshold by `at` + hours (at defaults
+        # to now), earliest crossing first
+        at = pd.Timestamp.now() if at is None else pd.Timestamp(at)
+        until = (at + pd.Timedelta(hours=hours)).as_unit("ns").value
+        if float(threshold) in self.crossings:
+            times, entries = self.crossings[float(threshold)]
+            return entries[: np.searchsorted(times, until, side="right")]
+
+        times = self._crossing_times(threshold)
+        rows = np.flatnonzero(times <= until)
+        rows = rows[np.argsort(times[rows], kind="stable")]
+        return [
+            {**self.records[row], "crossing_time": pd.Timestamp(times[row]).isoformat()}
+            for row in rows
+        ]
+
+    def __len__(self):
+        return len(self.bin_ids)
+
+
+def load_snapshot(path, levels=LEVELS):
+    # Returns the snapshot and the os.stat of the file it was read from
+    with open(path, "rb") as f:
+        stat = os.fstat(f.fileno())
+        with np.load(f) as data:
+            arrays = {name: data[name] for name in data.files}
+    return PrioritySnapshot(arrays, levels), stat
@@ -0,0 +1,328 @@
+import argparse
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from scipy.spatial import cKDTree
+
+# Location lookups for bins. Coordinates are projected to km on a local flat
+# plane and held in a KD-tree. Bins added later go into a small unindexed
+# buffer that is searched by brute force alongside the tree, and the tree is
+# only rebuilt once the buffer reaches a fraction of its size, so adding bins
+# one at a time stays cheap (amortized O(log n) per bin).
+#
+# Clusters are kept incrementally as well: a new bin joins the cluster with
+# the nearest centroid and that centroid moves to the running mean. A cluster
+# that grows past max_size is split in two by 2-means on its own members, so
+# re-clustering only ever touches one cluster and existing labels stay put.
+#
+# Neighbour features are the mean fullness of each bin's k nearest bins,
+# lagged so a model only sees neighbours' past readings.
+
+EARTH_RADIUS_KM = 6371.0
+
+
+def project(latitude, longitude, reference_latitude):
+    # Equirectangular projection to (x, y) in km
+    scale = np.cos(np.radians(reference_latitude))
+    return EARTH_RADIUS_KM * np.column_stack(
+        [np.radians(longitude) * scale, np.radians(latitude)]
+    )
+
+
+def _append(array, size, values):
+    # Writes values after the first size rows, doubling the allocation when
+    # it runs out, so appending in small batches is amortized O(1) per row
+    needed = size + len(values)
+    if needed > len(array):
+        grown = np.empty((max(needed, 2 * len(array)),) + array.shape[1:], array.dtype)
+        grown[:size] = array[:size]
+        array = grown
+    array[size:needed] = values
+    return array, needed
+
+
+class BinIndex:
+    def __init__(
+        self, bin_ids, latitude, longitude, reference_latitude=None, rebuild_at=0.1
+    ):
+        latitude = np.asarray(latitude, dtype=np.float64)
+        self.reference_latitude = (
+            float(latitude.mean()) if reference_latitude is None else reference_latitude
+        )
+        self.rebuild_at = rebuild_at
+        self._bin_ids = np.asarray(bin_ids)
+        self._points = project(latitude, longitude, self.reference_latitude)
+        self.size = len(self._points)
+        self._rebuild()
+
+    @property
+    def bin_ids(self):
+        return self._bin_ids[: self.size]
+
+    @property
+    def points(self):
+        return self._points[: self.size]
+
+    @classmethod
+    def from_csv(
+        cls,
+        path,
+        bin_column="Bin Id's",
+        latitude_column="latitude",
+        longitude_column="longitude",
+    ):
+        df = pd.read_csv(path).drop_duplicates(bin_column)
+        return cls(df[bin_column], df[latitude_column], df[longitude_column])
+
+    def _rebuild(self):
+        self.tree = cKDTree(self.points)
+        self.indexed = len(self.points)
+
+    def __len__(self):
+        return self.size
+
+    def add(self, bin_ids, latitude, longitude):
+        points = project(latitude, longitude, self.reference_latitude)
+        self._bin_ids, _ = _append(self._bin_ids, self.size, np.asarray(bin_ids))
+        self._points, self.size = _append(self._points, self.size, points)
+        if self.size - self.indexed > self.rebuild_at * max(self.indexed, 1):
+            self._rebuild()
+
+    def _query_points(self, points, k):
+        # k nearest rows of self.points for each query point, merging the
+        # tree's answer with the unindexed buffer. Brute force over the buffer
+        # only pays for a few queries; bulk queries rebuild the tree first.
+        if len(points) * (self.size - self.indexed) > self.size:
+            self._rebuild()
+        k_tree = min(k, self.indexed)
+        distances, rows = self.tree.query(points, k=k_tree)
+        distances = distances.reshape(len(points), k_tree)
+        rows = rows.reshape(len(points), k_tree)
+        if self.indexed < len(self.points):
+            buffer = self.points[self.indexed :]
+            buffer_distances = np.linalg.norm(
+                points[:, None, :] - buffer[None, :, :], axis=2
+            )
+            distances = np.hstack([distances, buffer_distances])
+            rows = np.hstack(
+                [
+                    rows,
+                    np.broadcast_to(
+                        np.arange(self.indexed, len(self.points)),
+                        buffer_distances.shape,
+                    ),
+                ]
+            )
+            order = np.argsort(distances, axis=1, kind="stable")[:, :k]
+            distances = np.take_along_axis(distances, order, axis=1)
+            rows = np.take_along_axis(rows, order, axis=1)
+        return distances, rows
+
+    def nearest(self, latitude, longitude, k=5):
+        # The k bins closest to a location: (bin ids, distances in km)
+        point = project([latitude], [longitude], self.reference_latitude)
+        distances, rows = self._query_points(point, min(k, len(self)))
+        return self.bin_ids[rows[0]], distances[0]
+
+    def within(self, latitude, longitude, radius_km):
+        # Bins within radius_km of a location, nearest first
+        point = project([latitude], [longitude], self.reference_latitude)[0]
+        rows = np.asarray(self.tree.query_ball_point(point, radius_km), dtype=int)
+        buffer = np.arange(self.indexed, len(self.points))
+        rows = np.concatenate([rows, buffer])
+        distances = np.linalg.norm(self.points[rows] - point, axis=1)
+        keep = distances <= radius_km
+        order = np.argsort(distances[keep], kind="stable")
+        return self.bin_ids[rows[keep][order]], distances[keep][order]
+
+    def neighbours(self, k=5):
+        # Row positions of every bin's k nearest other bins, shape (n, k)
+        k = min(k, len(self) - 1)
+        _, rows = self._query_points(self.points, k + 1)
+        # Drop each bin itself (normally the first hit, but bins at the same
+        # spot can come back in either order)
+        own = rows == np.arange(len(self))[:, None]
+        own[own.sum(axis=1) == 0, -1] = True
+        return rows[~own].reshape(len(self), k)
+
+
+class IncrementalClusters:
+    def __init__(self, index, labels, max_size=None, seed=0):
+        # labels gives the starting cluster of every bin in the index (for
+        # example the knn_cluster column); max_size defaults to twice the
+        # largest starting cluster
+        self.index = index
+        self.rng = np.random.default_rng(seed)
+        names, inverse, counts = np.unique(
+            np.asarray(labels), return_inverse=True, return_counts=True
+        )
+        self.names = list(names)
+        # Cluster position (into names/centroids/counts) of every bin
+        self._assignment = inverse.astype(np.int64)
+        self.counts = counts.astype(np.int64)
+        self.centroids = np.vstack(
+            [index.points[inverse == i].mean(axis=0) for i in range(len(names))]
+        )
+        self.max_size = max_size or 2 * int(counts.max())
+        self._next_label = (
+            int(max(names)) + 1
+            if np.issubdtype(np.asarray(names).dtype, np.integer)
+            else len(names)
+        )
+
+    @property
+    def assignment(self):
+        return self._assignment[: len(self.index)]
+
+    @property
+    def labels(self):
+        return np.asarray(self.names)[self.assignment]
+
+    def add(self, bin_ids, latitude, longitude):
+        # Adds bins to the index and to clusters; returns their labels
+        start = len(self.index)
+        self.index.add(bin_ids, latitude, longitude)
+        points = self.index.points[start:]
+        # The batch goes to the nearest centroids, which then move to the
+        # running mean of their members
+        if len(points) * len(self.centroids) <= 1 << 16:
+            clusters = (
+                ((points[:, None] - self.centroids[None]) ** 2).sum(axis=2).argmin(1)
+            )
+        else:
+            _, clusters = cKDTree(self.centroids).query(points)
+        added = np.bincount(clusters, minlength=len(self.names))
+        sums = np.zeros_like(self.centroids)
+        np.add.at(sums, clusters, points)
+        grown = added > 0
+        self.centroids[grown] = (
+            self.centroids[grown] * self.counts[grown, None] + sums[grown]
+        ) / (self.counts[grown] + added[grown])[:, None]
+        self.counts += added
+        self._assignment, _ = _append(self._assignment, start, clusters)
+        # A large batch can overfill a cluster several times over, so halves
+        # are split again until every cluster fits
+        oversized = list(np.unique(clusters))
+        while oversized:
+            cluster = oversized.pop()
+            if self.counts[cluster] > self.max_size and self._split(cluster):
+                oversized += [cluster, len(self.names) - 1]
+        return np.asarray(self.names)[self.assignment[start:]]
+
+    def _split(self, cluster, iterations=10):
+        # 2-means on the members of one cluster; the half closer to the old
+        # centroid keeps the label. Returns False if the members cannot be
+        # separated (all at the same spot).
+        members = np.flatnonzero(self.assignment == cluster)
+        points = self.index.points[members]
+        centres = points[self.rng.choice(len(points), 2, replace=False)]
+        side = None
+        for _ in range(iterations):
+            closer = ((points[:, None] - centres[None]) ** 2).sum(axis=2).argmin(1)
+            if side is not None and (closer == side).all():
+                break
+            side = closer
+            if side.min() == side.max():
+                return False
+            sizes = np.bincount(side, minlength=2)[:, None]
+            centres = (
+                np.column_stack(
+                    [
+                        np.bincount(side, weights=points[:, d], minlength=2)
+                        for d in (0, 1)
+                    ]
+                )
+                / sizes
+            )
+        keep = int(np.argmin(np.linalg.norm(centres - self.centroids[cluster], axis=1)))
+        moved = members[side != keep]
+
+        self.names.append(self._next_label)
+        self._next_label += 1
+        self._assignment[moved] = len(self.names) - 1
+        self.centroids[cluster] = centres[keep]
+        self.centroids = np.vstack([self.centroids, centres[1 - keep]])
+        self.counts[cluster] -= len(moved)
+        self.counts = np.append(self.counts, len(moved))
+        return True
+
+    def membership(self):
+        # Cluster -> bin ids, the same shape as Pipeline.clusters.read_membership
+        bin_ids = self.index.bin_ids
+        return {
+            name: bin_ids[self.assignment == cluster].tolist()
+            for cluster, name in enumerate(self.names)
+        }
+
+
+def neighbour_weights(neighbours, n):
+    # Row-stochastic (n x n) sparse matrix averaging each bin's neighbours
+    k = neighbours.shape[1]
+    rows = np.repeat(np.arange(n), k)
+    return sparse.csr_matrix(
+        (np.full(n * k, 1.0 / k), (rows, neighbours.ravel())), shape=(n, n)
+    )
+
+
+def neighbour_features(fullness, index, k=5, lags=(1,)):
+    # fullness is a (time x bin) frame with one column per bin in the index;
+    # returns one frame per lag with, for every bin and time, the mean of its
+    # k nearest bins' fullness `lag` readings earlier. Missing neighbour
+    # readings are left out of the mean rather than propagating NaN.
+    columns = pd.Index(index.bin_ids)
+    values = fullness.reindex(columns=columns).to_numpy(dtype=np.float64).T
+    observed = np.isfinite(values)
+    weights = neighbour_weights(index.neighbours(k), len(columns))
+    total = weights @ np.where(observed, values, 0.0)
+    count = weights @ observed.astype(np.float64)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = pd.DataFrame((total / count).T, index=fullness.index, columns=columns)
+    return {lag: mean.shift(lag) for lag in lags}
+
+
+def fullness_matrix(store, bin_ids, freq="D"):
+    # Last reading per bin in each period, one column per bin
+    return pd.DataFrame(
+        {
+            bin_id: store.series(bin_id).resample(freq).last()
+            for bin_id in bin_ids
+            if bin_id in store
+        }
+    )
+
+
+if __name__ == "__main__":
+    from Pipeline.bin_store import open_bin_store, open_cleaned_store
+
+    parser = argparse.ArgumentParser(description="Neighbour fullness features")
+    parser.add_argument("--locations", default="clusters_of_mumbai_dataset.csv")
+    parser.add_argument(
+        "--data", default=None, help="Build --store from this cleaned CSV instead"
+    )
+    parser.add_argument("--store", default="mumbai_store")
+    parser.add_argument("--freq", default="D")
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--lags", type=int, nargs="+", default=[1])
+    parser.add_argument("--output", default="neighbour_features.parquet")
+    args = parser.parse_args()
+
+    index = BinIndex.from_csv(args.locations)
+    if args.data:
+        store = open_bin_store(args.data, args.store, "mumbai")
+    else:
+        store = open_cleaned_store(args.store)
+    features = neighbour_features(
+        fullness_matrix(store, index.bin_ids, args.freq), index, args.k, args.lags
+    )
+    # Long format: one row per timestamp and bin, one column per lag
+    long = pd.concat(
+        {
+            f"neighbour_mean_lag{lag}": frame.stack(future_stack=True)
+            for lag, frame in features.items()
+        },
+        axis=1,
+    )
+    long.index.names = ["timestamp", "bin_id"]
+    long.reset_index().to_parquet(args.output, index=False)
+    print(f"{len(long)} rows of neighbour features exported to {args.output}")
@@ -0,0 +1,93 @@
+import numpy as np
+import tensorflow as tf
+from numpy.lib.stride_tricks import sliding_window_view
+
+# Training windows for the residual LSTMs. window_view() returns the
+# (n_windows, time_steps, 1) inputs and the targets as strided views over the
+# series, so nothing is copied. iter_window_batches() draws shuffled batches
+# across any number of bins and only ever materializes one batch;
+# window_dataset() wraps it in a tf.data pipeline that can go straight into
+# model.fit().
+
+
+def _as_series(series):
+    # Accepts pandas objects and (n, 1) scaler output as well as 1-D arrays
+    return np.ascontiguousarray(np.asarray(series, dtype=np.float32)).reshape(-1)
+
+
+def window_view(series, time_steps):
+    series = _as_series(series)
+    if len(series) <= time_steps:
+        raise ValueError(
+            f"Need more than {time_steps} values to build a window, got {len(series)}"
+        )
+    X = sliding_window_view(series[:-1], time_steps)[:, :, None]
+    y = series[time_steps:]
+    return X, y
+
+
+def iter_window_batches(
+    series_by_bin, time_steps, batch_size=256, group_ids=None, shuffle=True, seed=None
+):
+    # Windows are addressed by a flat index over all bins; a batch is gathered
+    # from the per-bin views by fancy indexing, which is the only copy made
+    views = [window_view(series, time_steps) for series in series_by_bin.values()]
+    counts = np.array([len(y) for _, y in views])
+    offsets = np.concatenate([[0], np.cumsum(counts)])
+    if group_ids is None:
+        group_ids = range(len(views))
+    groups = np.repeat(np.asarray(list(group_ids), dtype=np.int32), counts)
+
+    order = np.arange(offsets[-1])
+    if shuffle:
+        np.random.default_rng(seed).shuffle(order)
+
+    for start in range(0, len(order), batch_size):
+        index = order[start : start + batch_size]
+        bins = np.searchsorted(offsets, index, side="right") - 1
+        rows = index - offsets[bins]
+        X = np.empty((len(index), time_steps, 1), dtype=np.float32)
+        y = np.empty(len(index), dtype=np.float32)
+        for b in np.unique(bins):
+            mask = bins == b
+            X[mask] = views[b][0][rows[mask]]
+            y[mask] = views[b][1][rows[mask]]
+        yield X, groups[index], y
+
+
+def window_dataset(
+    series_by_bin,
+    time_steps,
+    batch_size=256,
+    group_ids=None,
+    with_groups=False,
+    shuffle=True,
+    seed=None,
+):
+    # The generator is re-run on every epoch, so the shuffle changes per epoch
+    # without keeping the shuffled windows around
+    rng = np.random.default_rng(seed)
+
+    def batches():
+        for X, groups, y in iter_window_batches(
+            series_by_bin,
+            time_steps,
+            batch_size,
+            group_ids,
+            shuffle,
+            rng.integers(2**32) if shuffle else None,
+        ):
+            yield ((X, groups), y) if with_groups else (X, y)
+
+    x_spec = tf.TensorSpec((None, time_steps, 1), tf.float32)
+    if with_groups:
+        x_spec = (x_spec, tf.TensorSpec((None,), tf.int32))
+    dataset = tf.data.Dataset.from_generator(
+        batches, output_signature=(x_spec, tf.TensorSpec((None,), tf.float32))
+    )
+    # Tell Keras how many batches an epoch has, since it cannot see through
+    # the generator
+    n_windows = sum(np.size(s) - time_steps for s in series_by_bin.values())
+    n_batches = -(-n_windows // batch_size)
+    dataset = dataset.apply(tf.data.experimental.assert_cardinality(n_batches))
+    return dataset.prefetch(tf.data.AUTOTUNE)